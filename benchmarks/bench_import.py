@@ -0,0 +1,67 @@
+"""
+Import-time benchmark for idiffuse
+
+Imports idiffuse in fresh interpreters and checks that the import stays fast and that
+pysynphot, matplotlib and pandas are only loaded on first use.
+
+EXAMPLE:
+    python benchmarks/bench_import.py --repeat 5 --max-seconds 0.5
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pysynphot','matplotlib','pandas']
+
+SNIPPET = """
+import json, sys, time
+t = time.time()
+import idiffuse
+dt = time.time() - t
+print(json.dumps({'seconds': dt, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def time_import(repeat=5):
+    """
+    Time `import idiffuse` in *repeat* fresh interpreters
+
+    OUTPUT:
+        dict with the median and minimum import time in seconds, and the heavy modules that were loaded
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH','')
+    times = []
+    loaded = set()
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable,'-c',SNIPPET],env=env,cwd=root)
+        res = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        times.append(res['seconds'])
+        loaded.update(res['loaded'])
+    times = sorted(times)
+    return {'median_seconds': times[len(times)//2],
+            'min_seconds': times[0],
+            'heavy_modules_loaded': sorted(loaded)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the import time of idiffuse')
+    parser.add_argument('--repeat',type=int,default=5,help='number of fresh interpreters to time')
+    parser.add_argument('--max-seconds',type=float,default=0.5,help='fail if the median import time is above this')
+    args = parser.parse_args(argv)
+
+    res = time_import(args.repeat)
+    print('import idiffuse: median {:0.3f}s, min {:0.3f}s'.format(res['median_seconds'],res['min_seconds']))
+    ok = True
+    if res['heavy_modules_loaded']:
+        print('FAIL: heavy modules loaded on import: {}'.format(', '.join(res['heavy_modules_loaded'])))
+        ok = False
+    if res['median_seconds'] > args.max_seconds:
+        print('FAIL: median import time above {:0.3f}s'.format(args.max_seconds))
+        ok = False
+    return 0 if ok else 1
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Benchmark suite for the idiffuse exposure time and noise calculators
+
+Measures, for both bundled telescope classes, both flux backends and every bundled filter:
+    - single-call latency of get_adu_per_sec, get_exptime_for_adu and get_err_cad_for_adu,
+      cold (empty count rate cache, i.e., including pysynphot) and warm
+    - batch throughput of get_err_cad_grid in rows/s
+    - peak memory (tracemalloc) of the cold call and of the batch call
+and the import time of idiffuse (see bench_import.py).
+
+Results are written as JSON, and can be compared against a stored baseline to catch slowdowns.
+
+EXAMPLE:
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json --tolerance 0.25
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import bench_import
+
+def _time_call(func,repeat,number=1):
+    """
+    Median and min time per call in seconds over *repeat* runs of *number* calls
+    """
+    times = sorted(t/number for t in timeit.repeat(func,repeat=repeat,number=number))
+    return times[len(times)//2], times[0]
+
+def _peak_memory(func):
+    """
+    Peak memory in MB allocated by Python during func()
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]/1e6
+    finally:
+        tracemalloc.stop()
+
+def run(repeat=5,batch_size=100000,filters=None,flux_backends=('pysynphot','numpy')):
+    """
+    Run the benchmarks
+
+    INPUT:
+        repeat     - number of repeats for each timing, the median is reported
+        batch_size - number of rows for the get_err_cad_grid() throughput benchmark
+        filters    - filter names to benchmark, default is all bundled filters except QE curves
+        flux_backends - flux backends to benchmark, see idiffuse.backends
+
+    OUTPUT:
+        dict of benchmark name -> {'value': ..., 'unit': ..., 'better': 'lower' or 'higher'}
+    """
+    import pysynphot # noqa: F401, keep the one-off pysynphot import out of the timings
+    import idiffuse
+    import idiffuse.sweep
+    if filters is None:
+        filters = idiffuse.sweep.default_filters()
+
+    results = {}
+    def add(name,value,unit,better='lower'):
+        results[name] = {'value': float(value), 'unit': unit, 'better': better}
+
+    imp = bench_import.time_import(repeat)
+    add('import/median',imp['median_seconds'],'s')
+
+    vegamag = np.random.RandomState(42).uniform(8.,16.,batch_size)
+    for cls in (idiffuse.TelescopeARC,idiffuse.TelescopePSUCDK24):
+        for flux_backend in flux_backends:
+            tel = cls()
+            tel.disk_cache = None
+            tel.flux_backend = flux_backend
+            for filter_name in filters:
+                bp = tel.get_bandpass(filter_name)
+                prefix = '{}/{}/{}/'.format(cls.__name__,flux_backend,filter_name)
+
+                def cold():
+                    tel.clear_zeropoint_cache()
+                    tel.get_adu_per_sec(12.,bp)
+                add(prefix+'get_adu_per_sec/cold',_time_call(cold,repeat)[0],'s')
+                add(prefix+'get_adu_per_sec/cold_peak_memory',_peak_memory(cold),'MB')
+                add(prefix+'get_adu_per_sec/warm',_time_call(lambda: tel.get_adu_per_sec(12.,bp),repeat,100)[0],'s')
+                add(prefix+'get_exptime_for_adu/warm',
+                    _time_call(lambda: tel.get_exptime_for_adu(12.,bp),repeat,100)[0],'s')
+
+                def err_cad_cold():
+                    tel.clear_zeropoint_cache()
+                    tel.get_err_cad_for_adu(12.,bp,verbose=False)
+                add(prefix+'get_err_cad_for_adu/cold',_time_call(err_cad_cold,repeat)[0],'s')
+                add(prefix+'get_err_cad_for_adu/warm',
+                    _time_call(lambda: tel.get_err_cad_for_adu(12.,bp,verbose=False),repeat,100)[0],'s')
+
+                batch = lambda: tel.get_err_cad_grid(bp,vegamag=vegamag,binning=2.,airmass=1.3)
+                add(prefix+'get_err_cad_grid/throughput',batch_size/_time_call(batch,repeat)[0],'rows/s','higher')
+                add(prefix+'get_err_cad_grid/peak_memory',_peak_memory(batch),'MB')
+    return results
+
+def compare(results,baseline,tolerance=0.25,min_seconds=1e-5):
+    """
+    Compare results against a baseline
+
+    INPUT:
+        results   - results from run()
+        baseline  - results from a previous run()
+        tolerance - allowed relative change in the worse direction, e.g., 0.25 for 25%
+        min_seconds - timings where both values are below this are not compared, as they are dominated by noise
+
+    OUTPUT:
+        list of (name, baseline value, new value, relative change) for benchmarks that regressed
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        new, old = results[name]['value'], baseline[name]['value']
+        if results[name]['unit']=='s' and max(new,old) < min_seconds:
+            continue
+        if old==0:
+            continue
+        change = (new-old)/old
+        worse = change > tolerance if results[name]['better']=='lower' else change < -tolerance
+        if worse:
+            regressions.append((name,old,new,change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the idiffuse benchmark suite')
+    parser.add_argument('--repeat',type=int,default=5,help='number of repeats per timing')
+    parser.add_argument('--batch-size',type=int,default=100000,help='rows in the batch throughput benchmark')
+    parser.add_argument('--filters',nargs='*',default=None,help='filters to benchmark, default is all bundled filters')
+    parser.add_argument('--flux-backends',nargs='*',default=['pysynphot','numpy'],help='flux backends to benchmark')
+    parser.add_argument('--output',default=None,help='write results to this JSON file')
+    parser.add_argument('--compare',default=None,help='compare against this baseline JSON file')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='allowed relative slowdown when comparing')
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore')
+    results = run(args.repeat,args.batch_size,args.filters,args.flux_backends)
+    for name in sorted(results):
+        print('{:70s} {:>14.6g} {}'.format(name,results[name]['value'],results[name]['unit']))
+
+    if args.output is not None:
+        meta = {'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.output,'w') as f:
+            json.dump({'meta': meta, 'results': results},f,indent=1,sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results,baseline,args.tolerance)
+        for name, old, new, change in regressions:
+            print('REGRESSION {}: {:0.6g} -> {:0.6g} ({:+0.1f}%)'.format(name,old,new,100*change))
+        if regressions:
+            return 1
+        print('No regressions against {}'.format(args.compare))
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
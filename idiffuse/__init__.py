@@ -1,6 +1,5 @@
 from __future__ import print_function
 import numpy as np
-import pandas as pd
 from .telescope import *
 from .photometry import *
 from .diffuser import *
@@ -0,0 +1,213 @@
+from __future__ import print_function
+import numpy as np
+import numbers
+import os
+
+# Vega spectrum bundled with idiffuse for the NumPy backend
+VEGA_FILENAME = os.path.join(os.path.dirname(__file__),'data','alpha_lyr_stis_010.txt')
+
+# Planck constant [erg s] and speed of light [Angstrom/s]
+H_ERG_S = 6.62607015e-27
+C_ANGSTROM_S = 2.99792458e18
+
+# Flux density of an AB=0 source [erg/s/cm2/Hz]
+AB_ZEROPOINT_FNU = 3631e-23
+
+def element_arrays(element):
+    """
+    Get the wavelength and throughput arrays of a spectral element
+
+    INPUT:
+        element - pysynphot spectral element, filter_registry.FilterCurve, anything else with .wave and .throughput
+                  attributes, or a number for a flat throughput
+
+    OUTPUT:
+        wave       - wavelength in Angstrom, None for a flat throughput
+        throughput - throughput array, or the flat throughput as a float
+    """
+    if isinstance(element,numbers.Number):
+        return None, float(element)
+    if element.wave is None:
+        return None, float(np.asarray(element.throughput).ravel()[0])
+    return np.asarray(element.wave,dtype=float), np.asarray(element.throughput,dtype=float)
+
+def combined_throughput(elements,wave):
+    """
+    Product of the throughputs of spectral elements on a wavelength grid
+
+    INPUT:
+        elements - list of spectral elements, see element_arrays()
+        wave     - wavelength grid in Angstrom
+
+    OUTPUT:
+        throughput array, the elements are linearly interpolated onto *wave* and are zero outside of their range
+    """
+    throughput = np.ones_like(wave,dtype=float)
+    for element in elements:
+        ewave, ethroughput = element_arrays(element)
+        if ewave is None:
+            throughput *= ethroughput
+        else:
+            throughput *= np.interp(wave,ewave,ethroughput,left=0.,right=0.)
+    return throughput
+
+def trapz(y,x):
+    """
+    Integral of y over x with the trapezoidal rule, along the last axis of y
+    """
+    y = np.asarray(y,dtype=float)
+    return np.sum(0.5*(y[...,1:]+y[...,:-1])*np.diff(x),axis=-1)
+
+
+class PysynphotBackend(object):
+    """
+    Flux backend using pysynphot, as in the original idiffuse calculations.
+
+    Renormalizes the pysynphot Vega spectrum to vegamag=0 in the combined bandpass and calculates the count rate of
+    an S.Observation binned on the Vega wavelength grid.
+    """
+    name = 'pysynphot'
+
+    def __repr__(self):
+        return '{}()'.format(self.__class__.__name__)
+
+    def _to_pysynphot(self,element):
+        import pysynphot as S
+        if isinstance(element,numbers.Number):
+            return S.UniformTransmission(element)
+        if hasattr(element,'to_pysynphot'):
+            return element.to_pysynphot()
+        return element
+
+    def cache_token(self):
+        """
+        Values the count rates depend on besides the spectral elements, used to key the disk cache
+        """
+        import pysynphot as S
+        return (S.refs.PRIMARY_AREA,os.path.basename(str(S.Vega)))
+
+    def countrate_per_cm2(self,elements):
+        """
+        Count rate in counts/s/cm2 of a vegamag=0 star through the product of the spectral elements
+
+        INPUT:
+            elements - list of spectral elements, e.g., [QE, Throughput, BandPass]
+        """
+        import pysynphot as S
+        CombinedBP = self._to_pysynphot(elements[0])
+        for element in elements[1:]:
+            CombinedBP = CombinedBP*self._to_pysynphot(element)
+        # Use Vega magnitudes
+        VegaSpectrum = S.Vega.renorm(0.,'vegamag',CombinedBP)
+        # Define observation
+        obs = S.Observation(VegaSpectrum, CombinedBP, binset=VegaSpectrum.GetWaveSet())
+        # pysynphot is automatically set up to calculate for Hubble, we just need to scale the area
+        return obs.countrate()/S.refs.PRIMARY_AREA
+
+
+class NumpyBackend(object):
+    """
+    Pure NumPy flux backend using the bundled Vega spectrum (CALSPEC alpha_lyr_stis_010).
+
+    All spectral elements are linearly interpolated onto the Vega wavelength grid (zero outside of their range),
+    multiplied, and the photon flux of Vega is integrated with the trapezoidal rule. By definition Vega has
+    vegamag=0 in every bandpass, so no renormalization is needed.
+
+    NOTES:
+        Agrees with the PysynphotBackend to better than 0.05% for the bundled filters and QE curve,
+        the difference comes from the trapezoidal integration vs the pysynphot binning.
+        Does not import pysynphot, also when given filter_registry.FilterCurve or numbers as elements.
+    """
+    name = 'numpy'
+
+    def __init__(self,vega_filename=VEGA_FILENAME):
+        """
+        INPUT:
+            vega_filename - two-column ASCII file with the Vega spectrum in Angstrom and erg/s/cm2/A
+        """
+        self.vega_filename = vega_filename
+        self._vega = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__,self.vega_filename)
+
+    @property
+    def vega(self):
+        """
+        Vega wavelength (Angstrom) and photon flux (photons/s/cm2/A), loaded on first use
+        """
+        if self._vega is None:
+            wave, flam = np.loadtxt(self.vega_filename,unpack=True)
+            self._vega = (wave,flam*wave/(H_ERG_S*C_ANGSTROM_S))
+        return self._vega
+
+    def cache_token(self):
+        """
+        Values the count rates depend on besides the spectral elements, used to key the disk cache
+        """
+        return (self.name,os.path.basename(self.vega_filename))
+
+    def photon_spectrum(self,elements):
+        """
+        Photon flux of Vega (vegamag=0) through the product of the spectral elements
+
+        INPUT:
+            elements - list of spectral elements, e.g., [QE, Throughput, BandPass], see element_arrays()
+
+        OUTPUT:
+            wave - Vega wavelength grid in Angstrom
+            flux - photons/s/cm2/A on the grid
+        """
+        wave, photlam = self.vega
+        return wave, photlam*combined_throughput(elements,wave)
+
+    def countrate_per_cm2(self,elements):
+        """
+        Count rate in counts/s/cm2 of a vegamag=0 star through the product of the spectral elements
+
+        INPUT:
+            elements - list of spectral elements, e.g., [QE, Throughput, BandPass], see element_arrays()
+        """
+        wave, y = self.photon_spectrum(elements)
+        return float(trapz(y,wave))
+
+def vega_ab_magnitude(elements):
+    """
+    AB magnitude of Vega (vegamag=0) through the product of spectral elements, from photon counts of the bundled
+    Vega spectrum and of a flat f_nu AB=0 spectrum
+
+    INPUT:
+        elements - list of spectral elements, e.g., [BandPass], see element_arrays()
+
+    OUTPUT:
+        AB magnitude of Vega, so vegamag = abmag - vega_ab_magnitude(elements), e.g., about 0.37 in Sloan i
+    """
+    backend = get_backend('numpy')
+    wave, vega = backend.photon_spectrum(elements)
+    # Photon flux of a flat f_nu spectrum is f_nu/(h*lambda) photons/s/cm2/A
+    ab = AB_ZEROPOINT_FNU/(H_ERG_S*wave)*combined_throughput(elements,wave)
+    return float(-2.5*np.log10(trapz(vega,wave)/trapz(ab,wave)))
+
+# Available backends by name, see get_backend()
+BACKENDS = {'pysynphot': PysynphotBackend,
+            'numpy': NumpyBackend}
+
+_INSTANCES = {}
+
+def get_backend(backend):
+    """
+    Get a flux backend instance
+
+    INPUT:
+        backend - name in BACKENDS ('pysynphot' or 'numpy'), or a backend instance which is returned as is
+
+    OUTPUT:
+        backend instance, shared between calls with the same name
+    """
+    if not isinstance(backend,str):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError('Unknown flux backend {}, available: {}'.format(backend,', '.join(sorted(BACKENDS))))
+    if backend not in _INSTANCES:
+        _INSTANCES[backend] = BACKENDS[backend]()
+    return _INSTANCES[backend]
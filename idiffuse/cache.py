@@ -0,0 +1,206 @@
+from __future__ import print_function
+import numpy as np
+import os
+import hashlib
+import numbers
+import sqlite3
+import threading
+import warnings
+import weakref
+
+def get_cache_dir():
+    """
+    Get the directory used for on-disk caches
+
+    OUTPUT:
+        path to the cache directory. Uses $IDIFFUSE_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/idiffuse,
+        falling back to ~/.cache/idiffuse
+
+    NOTES:
+        The directory is not created by this function
+    """
+    if os.environ.get('IDIFFUSE_CACHE_DIR'):
+        return os.environ['IDIFFUSE_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return os.path.join(base,'idiffuse')
+
+def disk_cache_enabled():
+    """
+    True if the on-disk caches (the zero point cache and the binary curve sidecars) are enabled, by setting the
+    environment variable IDIFFUSE_DISK_CACHE to a non-empty value other than 0
+    """
+    return os.environ.get('IDIFFUSE_DISK_CACHE','0') not in ('','0')
+
+# Memoized keys of spectral elements by id(element), see spectral_key(). Entries are dropped with their element
+_SPECTRAL_KEYS = {}
+
+def _forget_spectral_key(ref,element_id):
+    memo = _SPECTRAL_KEYS.get(element_id)
+    if memo is not None and memo[0] is ref:
+        del _SPECTRAL_KEYS[element_id]
+
+def _hash_spectral_element(element):
+    if element.wave is None:
+        return spectral_key(float(np.asarray(element.throughput).ravel()[0]))
+    h = hashlib.sha1(np.ascontiguousarray(element.wave,dtype=float).tobytes())
+    h.update(np.ascontiguousarray(element.throughput,dtype=float).tobytes())
+    return h.hexdigest()
+
+def spectral_key(element):
+    """
+    Hashable key describing the contents (wavelengths and throughput) of a spectral element
+
+    INPUT:
+        element - pysynphot spectral element, e.g., FileBandpass or UniformTransmission, a filter_registry.FilterCurve,
+                  or a number for a flat throughput
+
+    OUTPUT:
+        sha1 hex digest of the wavelength and throughput arrays
+
+    NOTES:
+        Only the contents are hashed, so e.g. a FilterCurve and the pysynphot.ArrayBandpass made from it,
+        or a number and a UniformTransmission with that value, have the same key.
+        The key of each element object is memoized (with a weak reference), so repeated calls with the same
+        object do not re-hash the curve. Elements are assumed not to be modified in place after their first use.
+    """
+    if isinstance(element,numbers.Number):
+        return hashlib.sha1('flat|{!r}'.format(float(element)).encode('utf-8')).hexdigest()
+    element_id = id(element)
+    memo = _SPECTRAL_KEYS.get(element_id)
+    if memo is not None and memo[0]() is element:
+        return memo[1]
+    key = _hash_spectral_element(element)
+    try:
+        ref = weakref.ref(element,lambda ref: _forget_spectral_key(ref,element_id))
+    except TypeError:
+        return key
+    _SPECTRAL_KEYS[element_id] = (ref,key)
+    return key
+
+def hash_key(*parts):
+    """
+    Combine several key parts (strings or numbers) into a single sha1 hex digest
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ZeroPointDiskCache(object):
+    """
+    SQLite store of bandpass count rates that is shared between processes and sessions.
+
+    Values are stored under a string key, see Telescope._get_adu_per_sec_zeropoint() for how keys are built.
+
+    EXAMPLE:
+        import idiffuse
+        idiffuse.Telescope.disk_cache = idiffuse.cache.ZeroPointDiskCache()
+
+    NOTES:
+        Set the environment variable IDIFFUSE_DISK_CACHE=1 to enable the cache for all Telescope instances
+        on import, see default_disk_cache(). If the cache file cannot be opened or written, a warning is
+        issued and the cache is disabled, so calculations continue without it.
+    """
+    def __init__(self,filename=None):
+        """
+        INPUT:
+            filename - path to the SQLite file, default is zeropoints.sqlite in get_cache_dir()
+        """
+        if filename is None:
+            filename = os.path.join(get_cache_dir(),'zeropoints.sqlite')
+        self.filename = filename
+        self.enabled = True
+        self._local = threading.local()
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__,self.filename)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        # SQLite connections can only be used in the thread that opened them and are not shared across fork(),
+        # so keep one connection per thread and reconnect in child processes
+        local = self._local
+        if getattr(local,'conn',None) is None or local.pid != os.getpid():
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.filename,timeout=30.)
+            conn.execute('CREATE TABLE IF NOT EXISTS zeropoints (key TEXT PRIMARY KEY, value REAL)')
+            conn.commit()
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def _disable(self,error):
+        warnings.warn('Disabling idiffuse disk cache {}: {}'.format(self.filename,error))
+        self.enabled = False
+
+    def get(self,key):
+        """
+        Get a cached value, returns None if not found
+        """
+        if not self.enabled:
+            return None
+        try:
+            row = self._connect().execute('SELECT value FROM zeropoints WHERE key=?',(key,)).fetchone()
+        except (sqlite3.Error,OSError) as e:
+            self._disable(e)
+            return None
+        return None if row is None else row[0]
+
+    def set(self,key,value):
+        """
+        Store a value under *key*, replacing any previous value
+        """
+        if not self.enabled:
+            return
+        try:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO zeropoints (key, value) VALUES (?,?)',(key,float(value)))
+            conn.commit()
+        except (sqlite3.Error,OSError) as e:
+            self._disable(e)
+
+    def clear(self):
+        """
+        Remove all cached values
+        """
+        if not self.enabled:
+            return
+        try:
+            conn = self._connect()
+            conn.execute('DELETE FROM zeropoints')
+            conn.commit()
+        except (sqlite3.Error,OSError) as e:
+            self._disable(e)
+
+    def __len__(self):
+        if not self.enabled:
+            return 0
+        try:
+            return self._connect().execute('SELECT COUNT(*) FROM zeropoints').fetchone()[0]
+        except (sqlite3.Error,OSError) as e:
+            self._disable(e)
+            return 0
+
+def default_disk_cache():
+    """
+    Get the default disk cache for Telescope instances
+
+    OUTPUT:
+        ZeroPointDiskCache() if the environment variable IDIFFUSE_DISK_CACHE is set to a non-empty value
+        other than 0, otherwise None
+    """
+    if disk_cache_enabled():
+        return ZeroPointDiskCache()
+    return None
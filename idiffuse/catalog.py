@@ -0,0 +1,340 @@
+from __future__ import print_function
+import numpy as np
+import argparse
+import os
+import sys
+import time
+import idiffuse.telescope as telescope
+import idiffuse.backends as backends
+import idiffuse.filter_registry as filter_registry
+import idiffuse.instruments as instruments
+from idiffuse.telescope import ERR_CAD_DEFAULTS
+
+# Common catalog magnitude columns, with the bundled filter they correspond to and their magnitude system. Johnson-Cousins
+# magnitudes (e.g., APASS/TIC Vmag) are Vega, SDSS-like ugriz magnitudes (SDSS, APASS, Pan-STARRS, TIC) are AB
+MAG_COLUMNS = {'Umag': ('bess-u.txt','vega'),
+               'Bmag': ('bess-b.txt','vega'),
+               'Vmag': ('bess-v.txt','vega'),
+               'Rmag': ('bess-r.txt','vega'),
+               'Imag': ('bess-i.txt','vega'),
+               'gmag': ('sloan_g_filter.txt','AB'),
+               'rmag': ('sloan_r_filter.txt','AB'),
+               'imag': ('sloan_i_filter.txt','AB'),
+               'zmag': ('sloan_z_filter.txt','AB')}
+
+# Gaia G magnitude columns and their BP and RP columns (Gaia archive and TIC names)
+GAIA_COLUMNS = {'phot_g_mean_mag': ('phot_bp_mean_mag','phot_rp_mean_mag'),
+                'GAIAmag': ('gaiabp','gaiarp')}
+
+# Gaia (E)DR3 photometric relations of Riello et al. (2021), G - mag = sum(c_i*(BP-RP)**i), with the magnitude system
+# of the result. Applied for -0.5 < BP-RP < 2.75, NaN outside
+GAIA_TRANSFORMATIONS = {'bess-v.txt': ((-0.02704,0.01424,-0.2156,0.01426),'vega'),
+                        'bess-r.txt': ((-0.02275,0.3961,-0.1243,-0.01396,0.003775),'vega'),
+                        'bess-i.txt': ((0.01753,0.76,-0.0991),'vega'),
+                        'sloan_g_filter.txt': ((0.2199,-0.6365,-0.1548,0.0064),'AB'),
+                        'sloan_r_filter.txt': ((-0.09837,0.08592,0.1907,-0.1701,0.02263),'AB'),
+                        'sloan_i_filter.txt': ((-0.293,0.6404,-0.09609,-0.002104),'AB')}
+GAIA_COLOR_RANGE = (-0.5,2.75)
+
+# Magnitude systems, see to_vegamag()
+MAG_SYSTEMS = ('vega','AB')
+
+# Output columns of Telescope.get_err_cad_grid() written to the output catalog
+OUTPUT_COLUMNS = ['exptime','cadence','efficiency','photometric_noise','photon_noise','scint_noise',
+                  'tot_noise','tot_noise_in_1_min','tot_noise_in_30_min']
+
+_VEGA_AB_MAGNITUDES = {}
+
+def find_mag_column(columns,filter_name):
+    """
+    Find the catalog magnitude column for a filter
+
+    INPUT:
+        columns     - catalog column names
+        filter_name - filter name in Telescope.FILTER_DICT
+
+    OUTPUT:
+        name of the first column in MAG_COLUMNS that matches the filter, otherwise a Gaia G column (see GAIA_COLUMNS)
+        if the catalog has Gaia photometry and GAIA_TRANSFORMATIONS has the filter, otherwise 'vegamag' if present
+
+    NOTES:
+        Raises a ValueError if no matching column is found. TESS magnitudes (TIC Tmag) have no bundled bandpass, use
+        the TIC Gaia or ugriz/BVRI columns instead
+    """
+    columns = list(columns)
+    for column in columns:
+        if column in MAG_COLUMNS and MAG_COLUMNS[column][0]==filter_name:
+            return column
+    if filter_name in GAIA_TRANSFORMATIONS:
+        for column, (bp, rp) in GAIA_COLUMNS.items():
+            if column in columns and (('bp_rp' in columns) or (bp in columns and rp in columns)):
+                return column
+    if 'vegamag' in columns:
+        return 'vegamag'
+    raise ValueError('No magnitude column for {} in the catalog, pass mag_column. Known columns: {}'.format(
+        filter_name,', '.join(sorted([c for c,(f,system) in MAG_COLUMNS.items() if f==filter_name]+
+                                     (list(GAIA_COLUMNS) if filter_name in GAIA_TRANSFORMATIONS else [])))))
+
+def get_mag_system(column):
+    """
+    Magnitude system of a known catalog column: 'vega' for vegamag and Gaia columns, see MAG_COLUMNS otherwise.
+    Returns None for unknown columns
+    """
+    if column in MAG_COLUMNS:
+        return MAG_COLUMNS[column][1]
+    if column=='vegamag' or column in GAIA_COLUMNS:
+        return 'vega'
+    return None
+
+def to_vegamag(mag,filter_name,mag_system):
+    """
+    Convert magnitudes in a bundled filter to Vega magnitudes
+
+    INPUT:
+        mag         - magnitudes, float or array
+        filter_name - filter name in Telescope.FILTER_DICT
+        mag_system  - 'vega' or 'AB'
+
+    OUTPUT:
+        Vega magnitudes. AB magnitudes are shifted by the AB magnitude of Vega in the filter, calculated once per filter
+        with backends.vega_ab_magnitude()
+    """
+    if mag_system not in MAG_SYSTEMS:
+        raise ValueError("mag_system has to be one of {}, got {!r}".format(', '.join(MAG_SYSTEMS),mag_system))
+    mag = np.asarray(mag,dtype=float)
+    if mag_system=='vega':
+        return mag
+    offset = _VEGA_AB_MAGNITUDES.get(filter_name)
+    if offset is None:
+        offset = backends.vega_ab_magnitude([filter_registry.registry.get_curve(filter_name)])
+        _VEGA_AB_MAGNITUDES[filter_name] = offset
+    return mag - offset
+
+def catalog_vegamag(catalog,filter_name,mag_column=None,mag_system=None):
+    """
+    Vega magnitudes of catalog rows in a bundled filter
+
+    INPUT:
+        catalog     - pandas.DataFrame
+        filter_name - filter name in Telescope.FILTER_DICT
+        mag_column  - magnitude column, default is found with find_mag_column(). Gaia G columns (GAIA_COLUMNS) are
+                      transformed to the filter with the BP-RP color, see GAIA_TRANSFORMATIONS
+        mag_system  - 'vega' or 'AB', the magnitude system of mag_column. Default is the system of a known column
+                      (see get_mag_system()), and has to be given for other columns. Not used for Gaia columns
+
+    OUTPUT:
+        array of Vega magnitudes in the filter
+    """
+    if mag_column is None:
+        mag_column = find_mag_column(catalog.columns,filter_name)
+    mag = catalog[mag_column].values.astype(float)
+    if mag_column in GAIA_COLUMNS:
+        if filter_name not in GAIA_TRANSFORMATIONS:
+            raise ValueError('No Gaia transformation to {}, available: {}'.format(
+                filter_name,', '.join(sorted(GAIA_TRANSFORMATIONS))))
+        bp, rp = GAIA_COLUMNS[mag_column]
+        if 'bp_rp' in catalog:
+            color = catalog['bp_rp'].values.astype(float)
+        else:
+            color = catalog[bp].values.astype(float)-catalog[rp].values.astype(float)
+        coeffs, mag_system = GAIA_TRANSFORMATIONS[filter_name]
+        with np.errstate(invalid='ignore'):
+            valid = (color>GAIA_COLOR_RANGE[0]) & (color<GAIA_COLOR_RANGE[1])
+        mag = np.where(valid,mag-np.polynomial.polynomial.polyval(color,coeffs),np.nan)
+    if mag_system is None:
+        mag_system = get_mag_system(mag_column)
+        if mag_system is None:
+            raise ValueError("The magnitude system of column {} is unknown, pass mag_system ('vega' or 'AB')".format(
+                mag_column))
+    return to_vegamag(mag,filter_name,mag_system)
+
+def get_telescope(tel,flux_backend=None):
+    """
+    Get a Telescope instance
+
+    INPUT:
+        tel          - Telescope instance, name of an instrument in idiffuse.instruments.registry (e.g., 'arc'),
+                       or name of a Telescope subclass in idiffuse.telescope (e.g., 'TelescopeARC')
+        flux_backend - flux backend to use, see idiffuse.backends. Default is 'pysynphot' for registry instruments,
+                       and the backend of the instance or class otherwise
+
+    OUTPUT:
+        Telescope instance. Registry instruments are the shared, frozen instances. If flux_backend differs from
+        the backend of a given instance, a copy with the backend is returned, see Telescope.with_params()
+    """
+    if isinstance(tel,str):
+        if tel in instruments.registry:
+            return instruments.get_instrument(tel,flux_backend or 'pysynphot')
+        cls = getattr(telescope,tel,None)
+        if not (isinstance(cls,type) and issubclass(cls,telescope.Telescope)) or cls is telescope.Telescope:
+            raise ValueError('Unknown telescope {}, use an instrument ({}) or a Telescope subclass in idiffuse.telescope'.format(
+                tel,', '.join(instruments.registry.names())))
+        tel = cls()
+    if flux_backend is not None and flux_backend!=tel.flux_backend:
+        # Copy, so frozen (registry) instances and the caller's instance are not changed
+        tel = tel.with_params(flux_backend=flux_backend)
+    return tel
+
+def _read_chunks(filename,chunksize):
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+        for chunk in pd.read_csv(filename,chunksize=chunksize):
+            yield chunk
+
+
+class _ChunkWriter(object):
+    """
+    Append DataFrame chunks to a CSV or Parquet file
+
+    Chunks are written to a temporary file, which is renamed to *filename* by close() and removed by abort(),
+    so a failed run does not leave a partial output behind
+    """
+    def __init__(self,filename):
+        self.filename = filename
+        self._tmpname = filename+'.{}.tmp'.format(os.getpid())
+        self._writer = None
+        self._first = True
+
+    def write(self,df):
+        if self.filename.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df,preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._tmpname,table.schema)
+            elif not table.schema.equals(self._writer.schema):
+                # pandas infers the dtypes of each CSV chunk separately, e.g., an all-null string column
+                try:
+                    table = table.cast(self._writer.schema)
+                except (pa.ArrowInvalid,pa.ArrowNotImplementedError,ValueError) as e:
+                    raise ValueError('Catalog column types changed between chunks ({}), use a larger chunksize or '
+                                     'a Parquet input'.format(e))
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self._tmpname,mode='w' if self._first else 'a',header=self._first,index=False)
+        self._first = False
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        self._close_writer()
+        if not self._first:
+            os.rename(self._tmpname,self.filename)
+
+    def abort(self):
+        self._close_writer()
+        if os.path.exists(self._tmpname):
+            os.remove(self._tmpname)
+
+def process_catalog(input_filename,
+                    output_filename,
+                    tel='TelescopeARC',
+                    filter_name='sloan_i_filter.txt',
+                    mag_column=None,
+                    mag_system=None,
+                    chunksize=100000,
+                    keep_columns=None,
+                    verbose=True,
+                    **kwargs):
+    """
+    Stream a catalog through the precision calculator and write exptime/cadence/noise columns.
+
+    The catalog is read and written in chunks, so memory use is set by *chunksize*, not by the catalog size.
+    Each chunk is evaluated with one vectorized Telescope.get_err_cad_grid() call.
+
+    INPUT:
+        input_filename  - CSV or Parquet (.parquet) catalog
+        output_filename - CSV or Parquet (.parquet) output file, overwritten
+        tel             - Telescope instance, instrument name or name of a Telescope class, see get_telescope()
+        filter_name     - filter name in Telescope.FILTER_DICT
+        mag_column      - catalog column with the magnitude in *filter_name*, default is found from MAG_COLUMNS
+                          and GAIA_COLUMNS, see find_mag_column()
+        mag_system      - 'vega' or 'AB', magnitude system of mag_column. Default is the system of a known column,
+                          e.g., AB for imag, and has to be given for other columns, see catalog_vegamag()
+        chunksize       - number of rows per chunk
+        keep_columns    - catalog columns to copy to the output, default is all
+        verbose         - if True, print progress and the throughput at the end
+        **kwargs        - parameters of Telescope.get_err_cad_for_adu() applied to all rows. Catalog columns with
+                          these names (e.g., airmass) are used per row if not given here
+
+    OUTPUT:
+        dictionary with the number of rows, elapsed time in s and throughput in rows/s
+
+    EXAMPLE:
+        process_catalog('targets.csv','targets_precision.parquet',tel='TelescopeARC',filter_name='sloan_i_filter.txt',
+                        binning=2,max_adu_per_pixel=30000.)
+    """
+    tel = get_telescope(tel)
+    bp = tel.get_bandpass(filter_name)
+    writer = _ChunkWriter(output_filename)
+    nrows = 0
+    t_start = time.time()
+    try:
+        for chunk in _read_chunks(input_filename,chunksize):
+            if mag_column is None:
+                mag_column = find_mag_column(chunk.columns,filter_name)
+            params = dict((key,chunk[key].values) for key in ERR_CAD_DEFAULTS if key in chunk)
+            params['vegamag'] = catalog_vegamag(chunk,filter_name,mag_column,mag_system)
+            params.update(kwargs)
+            res = tel.get_err_cad_grid(bp,output='records',**params)
+            out = chunk if keep_columns is None else chunk[list(keep_columns)]
+            out = out.reset_index(drop=True)
+            for key in OUTPUT_COLUMNS:
+                out[key] = res[key]
+            writer.write(out)
+            nrows += len(chunk)
+            if verbose:
+                sys.stderr.write('\rProcessed {} rows'.format(nrows))
+                sys.stderr.flush()
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    elapsed = time.time()-t_start
+    stats = {'rows': nrows, 'seconds': elapsed, 'rows_per_second': nrows/elapsed if elapsed>0 else np.inf}
+    if verbose:
+        sys.stderr.write('\n')
+        print('Processed {} rows in {:0.2f}s ({:0.0f} rows/s)'.format(nrows,elapsed,stats['rows_per_second']))
+    return stats
+
+def main(argv=None):
+    """
+    Console script entry point, see `idiffuse-catalog --help`
+    """
+    parser = argparse.ArgumentParser(description='Calculate diffuser-assisted exposure times, cadences and precisions for a catalog')
+    parser.add_argument('input',help='input catalog, CSV or .parquet')
+    parser.add_argument('output',help='output catalog, CSV or .parquet')
+    parser.add_argument('--telescope',default='TelescopeARC',help='instrument in idiffuse.instruments (e.g., arc) or Telescope class in idiffuse.telescope')
+    parser.add_argument('--filter',default='sloan_i_filter.txt',help='filter name in Telescope.FILTER_DICT')
+    parser.add_argument('--mag-column',default=None,help='magnitude column, default is found from the filter')
+    parser.add_argument('--mag-system',default=None,choices=MAG_SYSTEMS,
+                        help='magnitude system of --mag-column, default is the system of known columns (e.g., AB for imag)')
+    parser.add_argument('--chunksize',type=int,default=100000,help='rows per chunk')
+    parser.add_argument('--flux-backend',default=None,help="flux backend, 'pysynphot' or 'numpy'")
+    for key, default in ERR_CAD_DEFAULTS.items():
+        if key!='vegamag':
+            parser.add_argument('--'+key.replace('_','-'),type=float,default=None,
+                                help='default: catalog column {} if present, otherwise {}'.format(key,default))
+    args = parser.parse_args(argv)
+
+    tel = get_telescope(args.telescope,args.flux_backend)
+    kwargs = dict((key,getattr(args,key)) for key in ERR_CAD_DEFAULTS
+                  if key!='vegamag' and getattr(args,key) is not None)
+    if not os.path.exists(args.input):
+        parser.error('{} does not exist'.format(args.input))
+    try:
+        process_catalog(args.input,args.output,tel=tel,filter_name=args.filter,mag_column=args.mag_column,
+                        mag_system=args.mag_system,chunksize=args.chunksize,**kwargs)
+    except (ValueError,KeyError) as e:
+        parser.error(str(e).strip("'"))
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
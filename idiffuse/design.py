@@ -0,0 +1,299 @@
+from __future__ import print_function
+import numpy as np
+import glob
+import os
+import time
+import uuid
+from idiffuse.telescope import ERR_CAD_DEFAULTS
+from idiffuse.catalog import get_telescope
+from idiffuse.sweep import default_filters, pool_imap
+
+# Telescope parameters that can be explored, changed with Telescope.with_params()
+DESIGN_TELESCOPE_PARAMS = ('diffuser_angle','diffuser_dist_from_detector','pix_size','plt_scale','read_noise',
+                           'dark_noise','gain','diameter','central_obstruction')
+
+# Observation parameters that can be explored, see Telescope.get_err_cad_for_adu()
+DESIGN_OBSERVATION_PARAMS = tuple(ERR_CAD_DEFAULTS)
+
+# Columns that identify a design point in the store
+PARAM_COLUMNS = ('telescope','filter') + DESIGN_TELESCOPE_PARAMS + DESIGN_OBSERVATION_PARAMS
+
+# Parameter values are rounded to this many decimals, so equal values from e.g. np.arange and np.linspace match
+PARAM_DECIMALS = 10
+
+# Per-worker state, set up once per process by _init_worker()
+_WORKER = {}
+
+
+class ResultStore(object):
+    """
+    Appendable columnar store of design exploration results, one row per design point.
+
+    Parquet stores are directories with one file per appended batch, HDF5 stores (.h5/.hdf5) are a single
+    table with the parameter columns (PARAM_COLUMNS) as indexed data columns.
+
+    EXAMPLE:
+        store = ResultStore('arc_design.parquet')
+        df = store.read(columns=['diffuser_angle','tot_noise_in_30_min'])
+        front = store.pareto('tot_noise_in_30_min','efficiency',minimize=(True,False),by=['telescope','filter'])
+
+    NOTES:
+        Parquet needs pyarrow (pip install idiffuse[parquet]), HDF5 needs PyTables
+    """
+    def __init__(self,path):
+        """
+        INPUT:
+            path - directory for a Parquet store, or a .h5/.hdf5 file for an HDF5 store
+        """
+        self.path = path
+        self.format = 'hdf5' if os.path.splitext(path)[1].lower() in ('.h5','.hdf5') else 'parquet'
+
+    def __repr__(self):
+        return 'ResultStore({!r}, format={!r})'.format(self.path,self.format)
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path,'part-*.parquet')))
+
+    def exists(self):
+        """
+        True if any results have been stored
+        """
+        if self.format=='hdf5':
+            return os.path.exists(self.path)
+        return len(self._parts()) > 0
+
+    def __len__(self):
+        if not self.exists():
+            return 0
+        if self.format=='hdf5':
+            import pandas as pd
+            with pd.HDFStore(self.path,mode='r') as store:
+                return store.get_storer('results').nrows
+        import pyarrow.parquet as pq
+        return sum(pq.ParquetFile(part).metadata.num_rows for part in self._parts())
+
+    def append(self,df):
+        """
+        Append a DataFrame of results with the same columns as the existing results
+        """
+        if len(df)==0:
+            return
+        if self.format=='hdf5':
+            import pandas as pd
+            with pd.HDFStore(self.path,mode='a') as store:
+                store.append('results',df,format='table',data_columns=list(PARAM_COLUMNS),index=False,
+                             min_itemsize={'telescope': 64, 'filter': 128})
+        else:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            # Write to a temporary name first, so readers never see partial files
+            filename = os.path.join(self.path,'part-{:05d}-{}.parquet'.format(len(self._parts()),uuid.uuid4().hex[:8]))
+            df.to_parquet(filename+'.tmp',index=False)
+            os.rename(filename+'.tmp',filename)
+
+    def read(self,columns=None,query=None):
+        """
+        Read results
+
+        INPUT:
+            columns - columns to read, default is all. Only these columns are read from disk
+            query   - pandas.DataFrame.query() expression to select rows, e.g., "telescope=='arc' and binning==2"
+
+        OUTPUT:
+            pandas.DataFrame
+        """
+        import pandas as pd
+        if not self.exists():
+            return pd.DataFrame(columns=list(columns) if columns is not None else list(PARAM_COLUMNS))
+        if self.format=='hdf5':
+            df = pd.read_hdf(self.path,'results',columns=None if columns is None else list(columns))
+        else:
+            df = pd.concat([pd.read_parquet(part,columns=None if columns is None else list(columns))
+                            for part in self._parts()],ignore_index=True)
+        if query is not None:
+            df = df.query(query)
+        return df.reset_index(drop=True)
+
+    def pareto(self,x='tot_noise_in_30_min',y='efficiency',minimize=(True,False),by=None,query=None,columns=None):
+        """
+        Get the Pareto front of two objectives, e.g., precision vs duty cycle
+
+        INPUT:
+            x, y     - objective columns
+            minimize - for each objective, True if lower is better, False if higher is better
+            by       - columns to find separate fronts for, e.g., ['telescope','filter']
+            query    - select rows before finding the front, see read()
+            columns  - additional columns to return, default is all columns
+
+        OUTPUT:
+            pandas.DataFrame with the non-dominated rows, sorted by *by* and *x*
+        """
+        by = [] if by is None else list(by)
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns)+[x,y]+by))
+        df = self.read(columns=columns,query=query)
+        return pareto_front(df,x,y,minimize,by)
+
+def pareto_front(df,x,y,minimize=(True,False),by=None):
+    """
+    Non-dominated rows of a DataFrame for two objectives, see ResultStore.pareto()
+    """
+    by = [] if by is None else list(by)
+    if len(df)==0:
+        return df
+    sx = 1. if minimize[0] else -1.
+    sy = 1. if minimize[1] else -1.
+    ox = sx*df[x].values
+    oy = sy*df[y].values
+    # Sort by x (ties broken by y), a row is on the front if its y beats every row before it within its group
+    groups = [df[col].values for col in reversed(by)]
+    order = np.lexsort([oy,ox]+groups)
+    if by:
+        keys = df[by].iloc[order]
+        new_group = np.ones(len(order),dtype=bool)
+        new_group[1:] = (keys.values[1:]!=keys.values[:-1]).any(axis=1)
+        group_id = np.cumsum(new_group)-1
+    else:
+        group_id = np.zeros(len(order),dtype=int)
+    oy_sorted = oy[order]
+    keep = np.zeros(len(order),dtype=bool)
+    best = np.inf
+    for i in range(len(order)):
+        if i==0 or group_id[i]!=group_id[i-1]:
+            best = np.inf
+        if oy_sorted[i] < best:
+            keep[i] = True
+            best = oy_sorted[i]
+    return df.iloc[order[keep]].reset_index(drop=True)
+
+def _init_worker(flux_backend):
+    _WORKER['flux_backend'] = flux_backend
+    _WORKER['telescopes'] = {}
+
+def _get_base_telescope(name,flux_backend):
+    tel = _WORKER.setdefault('telescopes',{}).get(name)
+    if tel is None:
+        tel = get_telescope(name,flux_backend)
+        _WORKER['telescopes'][name] = tel
+    return tel
+
+def _run_chunk(chunk):
+    """
+    Evaluate a chunk of design points, grouped so each telescope variant needs one get_err_cad_grid() call
+    """
+    import pandas as pd
+    flux_backend = _WORKER.get('flux_backend','pysynphot')
+    results = []
+    group_columns = ['telescope','filter']+list(DESIGN_TELESCOPE_PARAMS)
+    for key, rows in chunk.groupby(group_columns,sort=False):
+        base = _get_base_telescope(key[0],flux_backend)
+        tel = base.with_params(**dict(zip(DESIGN_TELESCOPE_PARAMS,key[2:])))
+        r = tel.get_err_cad_grid(tel.get_bandpass(key[1]),params=rows[list(DESIGN_OBSERVATION_PARAMS)],output='records')
+        out = rows.copy()
+        out['diffuser_fwhm_pix'] = tel.diffuser_fwhm_pix
+        for name in r.dtype.names:
+            if name not in DESIGN_OBSERVATION_PARAMS:
+                out[name] = r[name]
+        results.append(out)
+    return pd.concat(results)
+
+def design_grid(telescopes=('arc','psu_cdk24'),filters=None,flux_backend='pysynphot',**params):
+    """
+    Cartesian product of design parameters, with the parameters that are not explored set to the telescope values
+    and the get_err_cad_for_adu() defaults
+
+    INPUT:
+        see explore()
+
+    OUTPUT:
+        pandas.DataFrame with the PARAM_COLUMNS, one row per design point. Values are rounded to PARAM_DECIMALS
+    """
+    import pandas as pd
+    unknown = set(params) - set(DESIGN_TELESCOPE_PARAMS) - set(DESIGN_OBSERVATION_PARAMS)
+    if unknown:
+        raise TypeError('Unknown design parameters: {}, available: {}'.format(
+            ', '.join(sorted(unknown)),', '.join(DESIGN_TELESCOPE_PARAMS+DESIGN_OBSERVATION_PARAMS)))
+    if 'vegamag' not in params:
+        raise ValueError('vegamag has to be given')
+    if filters is None:
+        filters = default_filters()
+    params = dict((key,np.unique(np.round(np.atleast_1d(np.asarray(value,dtype=float)),PARAM_DECIMALS)))
+                  for key,value in params.items())
+    frames = []
+    for tel_name in telescopes:
+        tel = get_telescope(tel_name,flux_backend)
+        axes = []
+        for key in DESIGN_TELESCOPE_PARAMS:
+            axes.append(params.get(key,[round(float(getattr(tel,key)),PARAM_DECIMALS)]))
+        for key in DESIGN_OBSERVATION_PARAMS:
+            axes.append(params.get(key,[ERR_CAD_DEFAULTS[key]]))
+        for filter_name in filters:
+            mesh = np.meshgrid(*axes,indexing='ij')
+            df = pd.DataFrame(dict((key,m.ravel()) for key,m in zip(PARAM_COLUMNS[2:],mesh)))
+            df.insert(0,'filter',filter_name)
+            df.insert(0,'telescope',tel_name)
+            frames.append(df)
+    return pd.concat(frames,ignore_index=True)[list(PARAM_COLUMNS)]
+
+def explore(store,
+            telescopes=('arc','psu_cdk24'),
+            filters=None,
+            processes=None,
+            chunksize=5000,
+            flux_backend='pysynphot',
+            progress=True,
+            **params):
+    """
+    Evaluate the precision/cadence model over a grid of diffuser, detector and observation parameters in parallel,
+    and append the results to a ResultStore.
+
+    Design points already in the store are skipped, so re-running with extended ranges only computes the new points.
+
+    INPUT:
+        store        - ResultStore, or a path (directory for Parquet, .h5/.hdf5 for HDF5)
+        telescopes   - instruments in idiffuse.instruments.registry or Telescope class names, e.g., ('arc','psu_cdk24')
+        filters      - filter names, default is all bundled filters except QE curves
+        processes    - number of worker processes, default is the number of CPUs. If 1, run in this process
+        chunksize    - number of design points per task, and per appended batch
+        flux_backend - flux backend, see idiffuse.backends
+        progress     - if True, print progress to stderr. Can also be a callable progress(done,total)
+        **params     - ranges (sequences) or values of DESIGN_TELESCOPE_PARAMS (diffuser_angle, pix_size, read_noise,
+                       gain, plt_scale, ...) and DESIGN_OBSERVATION_PARAMS (vegamag, binning, ...). vegamag has to be
+                       given. Parameters not given take the telescope values and the get_err_cad_for_adu() defaults
+
+    OUTPUT:
+        dictionary with the number of design points, the number computed and skipped, and the elapsed time in s
+
+    NOTES:
+        Telescope variants are made with Telescope.with_params(), so each worker parses curves and calculates count
+        rates once per (telescope, filter). The store gets the parameter columns, diffuser_fwhm_pix and the outputs of
+        Telescope.get_err_cad_grid() (exptime, cadence, efficiency (duty cycle), noise terms, ...).
+
+    EXAMPLE:
+        explore('diffuser_study.parquet',filters=['sloan_i_filter.txt'],diffuser_angle=np.arange(0.1,1.01,0.05),
+                pix_size=[9.,13.5,15.],read_noise=[3.,5.,8.],binning=[1,2,4],vegamag=np.arange(8.,15.,0.5))
+        front = ResultStore('diffuser_study.parquet').pareto('tot_noise_in_30_min','efficiency',minimize=(True,False),
+                                                             by=['telescope','filter'])
+    """
+    if not isinstance(store,ResultStore):
+        store = ResultStore(store)
+    t_start = time.time()
+    grid = design_grid(telescopes,filters,flux_backend,**params)
+    npoints = len(grid)
+    if store.exists():
+        done = store.read(columns=PARAM_COLUMNS)
+        float_columns = list(PARAM_COLUMNS[2:])
+        done[float_columns] = done[float_columns].astype(float).round(PARAM_DECIMALS)
+        done = done.drop_duplicates()
+        grid = grid.merge(done,on=list(PARAM_COLUMNS),how='left',indicator=True)
+        grid = grid[grid['_merge']=='left_only'].drop(columns='_merge')
+    # Keep the rows of each telescope variant together, so chunks need few with_params()/get_err_cad_grid() calls
+    grid = grid.sort_values(list(PARAM_COLUMNS[:2+len(DESIGN_TELESCOPE_PARAMS)]),kind='mergesort').reset_index(drop=True)
+    tasks = [grid.iloc[start:start+chunksize] for start in range(0,len(grid),chunksize)]
+    for df in pool_imap(_run_chunk,tasks,_init_worker,(flux_backend,),_WORKER,processes,ordered=False,
+                        progress=progress,label='Explore'):
+        store.append(df)
+    return {'points': npoints,
+            'computed': len(grid),
+            'skipped': npoints-len(grid),
+            'seconds': time.time()-t_start}
@@ -0,0 +1,141 @@
+"""
+Site and ephemeris geometry: target altitude and airmass, and low precision sun and moon positions
+"""
+from __future__ import print_function
+import numpy as np
+
+def calc_altitude(jd,lat,lon,ra,dec):
+    """
+    Calculate the altitude of a target from a site
+
+    INPUT:
+        see calc_airmass(), ra and dec can be arrays broadcasting with jd
+
+    OUTPUT:
+        altitude in degrees
+
+    NOTES:
+        Uses the mean sidereal time and ignores precession, nutation and refraction
+    """
+    jd = np.asarray(jd,dtype=float)
+    gmst = 18.697374558 + 24.06570982441908*(jd-2451545.0) # hours
+    ha = np.deg2rad((gmst*15. + lon - np.asarray(ra,dtype=float)) % 360.)
+    lat, dec = np.deg2rad(lat), np.deg2rad(dec)
+    sin_alt = np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(ha)
+    return np.rad2deg(np.arcsin(np.clip(sin_alt,-1.,1.)))
+
+def calc_airmass(jd,lat,lon,ra,dec):
+    """
+    Calculate the airmass of a target from a site
+
+    INPUT:
+        jd  - Julian date(s) (UT)
+        lat - site latitude in degrees
+        lon - site longitude in degrees (east positive)
+        ra  - target right ascension in degrees
+        dec - target declination in degrees
+
+    OUTPUT:
+        airmass using the Kasten & Young (1989) formula, NaN when the target is below the horizon
+
+    NOTES:
+        Uses the mean sidereal time and ignores precession, nutation and refraction, which is accurate to
+        a few percent in airmass for airmass < 3
+    """
+    alt = calc_altitude(jd,lat,lon,ra,dec)
+    z = 90. - alt
+    with np.errstate(invalid='ignore'):
+        airmass = 1./(np.cos(np.deg2rad(z)) + 0.50572*(96.07995-z)**-1.6364)
+    return np.where(alt>0.,airmass,np.nan)
+
+def site_airmass(lat,lon,ra,dec):
+    """
+    Get an airmass track function(jd) for a target at ra, dec observed from a site at lat, lon, see calc_airmass()
+
+    EXAMPLE:
+        # APO
+        airmass = site_airmass(32.78,-105.82,ra=130.,dec=20.)
+    """
+    return lambda jd: calc_airmass(jd,lat,lon,ra,dec)
+
+def sun_position(jd):
+    """
+    Low precision position of the sun (Astronomical Almanac, ~0.01 deg)
+
+    INPUT:
+        jd - Julian date(s) (UT)
+
+    OUTPUT:
+        ecliptic longitude in degrees, ra and dec in degrees
+    """
+    n = np.asarray(jd,dtype=float)-2451545.0
+    L = 280.460 + 0.9856474*n
+    g = np.deg2rad(357.528 + 0.9856003*n)
+    lam = (L + 1.915*np.sin(g) + 0.020*np.sin(2.*g)) % 360.
+    ra, dec = _ecliptic_to_equatorial(lam,0.,n/36525.)
+    return lam, ra, dec
+
+def moon_position(jd):
+    """
+    Low precision geocentric position of the moon (Astronomical Almanac, ~0.3 deg)
+
+    INPUT:
+        jd - Julian date(s) (UT)
+
+    OUTPUT:
+        ecliptic longitude and latitude in degrees, ra and dec in degrees
+
+    NOTES:
+        The topocentric parallax (up to 1 deg) is not included
+    """
+    T = (np.asarray(jd,dtype=float)-2451545.0)/36525.
+    sind = lambda x: np.sin(np.deg2rad(x))
+    lam = (218.32 + 481267.881*T
+           + 6.29*sind(135.0+477198.87*T) - 1.27*sind(259.3-413335.36*T)
+           + 0.66*sind(235.7+890534.22*T) + 0.21*sind(269.9+954397.74*T)
+           - 0.19*sind(357.5+35999.05*T) - 0.11*sind(186.5+966404.03*T)) % 360.
+    beta = (5.13*sind(93.3+483202.02*T) + 0.28*sind(228.2+960400.89*T)
+            - 0.28*sind(318.3+6003.15*T) - 0.17*sind(217.6-407332.21*T))
+    ra, dec = _ecliptic_to_equatorial(lam,beta,T)
+    return lam, beta, ra, dec
+
+def _ecliptic_to_equatorial(lam,beta,T):
+    eps = np.deg2rad(23.439-0.013*T)
+    lam, beta = np.deg2rad(lam), np.deg2rad(beta)
+    x = np.cos(beta)*np.cos(lam)
+    y = np.cos(eps)*np.cos(beta)*np.sin(lam) - np.sin(eps)*np.sin(beta)
+    z = np.sin(eps)*np.cos(beta)*np.sin(lam) + np.cos(eps)*np.sin(beta)
+    return np.rad2deg(np.arctan2(y,x)) % 360., np.rad2deg(np.arcsin(np.clip(z,-1.,1.)))
+
+def angular_separation(ra1,dec1,ra2,dec2):
+    """
+    Angular separation in degrees between two positions in degrees
+    """
+    ra1, dec1, ra2, dec2 = [np.deg2rad(np.asarray(x,dtype=float)) for x in (ra1,dec1,ra2,dec2)]
+    cos_sep = np.sin(dec1)*np.sin(dec2) + np.cos(dec1)*np.cos(dec2)*np.cos(ra1-ra2)
+    return np.rad2deg(np.arccos(np.clip(cos_sep,-1.,1.)))
+
+def moon_geometry(jd,lat,lon,ra,dec):
+    """
+    Moon phase angle, moon-target separation, moon altitude and target airmass for a target observed from a site
+
+    INPUT:
+        jd      - Julian date(s) (UT), e.g., the epochs of a night schedule
+        lat,lon - site latitude and longitude in degrees (east positive)
+        ra,dec  - target position in degrees, can be arrays broadcasting with jd
+
+    OUTPUT:
+        dictionary with arrays of moon_phase (phase angle in degrees, 0 is full), moon_illumination (0-1),
+        moon_sep (degrees), moon_alt (degrees) and airmass (NaN when the target is down), which can be passed on to
+        SkyTable.sky_mag() or Telescope.get_sky_mag()
+    """
+    sun_lam = sun_position(jd)[0]
+    moon_lam, moon_beta, moon_ra, moon_dec = moon_position(jd)
+    elongation = np.rad2deg(np.arccos(np.cos(np.deg2rad(moon_beta))*np.cos(np.deg2rad(moon_lam-sun_lam))))
+    phase = 180.-elongation
+    return {'moon_phase': phase,
+            'moon_illumination': 0.5*(1.+np.cos(np.deg2rad(phase))),
+            'moon_sep': angular_separation(ra,dec,moon_ra,moon_dec),
+            'moon_alt': calc_altitude(jd,lat,lon,moon_ra,moon_dec),
+            'airmass': calc_airmass(jd,lat,lon,ra,dec)}
+
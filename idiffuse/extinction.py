@@ -0,0 +1,158 @@
+from __future__ import print_function
+import numpy as np
+import hashlib
+import os
+import idiffuse.backends as backends
+import idiffuse.filter_registry as filter_registry
+
+# Airmass grid of the precomputed transmission tables, see AirmassTable
+AIRMASS_GRID = np.linspace(1.,4.,61)
+
+def rayleigh_extinction(wave,altitude=0.):
+    """
+    Rayleigh scattering extinction in mag/airmass
+
+    INPUT:
+        wave     - wavelength in Angstrom
+        altitude - altitude of the site in m, the extinction scales with the pressure as exp(-altitude/7996m)
+
+    OUTPUT:
+        extinction coefficient in mag/airmass
+
+    NOTES:
+        Optical depth from Hansen & Travis (1974), tau = 0.008569 lambda^-4 (1 + 0.0113 lambda^-2 + 0.00013 lambda^-4)
+        with lambda in micron, at sea level pressure
+    """
+    lam = np.asarray(wave,dtype=float)/1e4
+    tau = 0.008569*lam**-4.*(1.+0.0113*lam**-2.+0.00013*lam**-4.)
+    return 2.5*np.log10(np.e)*tau*np.exp(-altitude/7996.)
+
+def aerosol_extinction(wave,k_5500=0.05,alpha=1.3):
+    """
+    Aerosol extinction in mag/airmass, as a power law in wavelength
+
+    INPUT:
+        wave   - wavelength in Angstrom
+        k_5500 - aerosol extinction at 5500A in mag/airmass
+        alpha  - Angstrom exponent of the power law
+
+    OUTPUT:
+        extinction coefficient in mag/airmass
+    """
+    return k_5500*(np.asarray(wave,dtype=float)/5500.)**(-alpha)
+
+
+class ExtinctionCurve(object):
+    """
+    Atmospheric extinction coefficient k(lambda) in mag/airmass, so the transmission is 10**(-0.4*k*airmass)
+
+    EXAMPLE:
+        ext = ExtinctionCurve.from_model(altitude=2788.,aerosol_k=0.05)
+        ext = ExtinctionCurve.from_file('apo_extinction.txt')
+        ext.transmission(5500.,airmass=1.5)
+    """
+    def __init__(self,wave,k,name=None):
+        """
+        INPUT:
+            wave - wavelength in Angstrom, increasing
+            k    - extinction in mag/airmass, extrapolated as constant outside of the wavelength range
+            name - name of the curve (optional)
+        """
+        self.wave = np.asarray(wave,dtype=float)
+        self.k    = np.asarray(k,dtype=float)
+        self.name = name
+        h = hashlib.sha1(np.ascontiguousarray(self.wave).tobytes())
+        h.update(np.ascontiguousarray(self.k).tobytes())
+        # Content hash used to key the airmass tables
+        self.key  = h.hexdigest()
+
+    def __repr__(self):
+        return 'ExtinctionCurve({!r}, {} points, k(5500A)={:0.3f} mag/airmass)'.format(self.name,len(self.wave),
+                                                                                      float(self(5500.)))
+
+    def __call__(self,wave):
+        """
+        Extinction in mag/airmass at *wave* (Angstrom)
+        """
+        return np.interp(wave,self.wave,self.k)
+
+    def transmission(self,wave,airmass):
+        """
+        Atmospheric transmission at *wave* (Angstrom) and *airmass*, which broadcast against each other
+        """
+        return 10.**(-0.4*self(wave)*np.asarray(airmass,dtype=float))
+
+    @classmethod
+    def from_file(cls,filename,wave_unit='angstrom'):
+        """
+        Read a site extinction curve from a two-column ASCII file with wavelength and extinction in mag/airmass
+
+        INPUT:
+            filename  - two-column ASCII file
+            wave_unit - unit of the wavelengths in the file, 'angstrom', 'nm' or 'micron'
+        """
+        wave, k = filter_registry.read_curve_file(filename,wave_unit,use_sidecar=False)
+        return cls(wave,k,name=os.path.basename(filename))
+
+    @classmethod
+    def from_model(cls,altitude=0.,aerosol_k=0.05,aerosol_alpha=1.3,wave=None):
+        """
+        Extinction from Rayleigh scattering at the site altitude plus a power law for aerosols
+
+        INPUT:
+            altitude      - altitude of the site in m
+            aerosol_k     - aerosol extinction at 5500A in mag/airmass, see aerosol_extinction()
+            aerosol_alpha - Angstrom exponent of the aerosols
+            wave          - wavelength grid in Angstrom, default is 3000-11000A in 10A steps
+
+        NOTES:
+            Ozone and water absorption bands are not included, use from_file() with a measured site curve for those
+        """
+        if wave is None:
+            wave = np.arange(3000.,11000.+1.,10.)
+        k = rayleigh_extinction(wave,altitude) + aerosol_extinction(wave,aerosol_k,aerosol_alpha)
+        return cls(wave,k,name='model(altitude={:g},aerosol_k={:g},aerosol_alpha={:g})'.format(altitude,aerosol_k,
+                                                                                                 aerosol_alpha))
+
+
+class AirmassTable(object):
+    """
+    Precomputed transmission of a star through the atmosphere vs airmass, for one set of spectral elements
+
+    The transmission at each airmass in the grid is int(F*T*10**(-0.4*k*X))/int(F*T), with F the Vega photon flux
+    and T the product of the spectral elements. Calling the table interpolates log(transmission) linearly in
+    airmass, which is exact for a flat k(lambda), and extrapolates linearly outside of the grid.
+
+    EXAMPLE:
+        table = AirmassTable([QE,Throughput,BandPass],ExtinctionCurve.from_model(altitude=2788.))
+        table([1.0,1.5,2.0])
+    """
+    def __init__(self,elements,extinction,airmass=AIRMASS_GRID):
+        """
+        INPUT:
+            elements   - list of spectral elements, see backends.element_arrays()
+            extinction - ExtinctionCurve
+            airmass    - airmass grid, increasing
+        """
+        wave, y = backends.get_backend('numpy').photon_spectrum(elements)
+        # One vectorized integration for the whole airmass grid
+        yx = y*10.**(-0.4*np.outer(airmass,extinction(wave)))
+        self.airmass = np.asarray(airmass,dtype=float)
+        self.transmission = backends.trapz(yx,wave)/backends.trapz(y,wave)
+        self._log_transmission = np.log(self.transmission)
+        self._slope = np.diff(self._log_transmission)/np.diff(self.airmass)
+
+    def __repr__(self):
+        return 'AirmassTable(X={:0.2f}-{:0.2f}, transmission={:0.4f}-{:0.4f})'.format(self.airmass[0],self.airmass[-1],
+                                                                                   self.transmission[0],
+                                                                                   self.transmission[-1])
+
+    def __call__(self,airmass):
+        """
+        Transmission at *airmass*, float or array
+        """
+        x = np.asarray(airmass,dtype=float)
+        logt = np.interp(x,self.airmass,self._log_transmission)
+        logt = logt + np.where(x < self.airmass[0],(x-self.airmass[0])*self._slope[0],0.)
+        logt = logt + np.where(x > self.airmass[-1],(x-self.airmass[-1])*self._slope[-1],0.)
+        return np.exp(logt)
@@ -0,0 +1,312 @@
+from __future__ import print_function
+import numpy as np
+import os
+import hashlib
+import idiffuse.backends as backends
+import idiffuse.cache as cache
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Directory with the filter and QE curves bundled with idiffuse
+FILTER_DIRNAME = os.path.join(os.path.dirname(__file__),'filters')
+
+# Directory with mirror and lens throughput curves bundled with idiffuse, see throughput_registry
+THROUGHPUT_DIRNAME = os.path.join(os.path.dirname(__file__),'data','throughput')
+
+# Wavelength units of curve files, as factors to convert to Angstrom
+WAVE_UNITS = {'angstrom': 1., 'nm': 10., 'micron': 1e4}
+
+# Version of the parsing in read_curve_file(), part of the sidecar key so parsing changes invalidate old sidecars
+CURVE_FORMAT_VERSION = 2
+
+# Bundled curves with wavelengths in nm instead of Angstrom
+BUNDLED_WAVE_UNITS = {'semrock_857_30.txt': 'nm'}
+
+def pivot_wavelength(wave,throughput):
+    """
+    Pivot wavelength in Angstrom of a transmission curve, sqrt(int(T*lambda)/int(T/lambda))
+
+    INPUT:
+        wave       - wavelength in Angstrom, e.g., BandPass.wave of a pysynphot bandpass
+        throughput - throughput
+    """
+    wave = np.asarray(wave,dtype=float)
+    throughput = np.asarray(throughput,dtype=float)
+    return float(np.sqrt(backends.trapz(throughput*wave,wave)/backends.trapz(throughput/wave,wave)))
+
+def _wave_factor(wave_unit):
+    if wave_unit not in WAVE_UNITS:
+        raise ValueError('Unknown wavelength unit {}, use one of {}'.format(wave_unit,', '.join(sorted(WAVE_UNITS))))
+    return WAVE_UNITS[wave_unit]
+
+def read_curve_file(filename,wave_unit='angstrom',use_sidecar=None):
+    """
+    Read a two-column ASCII transmission curve, using a binary .npy sidecar in the cache directory if enabled
+
+    INPUT:
+        filename    - two-column ASCII file with wavelength and throughput
+        wave_unit   - unit of the wavelengths in the file, 'angstrom', 'nm' or 'micron'
+        use_sidecar - if True, read and write the sidecar, default is cache.disk_cache_enabled()
+
+    OUTPUT:
+        wave       - wavelength in Angstrom
+        throughput - throughput, from 0 to 1
+
+    NOTES:
+        The sidecar is keyed on the absolute path, size and modification time of the file, the wavelength unit and
+        CURVE_FORMAT_VERSION, so editing a curve results in it being parsed again. The sidecar is memory-mapped,
+        and if the cache directory is not writable the text file is parsed every time.
+    """
+    factor = _wave_factor(wave_unit)
+    if use_sidecar is None:
+        use_sidecar = cache.disk_cache_enabled()
+    filename = os.path.abspath(filename)
+    if use_sidecar:
+        st = os.stat(filename)
+        key = hashlib.sha1('{}|{}|{}|{}|{}'.format(CURVE_FORMAT_VERSION,filename,st.st_size,st.st_mtime,
+                                                   wave_unit).encode('utf-8')).hexdigest()
+        sidecar = os.path.join(cache.get_cache_dir(),'filters',key+'.npy')
+        if os.path.exists(sidecar):
+            try:
+                data = np.load(sidecar,mmap_mode='r')
+                return data[0], data[1]
+            except (IOError,OSError,ValueError):
+                pass
+    data = np.loadtxt(filename,dtype=float,ndmin=2)[:,:2].T
+    data = data[:,np.argsort(data[0],kind='mergesort')]
+    data[0] *= factor
+    data = np.ascontiguousarray(data)
+    if use_sidecar:
+        try:
+            if not os.path.isdir(os.path.dirname(sidecar)):
+                os.makedirs(os.path.dirname(sidecar))
+            tmpname = sidecar+'.{}.tmp'.format(os.getpid())
+            with open(tmpname,'wb') as f:
+                np.save(f,data)
+            os.rename(tmpname,sidecar)
+        except (IOError,OSError):
+            pass
+    return data[0], data[1]
+
+class FilterCurve(object):
+    """
+    A transmission curve (filter or QE) stored as compact float arrays
+
+    EXAMPLE:
+        curve = idiffuse.filter_registry.get_filter('sloan_i_filter.txt')
+        curve.pivot_wavelength
+        bp = curve.to_pysynphot()
+    """
+    def __init__(self,name,wave,throughput,filename=None):
+        """
+        INPUT:
+            name       - name of the curve, e.g., 'sloan_i_filter.txt'
+            wave       - wavelength in Angstrom
+            throughput - throughput, from 0 to 1
+            filename   - file the curve was read from (optional)
+        """
+        self.name       = name
+        self.wave       = wave
+        self.throughput = throughput
+        self.filename   = filename
+        self._bandpass  = None
+
+    def __repr__(self):
+        return 'FilterCurve({!r}, {} points, {:0.1f}-{:0.1f}A)'.format(self.name,len(self.wave),self.wave_min,self.wave_max)
+
+    @property
+    def wave_min(self):
+        """
+        Minimum wavelength in Angstrom
+        """
+        return float(self.wave[0])
+
+    @property
+    def wave_max(self):
+        """
+        Maximum wavelength in Angstrom
+        """
+        return float(self.wave[-1])
+
+    @property
+    def pivot_wavelength(self):
+        """
+        Pivot wavelength in Angstrom, sqrt(int(T*lambda)/int(T/lambda))
+        """
+        return pivot_wavelength(self.wave,self.throughput)
+
+    @property
+    def width(self):
+        """
+        Rectangular width in Angstrom, int(T)/max(T)
+        """
+        return float(backends.trapz(self.throughput,self.wave))/float(np.max(self.throughput))
+
+    def metadata(self):
+        """
+        Get a dictionary with the name, filename, number of points, pivot wavelength, width and wavelength range
+        """
+        return {'name': self.name,
+                'filename': self.filename,
+                'npoints': len(self.wave),
+                'pivot_wavelength': self.pivot_wavelength,
+                'width': self.width,
+                'wave_min': self.wave_min,
+                'wave_max': self.wave_max}
+
+    def to_pysynphot(self):
+        """
+        Get the curve as a pysynphot.ArrayBandpass, created once and reused
+        """
+        if self._bandpass is None:
+            import pysynphot as S
+            self._bandpass = S.ArrayBandpass(np.array(self.wave),np.array(self.throughput),name=self.name)
+        return self._bandpass
+
+
+class FilterRegistry(Mapping):
+    """
+    Index of filter and QE curves in one or more directories.
+
+    Behaves as a read-only dictionary of curve name (file basename) -> absolute filename, which is how
+    Telescope.FILTER_DICT is exposed. The directories are only listed on first access, and each curve is only
+    parsed once per process (and once per machine with IDIFFUSE_DISK_CACHE=1, see read_curve_file()).
+
+    NOTES:
+        If several registered directories have a file with the same name, the last registered one wins.
+        Wavelengths are in Angstrom unless a different unit is given when registering a curve or directory.
+    """
+    def __init__(self,dirnames=(),wave_units=None):
+        """
+        INPUT:
+            dirnames   - directories with two-column ASCII curves, with wavelengths in Angstrom
+            wave_units - dictionary of curve name -> wavelength unit for curves not in Angstrom, e.g., {'my.txt': 'nm'}
+        """
+        self.dirnames    = [os.path.abspath(d) for d in dirnames]
+        self.wave_units  = dict(wave_units or {})
+        self._dir_units  = {}
+        self._files      = {}
+        self._index      = None
+        self._curves     = {}
+
+    def __repr__(self):
+        return 'FilterRegistry({!r})'.format(self.dirnames)
+
+    def register_directory(self,dirname,wave_unit='angstrom'):
+        """
+        Add a directory of two-column ASCII curves to the registry
+
+        INPUT:
+            dirname   - directory with the curves
+            wave_unit - wavelength unit of the curves in the directory, 'angstrom', 'nm' or 'micron'
+        """
+        _wave_factor(wave_unit)
+        dirname = os.path.abspath(dirname)
+        self.dirnames.append(dirname)
+        self._dir_units[dirname] = wave_unit
+        self._index = None
+
+    def register_file(self,filename,name=None,wave_unit='angstrom'):
+        """
+        Add a single two-column ASCII curve to the registry
+
+        INPUT:
+            filename  - curve filename
+            name      - name to register it under, default is the basename of filename
+            wave_unit - wavelength unit of the file, 'angstrom', 'nm' or 'micron'
+        """
+        _wave_factor(wave_unit)
+        filename = os.path.abspath(filename)
+        if name is None:
+            name = os.path.basename(filename)
+        self._files[name] = filename
+        self.wave_units[name] = wave_unit
+        self._index = None
+
+    def get_wave_unit(self,name):
+        """
+        Wavelength unit of a registered curve, see register_file() and register_directory()
+        """
+        if name in self.wave_units:
+            return self.wave_units[name]
+        filename = self._get_index().get(name)
+        if filename is None:
+            return 'angstrom'
+        return self._dir_units.get(os.path.dirname(filename),'angstrom')
+
+    def _get_index(self):
+        if self._index is None:
+            index = {}
+            for dirname in self.dirnames:
+                for basename in sorted(os.listdir(dirname)):
+                    filename = os.path.join(dirname,basename)
+                    if not basename.startswith('.') and os.path.isfile(filename):
+                        index[basename] = filename
+            index.update(self._files)
+            self._index = index
+        return self._index
+
+    def __getitem__(self,name):
+        return self._get_index()[name]
+
+    def __iter__(self):
+        return iter(sorted(self._get_index()))
+
+    def __len__(self):
+        return len(self._get_index())
+
+    def get_curve(self,name):
+        """
+        Get a FilterCurve by registry name or by filename
+
+        INPUT:
+            name - name in the registry (e.g., 'bess-v.txt') or a path to a two-column ASCII file
+
+        OUTPUT:
+            FilterCurve
+        """
+        filename = self._get_index().get(name)
+        if filename is None:
+            if not os.path.isfile(name):
+                raise KeyError('{} is not a registered filter or a file'.format(name))
+            filename = os.path.abspath(name)
+        wave_unit = self.get_wave_unit(name)
+        curve = self._curves.get((filename,wave_unit))
+        if curve is None:
+            wave, throughput = read_curve_file(filename,wave_unit)
+            curve = FilterCurve(os.path.basename(filename),wave,throughput,filename=filename)
+            self._curves[(filename,wave_unit)] = curve
+        return curve
+
+    def get_bandpass(self,name):
+        """
+        Get a pysynphot.ArrayBandpass by registry name or filename, see get_curve()
+        """
+        return self.get_curve(name).to_pysynphot()
+
+    def metadata(self):
+        """
+        Get a pandas.DataFrame with the metadata of all curves, indexed by name, see FilterCurve.metadata()
+        """
+        import pandas as pd
+        return pd.DataFrame([self.get_curve(name).metadata() for name in self]).set_index('name')
+
+# Default registry with the bundled curves, used by Telescope.FILTER_DICT
+registry = FilterRegistry([FILTER_DIRNAME],wave_units=BUNDLED_WAVE_UNITS)
+
+# Registry with the bundled mirror and lens curves, used for 'curve' throughput elements of instrument definitions
+throughput_registry = FilterRegistry([THROUGHPUT_DIRNAME])
+
+def get_filter(name):
+    """
+    Get a FilterCurve from the default registry by name or filename
+    """
+    return registry.get_curve(name)
+
+def register_filter_directory(dirname,wave_unit='angstrom'):
+    """
+    Add a directory of two-column ASCII curves to the default registry, see FilterRegistry.register_directory()
+    """
+    registry.register_directory(dirname,wave_unit)
@@ -0,0 +1,84 @@
+from __future__ import print_function
+import time
+
+# Functions hook(stage,seconds) called after each instrumented stage
+_HOOKS = []
+
+_clock = getattr(time,'perf_counter',time.time)
+
+def add_hook(hook):
+    """
+    Register hook(stage,seconds) to be called after every instrumented stage
+
+    NOTES:
+        Stages are 'flux' (count rate lookup, including any flux backend call), the flux backend name, e.g.,
+        'pysynphot' or 'numpy' (only when the backend is actually called, i.e., on a cache miss) and 'arithmetic'
+        (the noise and cadence calculation)
+    """
+    _HOOKS.append(hook)
+
+def remove_hook(hook):
+    """
+    Remove a hook registered with add_hook()
+    """
+    _HOOKS.remove(hook)
+
+def start():
+    """
+    Start timing a stage, returns None if no hooks are registered so that timing costs nothing by default
+    """
+    if _HOOKS:
+        return _clock()
+    return None
+
+def stop(stage,t_start):
+    """
+    Stop timing a stage started with start() and pass the elapsed time to the hooks
+    """
+    if t_start is not None:
+        dt = _clock()-t_start
+        for hook in list(_HOOKS):
+            hook(stage,dt)
+
+
+class Profiler(object):
+    """
+    Hook that records the time spent in each instrumented stage
+
+    EXAMPLE:
+        with idiffuse.instrumentation.Profiler() as prof:
+            arc.get_err_cad_for_adu(12.,bp,verbose=False)
+        print(prof.summary())
+    """
+    def __init__(self):
+        self.records = []
+
+    def __call__(self,stage,seconds):
+        self.records.append((stage,seconds))
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self,*args):
+        remove_hook(self)
+
+    def summary(self):
+        """
+        Get a dictionary of stage -> {'count','total','mean','max'} with times in seconds
+        """
+        out = {}
+        for stage, seconds in self.records:
+            s = out.setdefault(stage,{'count': 0,'total': 0.,'max': 0.})
+            s['count'] += 1
+            s['total'] += seconds
+            s['max'] = max(s['max'],seconds)
+        for s in out.values():
+            s['mean'] = s['total']/s['count']
+        return out
+
+    def reset(self):
+        """
+        Remove all recorded timings
+        """
+        self.records = []
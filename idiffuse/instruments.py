@@ -0,0 +1,347 @@
+from __future__ import print_function
+import numpy as np
+import copy
+import json
+import numbers
+import os
+import threading
+import idiffuse.filter_registry as filter_registry
+import idiffuse.extinction as extinction
+from idiffuse.telescope import Telescope
+
+# Directory with the instrument definitions bundled with idiffuse
+INSTRUMENT_DIRNAME = os.path.join(os.path.dirname(__file__),'data','instruments')
+
+# Supported definition file extensions
+EXTENSIONS = ('.json','.yaml','.yml','.toml')
+
+# Keys of an instrument definition, passed on to Telescope() (see Telescope.__init__ for units)
+REQUIRED_KEYS = ('name','diameter','fnum','flength','gain','pix_size','fov','num_pix','plt_scale',
+                 'dark_noise','read_noise','altitude','central_obstruction','qe','throughput',
+                 'diffuser_angle','diffuser_dist_from_detector')
+OPTIONAL_KEYS = ('description','filters','extinction')
+
+# Keys that have to be positive numbers, and keys that have to be non-negative numbers
+POSITIVE_KEYS = ('diameter','fnum','flength','gain','pix_size','fov','num_pix','plt_scale',
+                 'diffuser_dist_from_detector')
+NON_NEGATIVE_KEYS = ('dark_noise','read_noise','altitude','diffuser_angle')
+
+# Keys of an element in the throughput list
+THROUGHPUT_ELEMENT_KEYS = ('element','transmission','curve','count')
+
+# Keys of an extinction model, see extinction.ExtinctionCurve.from_model()
+EXTINCTION_MODEL_KEYS = ('aerosol_k','aerosol_alpha')
+
+def load_definition_file(filename):
+    """
+    Read an instrument definition from a JSON, YAML (.yaml/.yml) or TOML file
+
+    INPUT:
+        filename - path to the definition file
+
+    OUTPUT:
+        dictionary with the definition, not validated
+
+    NOTES:
+        YAML needs PyYAML, TOML needs Python>=3.11 (tomllib) or the toml package
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext=='.json':
+        with open(filename) as f:
+            return json.load(f)
+    if ext in ('.yaml','.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is needed to read {}, install it with pip install pyyaml'.format(filename))
+        with open(filename) as f:
+            return yaml.safe_load(f)
+    if ext=='.toml':
+        try:
+            import tomllib
+            with open(filename,'rb') as f:
+                return tomllib.load(f)
+        except ImportError:
+            pass
+        try:
+            import toml
+        except ImportError:
+            raise ImportError('tomllib (Python>=3.11) or the toml package is needed to read {}'.format(filename))
+        with open(filename) as f:
+            return toml.load(f)
+    raise ValueError('Unknown instrument definition format {}, use one of {}'.format(filename,', '.join(EXTENSIONS)))
+
+def _check_number(name,value,minimum=None,maximum=None,inclusive=True):
+    if isinstance(value,bool) or not isinstance(value,numbers.Number) or not np.isfinite(value):
+        raise ValueError('{} has to be a number, got {!r}'.format(name,value))
+    if minimum is not None and (value < minimum or (not inclusive and value==minimum)):
+        raise ValueError('{} has to be {} {}, got {}'.format(name,'>=' if inclusive else '>',minimum,value))
+    if maximum is not None and value > maximum:
+        raise ValueError('{} has to be <= {}, got {}'.format(name,maximum,value))
+
+def validate_definition(definition):
+    """
+    Validate an instrument definition
+
+    INPUT:
+        definition - dictionary with an instrument definition, see InstrumentRegistry
+
+    OUTPUT:
+        copy of the definition with the throughput elements normalized to have a 'count'
+
+    NOTES:
+        Raises a ValueError describing the first problem found
+    """
+    if not isinstance(definition,dict):
+        raise ValueError('Instrument definition has to be a mapping, got {!r}'.format(type(definition)))
+    name = definition.get('name','<unnamed>')
+    missing = [key for key in REQUIRED_KEYS if key not in definition]
+    if missing:
+        raise ValueError('Instrument {}: missing keys {}'.format(name,', '.join(missing)))
+    unknown = [key for key in definition if key not in REQUIRED_KEYS+OPTIONAL_KEYS]
+    if unknown:
+        raise ValueError('Instrument {}: unknown keys {}'.format(name,', '.join(sorted(unknown))))
+    definition = copy.deepcopy(definition)
+    try:
+        if not isinstance(definition['name'],str) or not definition['name']:
+            raise ValueError('name has to be a non-empty string')
+        for key in POSITIVE_KEYS:
+            _check_number(key,definition[key],0.,inclusive=False)
+        for key in NON_NEGATIVE_KEYS:
+            _check_number(key,definition[key],0.)
+        _check_number('central_obstruction',definition['central_obstruction'],0.,1.)
+        if definition['central_obstruction']==1.:
+            raise ValueError('central_obstruction has to be < 1')
+        if not isinstance(definition['qe'],str):
+            raise ValueError('qe has to be a filter registry name or a filename')
+        elements = definition['throughput']
+        if isinstance(elements,numbers.Number):
+            elements = [{'element':'total','transmission':elements}]
+        if not isinstance(elements,list) or not elements:
+            raise ValueError('throughput has to be a number or a non-empty list of elements')
+        for i, element in enumerate(elements):
+            label = 'throughput[{}]'.format(i)
+            if not isinstance(element,dict):
+                raise ValueError('{} has to be a mapping'.format(label))
+            unknown = [key for key in element if key not in THROUGHPUT_ELEMENT_KEYS]
+            if unknown:
+                raise ValueError('{}: unknown keys {}'.format(label,', '.join(sorted(unknown))))
+            if ('transmission' in element)==('curve' in element):
+                raise ValueError('{}: give exactly one of transmission or curve'.format(label))
+            if 'transmission' in element:
+                _check_number(label+'.transmission',element['transmission'],0.,1.,inclusive=False)
+            elif not isinstance(element['curve'],str):
+                raise ValueError('{}.curve has to be a filter registry name or a filename'.format(label))
+            element.setdefault('count',1)
+            if isinstance(element['count'],bool) or not isinstance(element['count'],numbers.Integral) or element['count'] < 1:
+                raise ValueError('{}.count has to be a positive integer, got {!r}'.format(label,element['count']))
+        definition['throughput'] = elements
+        ext = definition.get('extinction')
+        if isinstance(ext,dict):
+            unknown = [key for key in ext if key not in EXTINCTION_MODEL_KEYS]
+            if unknown:
+                raise ValueError('extinction: unknown keys {}'.format(', '.join(sorted(unknown))))
+            for key in ext:
+                _check_number('extinction.'+key,ext[key],0.)
+        elif ext is not None and not isinstance(ext,str):
+            raise ValueError('extinction has to be a filename of a site extinction curve or a mapping with model parameters')
+        filters = definition.get('filters',[])
+        if not isinstance(filters,list) or not all(isinstance(f,str) for f in filters):
+            raise ValueError('filters has to be a list of filter names')
+    except ValueError as e:
+        raise ValueError('Instrument {}: {}'.format(name,e))
+    return definition
+
+def build_throughput(elements):
+    """
+    Combine a list of throughput elements into a total throughput
+
+    INPUT:
+        elements - list of dictionaries with 'transmission' (flat, 0-1) or 'curve' (name in
+                   filter_registry.throughput_registry, e.g., 'aluminium_mirror.txt', filter registry name or filename),
+                   and optionally 'count' (number of identical elements, e.g., 2 mirrors), see validate_definition()
+
+    OUTPUT:
+        flat throughput as a float if all elements are flat, otherwise a filter_registry.FilterCurve with the product
+        of the curves (on the union of their wavelength grids, zero outside of their range) times the flat elements
+    """
+    flat = 1.
+    curves = []
+    for element in elements:
+        count = element.get('count',1)
+        if 'transmission' in element:
+            flat *= float(element['transmission'])**count
+        elif element['curve'] in filter_registry.throughput_registry:
+            curves.extend([filter_registry.throughput_registry.get_curve(element['curve'])]*count)
+        else:
+            curves.extend([filter_registry.registry.get_curve(element['curve'])]*count)
+    if not curves:
+        return flat
+    wave = np.unique(np.concatenate([curve.wave for curve in curves]))
+    throughput = np.full(len(wave),flat)
+    for curve in curves:
+        throughput *= np.interp(wave,curve.wave,curve.throughput,left=0.,right=0.)
+    name = '*'.join(curve.name for curve in curves)
+    return filter_registry.FilterCurve(name,wave,throughput)
+
+def build_telescope(definition):
+    """
+    Build a Telescope from an instrument definition
+
+    INPUT:
+        definition - dictionary with an instrument definition, validated with validate_definition()
+
+    OUTPUT:
+        a new, mutable Telescope instance
+
+    EXAMPLE:
+        tel = build_telescope(load_definition_file('my_telescope.yaml'))
+    """
+    definition = validate_definition(definition)
+    kwargs = dict((key,definition[key]) for key in REQUIRED_KEYS if key not in ('qe','throughput'))
+    tel = Telescope(QE=definition['qe'],Throughput=build_throughput(definition['throughput']),**kwargs)
+    ext = definition.get('extinction')
+    if isinstance(ext,dict):
+        tel.extinction = extinction.ExtinctionCurve.from_model(altitude=definition['altitude'],**ext)
+    elif ext is not None:
+        tel.extinction = extinction.ExtinctionCurve.from_file(ext)
+    return tel
+
+
+class InstrumentRegistry(object):
+    """
+    Registry of declarative instrument definitions that hands out shared, frozen, pre-warmed Telescope instances.
+
+    Definitions are dictionaries (or JSON/YAML/TOML files) with the Telescope() parameters, a 'qe' curve name,
+    and the 'throughput' as a list of elements:
+
+        {"name": "ARC 3.5m", "diameter": 350.0, ..., "qe": "arctic_qe.txt",
+         "throughput": [{"element": "diffuser", "transmission": 0.90},
+                        {"element": "lens", "transmission": 0.99, "count": 4},
+                        {"element": "mirror", "transmission": 0.96, "count": 2},
+                        {"element": "atmosphere", "transmission": 0.5}],
+         "diffuser_angle": 0.34, "diffuser_dist_from_detector": 200.0,
+         "filters": ["sloan_i_filter.txt"]}
+
+    Elements can give a wavelength dependent 'curve' (e.g., 'aluminium_mirror.txt', see build_throughput()) instead
+    of a flat 'transmission'. The optional 'extinction' is a site extinction curve file, or a mapping with the
+    parameters of extinction.ExtinctionCurve.from_model() (e.g., {"aerosol_k": 0.05}) at the instrument altitude,
+    and replaces the flat atmosphere element. The optional 'filters' are used to pre-warm the count rate cache and
+    airmass tables of new instances.
+    Instruments are registered under the file name without extension (e.g., 'arc'), or the given name.
+
+    EXAMPLE:
+        tel = idiffuse.instruments.get_instrument('arc')
+        tel.get_err_cad_for_adu(12.,tel.get_bandpass('sloan_i_filter.txt'))
+
+    NOTES:
+        get() builds each (instrument, flux backend) once per process and is thread safe. The returned instances
+        are frozen (see Telescope.freeze()) as they are shared, use build() for a private, mutable copy.
+    """
+    def __init__(self,dirnames=()):
+        """
+        INPUT:
+            dirnames - directories with instrument definition files to register
+        """
+        self._definitions = {}
+        self._instances   = {}
+        self._lock        = threading.RLock()
+        for dirname in dirnames:
+            self.register_directory(dirname)
+
+    def __repr__(self):
+        return 'InstrumentRegistry({})'.format(', '.join(self.names()))
+
+    def __contains__(self,name):
+        return name in self._definitions
+
+    def __len__(self):
+        return len(self._definitions)
+
+    def register_directory(self,dirname):
+        """
+        Register all definition files (see EXTENSIONS) in a directory
+        """
+        for filename in sorted(os.listdir(dirname)):
+            if os.path.splitext(filename)[1].lower() in EXTENSIONS:
+                self.register_file(os.path.join(dirname,filename))
+
+    def register_file(self,filename,name=None):
+        """
+        Register a definition file, under *name* or the file name without extension
+        """
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        self.register_definition(name,load_definition_file(filename))
+
+    def register_definition(self,name,definition):
+        """
+        Register a definition dictionary under *name*, replacing any previous instrument with that name
+        """
+        definition = validate_definition(definition)
+        with self._lock:
+            self._definitions[name] = definition
+            for key in [key for key in self._instances if key[0]==name]:
+                del self._instances[key]
+
+    def names(self):
+        """
+        Get the sorted names of the registered instruments
+        """
+        return sorted(self._definitions)
+
+    def definition(self,name):
+        """
+        Get a copy of the validated definition of an instrument
+        """
+        if name not in self._definitions:
+            raise KeyError('Unknown instrument {}, available: {}'.format(name,', '.join(self.names())))
+        return copy.deepcopy(self._definitions[name])
+
+    def build(self,name,flux_backend='pysynphot'):
+        """
+        Build a new, mutable Telescope for a registered instrument, see build_telescope()
+        """
+        tel = build_telescope(self.definition(name))
+        tel.flux_backend = flux_backend
+        return tel
+
+    def get(self,name,flux_backend='pysynphot'):
+        """
+        Get the shared Telescope instance of a registered instrument
+
+        INPUT:
+            name         - instrument name, see names()
+            flux_backend - flux backend of the instance, see idiffuse.backends
+
+        OUTPUT:
+            frozen Telescope, built and pre-warmed on the first call for each (name, flux_backend)
+        """
+        key = (name,flux_backend)
+        tel = self._instances.get(key)
+        if tel is None:
+            with self._lock:
+                tel = self._instances.get(key)
+                if tel is None:
+                    tel = self.build(name,flux_backend)
+                    for filter_name in self._definitions[name].get('filters',[]):
+                        tel.get_adu_per_sec(0.,filter_registry.registry.get_curve(filter_name),
+                                            1. if tel.extinction is not None else None)
+                    tel.freeze()
+                    self._instances[key] = tel
+        return tel
+
+# Default registry with the bundled instrument definitions
+registry = InstrumentRegistry([INSTRUMENT_DIRNAME])
+
+def get_instrument(name,flux_backend='pysynphot'):
+    """
+    Get a shared, frozen Telescope from the default registry, see InstrumentRegistry.get()
+    """
+    return registry.get(name,flux_backend)
+
+def register_instrument_directory(dirname):
+    """
+    Add a directory of instrument definition files to the default registry
+    """
+    registry.register_directory(dirname)
@@ -53,3 +53,24 @@ def scintillation_noise(diameter,airmass,exptime,altitude,wavelength=None,withex
         return scint_err * (wavelength/550.)**(-7./12.)
     else:
         return scint_err
+
+def phot_error_terms(star_ADU,n_pix,n_b,sky_ADU,dark,read,gain=1.0):
+    """
+    Individual terms of the photometric error in phot_error()
+
+    INPUT:
+        see phot_error()
+
+    OUTPUT:
+        dictionary with the photon, sky, dark, read and digitization noise in ADUs.
+        Adding these in quadrature gives phot_error()
+
+    NOTES:
+        The sky, dark, read and digitization terms include the (1 + n_pix/n_b) background estimation factor
+    """
+    bkg = n_pix*(1. + n_pix/n_b)
+    return {'photon': np.sqrt(gain*star_ADU)/gain,
+            'sky': np.sqrt(bkg*gain*sky_ADU)/gain,
+            'dark': np.sqrt(bkg*dark)/gain,
+            'read': np.sqrt(bkg*read**2.)/gain,
+            'digitization': np.sqrt(bkg*(gain*0.289)**2.)/gain}
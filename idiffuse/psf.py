@@ -0,0 +1,152 @@
+from __future__ import print_function
+import numpy as np
+import threading
+from collections import OrderedDict
+import idiffuse.photometry as photometry
+
+# Radial step in pixels of the tabulated encircled energy curve
+EE_STEP = 0.05
+
+# Maximum number of PSFs kept by get_diffused_psf(), least recently used ones are dropped first
+PSF_CACHE_SIZE = 256
+
+# LRU cache of DiffusedPSF instances, keyed on (fwhm_pix, seeing_pix, oversample)
+_PSF_CACHE = OrderedDict()
+_PSF_CACHE_LOCK = threading.Lock()
+
+class DiffusedPSF(object):
+    """
+    Pixelized diffused PSF: a flat top-hat disk of the diffuser FWHM convolved with Gaussian seeing.
+
+    The PSF is built on a grid oversampled by *oversample* (odd) in each direction, convolved with FFTs,
+    and integrated over the detector pixels. It is centered on the central pixel.
+
+    EXAMPLE:
+        psf = DiffusedPSF(fwhm_pix=39.5,seeing_pix=4.5)
+        psf.peak_fraction
+        psf.encircled_energy([10.,20.,30.])
+
+    NOTES:
+        Use get_diffused_psf() to share PSFs with the same parameters
+    """
+    def __init__(self,fwhm_pix,seeing_pix,oversample=5):
+        """
+        INPUT:
+            fwhm_pix   - diameter of the diffuser top-hat in (binned) pixels
+            seeing_pix - FWHM of the Gaussian seeing in (binned) pixels, 0 for no seeing
+            oversample - oversampling factor used to build the PSF, has to be odd
+        """
+        if oversample % 2 != 1:
+            raise ValueError('oversample has to be odd')
+        self.fwhm_pix   = float(fwhm_pix)
+        self.seeing_pix = float(seeing_pix)
+        self.oversample = int(oversample)
+
+        # Odd number of detector pixels that covers the top-hat and +-2 seeing FWHM
+        npix = int(np.ceil(self.fwhm_pix + 4.*self.seeing_pix)) + 3
+        npix += (npix+1) % 2
+        n = npix*self.oversample
+        # Subpixel center coordinates in detector pixels, with 0 at the center of the central pixel
+        x = (np.arange(n)+0.5)/self.oversample - npix/2.
+        xx, yy = np.meshgrid(x,x)
+        rr = np.hypot(xx,yy)
+
+        image = (rr <= self.fwhm_pix/2.).astype(float)
+        if image.sum()==0.:
+            image[n//2,n//2] = 1.
+        if self.seeing_pix > 0.:
+            sigma = self.seeing_pix/(2.*np.sqrt(2.*np.log(2.)))
+            kernel = np.exp(-0.5*(rr/sigma)**2.)
+            kernel = np.fft.ifftshift(kernel/kernel.sum())
+            image = np.fft.irfft2(np.fft.rfft2(image)*np.fft.rfft2(kernel),s=image.shape)
+            image = np.clip(image,0.,None)
+        image /= image.sum()
+
+        # Encircled energy curve from the oversampled image, tabulated in EE_STEP radial bins to keep PSFs compact
+        nbins = int(np.ceil(rr.max()/EE_STEP))+1
+        flux = np.bincount((rr/EE_STEP).astype(int).ravel(),weights=image.ravel(),minlength=nbins)
+        self._ee_r   = np.arange(len(flux)+1)*EE_STEP
+        self._ee_cum = np.concatenate([[0.],np.cumsum(flux)])
+
+        self.npix  = npix
+        self.image = image.reshape(npix,self.oversample,npix,self.oversample).sum(axis=(1,3))
+
+    def __repr__(self):
+        return 'DiffusedPSF(fwhm_pix={:0.2f}, seeing_pix={:0.2f}, peak_fraction={:0.5f})'.format(self.fwhm_pix,
+                                                                                               self.seeing_pix,
+                                                                                               self.peak_fraction)
+
+    @property
+    def peak_fraction(self):
+        """
+        Fraction of the total flux that lands in the brightest pixel
+        """
+        return float(self.image.max())
+
+    def encircled_energy(self,radius):
+        """
+        Fraction of the total flux within *radius* pixels of the PSF center, radius can be an array
+        """
+        return np.interp(radius,self._ee_r,self._ee_cum,left=0.,right=1.)
+
+    def optimal_aperture(self,star_adu,sky_adu_per_pixel,dark,read,gain,radii=None):
+        """
+        Find the aperture radius that minimizes the relative photometric error, for arrays of stars
+
+        Uses photometry.phot_error() with the encircled flux and a background annulus from 1.5 to 2.0 times
+        the aperture radius, as in Telescope.get_err_cad_for_adu().
+
+        INPUT:
+            star_adu          - total star counts in ADU, float or array
+            sky_adu_per_pixel - sky counts in ADU/pix, float or array broadcasting with star_adu
+            dark, read, gain  - see photometry.phot_error()
+            radii             - aperture radii in pixels to search, default 0.25 pix steps out to the PSF edge
+
+        OUTPUT:
+            radius    - optimal aperture radius in pixels, same shape as the broadcast inputs
+            rel_error - relative photometric error (not in ppm) at the optimal radius
+        """
+        if radii is None:
+            radii = np.arange(1.,self.npix/2.+0.25,0.25)
+        radii = np.asarray(radii,dtype=float)
+        star_adu, sky_adu_per_pixel = np.broadcast_arrays(np.asarray(star_adu,dtype=float),
+                                                          np.asarray(sky_adu_per_pixel,dtype=float))
+        ee = self.encircled_energy(radii)
+        n_pix = np.pi*radii**2.
+        n_b = np.pi*((2.0*radii)**2.-(1.5*radii)**2.)
+        signal = star_adu[...,None]*ee
+        with np.errstate(divide='ignore',invalid='ignore'):
+            rel_error = photometry.phot_error(signal,n_pix,n_b,sky_adu_per_pixel[...,None],dark,read,gain)/signal
+        rel_error = np.where(np.isfinite(rel_error),rel_error,np.inf)
+        best = rel_error.argmin(axis=-1)
+        return radii[best], np.take_along_axis(rel_error,best[...,None],axis=-1)[...,0]
+
+def get_diffused_psf(fwhm_pix,seeing_pix,oversample=5):
+    """
+    Get a DiffusedPSF, cached on (fwhm_pix, seeing_pix, oversample) so each kernel is only built once
+
+    INPUT:
+        see DiffusedPSF()
+
+    NOTES:
+        At most PSF_CACHE_SIZE PSFs are kept, the least recently used are dropped first
+    """
+    key = (round(float(fwhm_pix),6),round(float(seeing_pix),6),int(oversample))
+    with _PSF_CACHE_LOCK:
+        psf = _PSF_CACHE.get(key)
+        if psf is not None:
+            _PSF_CACHE.move_to_end(key)
+            return psf
+    psf = DiffusedPSF(*key)
+    with _PSF_CACHE_LOCK:
+        _PSF_CACHE[key] = psf
+        while len(_PSF_CACHE) > PSF_CACHE_SIZE:
+            _PSF_CACHE.popitem(last=False)
+    return psf
+
+def clear_psf_cache():
+    """
+    Remove all cached PSFs
+    """
+    with _PSF_CACHE_LOCK:
+        _PSF_CACHE.clear()
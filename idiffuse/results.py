@@ -0,0 +1,110 @@
+from __future__ import print_function
+import numpy as np
+
+# Fields of ErrCadResult, in the order calculated by Telescope._calc_err_cad()
+ERR_CAD_FIELDS = ('exptime',
+                  'cadence',
+                  'efficiency',
+                  'n_pix',
+                  'n_b',
+                  'star_adu',
+                  'sky_adu',
+                  'sky_adu_per_pixel',
+                  'photometric_noise',
+                  'photon_noise',
+                  'scint_noise',
+                  'tot_noise',
+                  'tot_noise_in_1_min',
+                  'tot_noise_in_30_min')
+
+
+class ErrCadResult(object):
+    """
+    Result of Telescope.get_err_cad_for_adu() with every intermediate value.
+
+    Unpacks as (tot_noise, cadence) so existing code like `err, cad = arc.get_err_cad_for_adu(...)` keeps working.
+    All values are also available as attributes, e.g., result.exptime, result.scint_noise.
+
+    NOTES:
+        exptime, cadence in s; n_pix, n_b in (binned) pixels; star_adu, sky_adu in ADU; sky_adu_per_pixel in ADU/pix;
+        all noise terms in ppm
+    """
+    __slots__ = ERR_CAD_FIELDS
+
+    def __init__(self,**values):
+        for name in ERR_CAD_FIELDS:
+            setattr(self,name,values[name])
+
+    def __iter__(self):
+        yield self.tot_noise
+        yield self.cadence
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            return getattr(self,key)
+        return (self.tot_noise,self.cadence)[key]
+
+    def __repr__(self):
+        return 'ErrCadResult(tot_noise={}ppm, cadence={}s, exptime={}s)'.format(format_value(self.tot_noise,'{:0.2f}'),
+                                                                            format_value(self.cadence,'{:0.3f}'),
+                                                                            format_value(self.exptime,'{:0.3f}'))
+
+    def as_dict(self):
+        """
+        Get all values as a dictionary
+        """
+        return dict((name,getattr(self,name)) for name in ERR_CAD_FIELDS)
+
+    def summary(self):
+        """
+        Get a human readable summary of the exposure time, counts and noise
+        """
+        lines = ['##### Exptime #####',
+                 'Exptime [s]:                  {}'.format(format_value(self.exptime,'{:0.3f}')),
+                 'Total cadence [s]:            {}'.format(format_value(self.cadence,'{:0.3f}')),
+                 'Obs. Efficiency [%]:          {}'.format(format_value(100.*self.efficiency,'{:0.2f}')),
+                 'npix [pix]:                   {}'.format(format_value(self.n_pix,'{:0.2f}')),
+                 'n_b [pix]:                    {}'.format(format_value(self.n_b,'{:0.2f}')),
+                 '',
+                 '##### Counts #####',
+                 'Star counts - Total [adu]:    {} '.format(format_value(self.star_adu,'{:0.2f}')),
+                 'Star counts - /pix [adu/pix]: {} '.format(format_value(self.star_adu/self.n_pix,'{:0.2f}')),
+                 'Sky counts - Total [adu]:     {}'.format(format_value(self.sky_adu,'{:0.2f}')),
+                 'Sky counts - /pix [adu/pix]:  {}'.format(format_value(self.sky_adu_per_pixel,'{:0.2f}')),
+                 '',
+                 '##### Noise in exptime={}s ######'.format(format_value(self.exptime,'{:0.2f}')),
+                 'Photometric noise [ppm]       {}'.format(format_value(self.photometric_noise,'{:0.2f}')),
+                 'Photon noise [ppm]:           {}'.format(format_value(self.photon_noise,'{:0.2f}')),
+                 'Scintillation noise [ppm]:    {}'.format(format_value(self.scint_noise,'{:0.2f}')),
+                 'Total noise [ppm]:            {}'.format(format_value(self.tot_noise,'{:0.2f}')),
+                 '',
+                 '##### Noise ######',
+                 'Noise in 1min [ppm]:          {}'.format(format_value(self.tot_noise_in_1_min,'{:0.2f}')),
+                 'Noise in 30min [ppm]:         {}'.format(format_value(self.tot_noise_in_30_min,'{:0.2f}')),
+                 '#####']
+        return '\n'.join(lines)
+
+def format_value(value,fmt='{:0.2f}'):
+    """
+    Format a scalar or an array of values
+
+    INPUT:
+        value - a number or an array (e.g., from an array of vegamags)
+        fmt - format string for each number
+
+    OUTPUT:
+        string
+    """
+    if np.ndim(value)==0:
+        return fmt.format(float(value))
+    return np.array2string(np.asarray(value,dtype=float),separator=', ',formatter={'float_kind':fmt.format})
+
+def to_records(values):
+    """
+    Convert a dictionary of equal-length arrays to a numpy record array, keeping the key order
+    """
+    names = list(values)
+    return np.rec.fromarrays([np.asarray(values[name]) for name in names],names=names)
@@ -0,0 +1,522 @@
+"""
+Lightweight HTTP/JSON exposure time calculator (ETC) service, using only the standard library (asyncio).
+
+Telescopes and their count rates are kept warm in memory, and requests for the same (endpoint, instrument, filter)
+that arrive within a short batch window are evaluated together in one vectorized call, in a worker thread pool so
+pysynphot work does not block the event loop.
+
+ENDPOINTS:
+    GET  /health      - {"status": "ok", ...}
+    GET  /instruments - names of the registered instruments, see idiffuse.instruments
+    POST /exptime     - Telescope.get_exptime_for_adu(), returns {"exptime": ...}
+    POST /err_cad     - Telescope.get_err_cad_for_adu(), returns all fields of results.ErrCadResult
+    The POST body is a JSON object, e.g., {"instrument": "arc", "filter": "sloan_i_filter.txt", "vegamag": 12.0,
+    "binning": 2}, or a list of such objects, in which case a list of results is returned. Numbers have to be
+    finite, and non-finite results (e.g., the noise of cadences longer than the binning window) are returned as null.
+
+EXAMPLE:
+    idiffuse-server --port 8080
+
+    # or in-process, e.g., for tests
+    with ServerThread(ETCService()) as server:
+        client = ETCClient(server.url)
+        client.err_cad(instrument='arc',filter='sloan_i_filter.txt',vegamag=12.,binning=2)
+"""
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import idiffuse.instruments as instruments
+from idiffuse.catalog import get_telescope
+from idiffuse.telescope import ERR_CAD_DEFAULTS
+
+# Parameters of each endpoint and their defaults (see Telescope.get_exptime_for_adu/get_err_cad_for_adu)
+ENDPOINT_PARAMS = {'exptime': OrderedDict([('vegamag',None),
+                                           ('max_adu_per_pixel',40000.),
+                                           ('binning',1.),
+                                           ('airmass',None)]),
+                   'err_cad': OrderedDict((key,None if key=='vegamag' else value)
+                                          for key,value in ERR_CAD_DEFAULTS.items())}
+
+# Largest accepted request body in bytes
+MAX_BODY_SIZE = 10*1024*1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class RequestError(ValueError):
+    """
+    Invalid request, returned to the client with HTTP status 400
+    """
+    pass
+
+def _reject_constant(name):
+    # json.loads() accepts NaN, Infinity and -Infinity, which are not valid JSON
+    raise RequestError('{} is not a valid JSON number'.format(name))
+
+def _json_float(value):
+    # Non-finite floats are not valid JSON, they are returned as null
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class ETCService(object):
+    """
+    Exposure time calculator service: validates requests, batches them and evaluates the batches.
+
+    Can be used directly from asyncio code with `await service.handle('err_cad',request)`, or over HTTP
+    with serve() / ServerThread.
+
+    NOTES:
+        Requests are grouped by (endpoint, instrument, filter) for *batch_window* seconds (or until *max_batch*
+        requests are pending) and evaluated with one Telescope.get_err_cad_grid() or get_exptime_for_adu() call.
+        Worker threads share the warm Telescope instances, so count rates are only computed once per process.
+    """
+    def __init__(self,
+                 instrument_names=None,
+                 filters=None,
+                 flux_backend='pysynphot',
+                 max_workers=4,
+                 batch_window=0.002,
+                 max_batch=10000):
+        """
+        INPUT:
+            instrument_names - instruments to allow (names in idiffuse.instruments.registry or Telescope classes),
+                               default is all registered instruments and Telescope classes
+            filters          - filters to pre-warm for every allowed instrument in warm(), default is the filters in
+                               the instrument definitions
+            flux_backend     - flux backend, see idiffuse.backends
+            max_workers      - number of worker threads evaluating batches
+            batch_window     - time in s to collect requests into a batch
+            max_batch        - maximum number of requests in a batch
+        """
+        self.instrument_names = None if instrument_names is None else list(instrument_names)
+        self.filters          = None if filters is None else list(filters)
+        self.flux_backend     = flux_backend
+        self.batch_window     = batch_window
+        self.max_batch        = max_batch
+        self.stats            = {'requests': 0, 'batches': 0, 'errors': 0}
+        self._executor        = ThreadPoolExecutor(max_workers=max_workers)
+        self._telescopes      = {}
+        self._lock            = threading.Lock()
+        self._pending         = {}
+        self._t_start         = time.time()
+
+    def __repr__(self):
+        return 'ETCService(instruments={}, flux_backend={!r})'.format(self.instrument_names,self.flux_backend)
+
+    def close(self):
+        """
+        Shut down the worker threads
+        """
+        self._executor.shutdown(wait=True)
+
+    def get_telescope(self,name):
+        """
+        Get the warm Telescope for an instrument name, see catalog.get_telescope()
+        """
+        tel = self._telescopes.get(name)
+        if tel is None:
+            if self.instrument_names is not None and name not in self.instrument_names:
+                raise RequestError('Unknown instrument {}, available: {}'.format(name,', '.join(self.instrument_names)))
+            with self._lock:
+                tel = self._telescopes.get(name)
+                if tel is None:
+                    try:
+                        tel = get_telescope(name,self.flux_backend)
+                    except ValueError as e:
+                        raise RequestError(str(e))
+                    self._telescopes[name] = tel
+        return tel
+
+    def warm(self):
+        """
+        Build all allowed instruments and calculate the count rates of their filters, so the first requests are fast
+        """
+        names = self.instrument_names if self.instrument_names is not None else instruments.registry.names()
+        for name in names:
+            tel = self.get_telescope(name)
+            filters = self.filters
+            if filters is None and name in instruments.registry:
+                filters = instruments.registry.definition(name).get('filters',[])
+            for filter_name in filters or []:
+                tel.get_adu_per_sec(0.,tel.get_bandpass(filter_name))
+
+    def instrument_list(self):
+        """
+        Names of the instruments that can be requested
+        """
+        if self.instrument_names is not None:
+            return list(self.instrument_names)
+        return instruments.registry.names()
+
+    def _parse(self,endpoint,request):
+        if endpoint not in ENDPOINT_PARAMS:
+            raise RequestError('Unknown endpoint {}'.format(endpoint))
+        if not isinstance(request,dict):
+            raise RequestError('Request has to be a JSON object')
+        defaults = ENDPOINT_PARAMS[endpoint]
+        unknown = set(request) - set(defaults) - set(['instrument','filter'])
+        if unknown:
+            raise RequestError('Unknown parameters: {}'.format(', '.join(sorted(unknown))))
+        for key in ('instrument','filter','vegamag'):
+            if request.get(key) is None:
+                raise RequestError('{} has to be given'.format(key))
+        if not isinstance(request['instrument'],str) or not isinstance(request['filter'],str):
+            raise RequestError('instrument and filter have to be strings')
+        params = {}
+        for key, default in defaults.items():
+            value = request.get(key,default)
+            if value is None:
+                continue
+            if isinstance(value,bool) or not isinstance(value,(int,float)):
+                raise RequestError('{} has to be a number, got {!r}'.format(key,value))
+            try:
+                params[key] = float(value)
+            except OverflowError:
+                params[key] = np.inf
+            if not np.isfinite(params[key]):
+                raise RequestError('{} has to be a finite number, got {!r}'.format(key,value))
+        return request['instrument'], request['filter'], params
+
+    def _evaluate(self,endpoint,instrument,filter_name,params_list):
+        """
+        Evaluate a batch of requests with one vectorized call, returns a list of result dictionaries
+        """
+        tel = self.get_telescope(instrument)
+        # Only registered curves, get_bandpass() would also read any file on the server
+        if filter_name not in tel.FILTER_DICT:
+            raise RequestError('Unknown filter {}, see Telescope.FILTER_DICT'.format(filter_name))
+        bp = tel.get_bandpass(filter_name)
+        arrays = dict((key,np.array([params[key] for params in params_list]))
+                      for key in params_list[0])
+        if endpoint=='exptime':
+            exptime = tel.get_exptime_for_adu(arrays['vegamag'],bp,arrays['max_adu_per_pixel'],arrays['binning'],
+                                              arrays.get('airmass'))
+            return [{'exptime': _json_float(value)} for value in np.broadcast_to(exptime,len(params_list))]
+        records = tel.get_err_cad_grid(bp,output='records',**arrays)
+        return [dict((name,_json_float(record[name])) for name in records.dtype.names) for record in records]
+
+    def _flush(self,key):
+        batch = self._pending.pop(key,None)
+        if not batch:
+            return
+        endpoint, instrument, filter_name = key[:3]
+        params_list = [params for params,future in batch]
+        self.stats['batches'] += 1
+        loop = asyncio.get_event_loop()
+        done = loop.run_in_executor(self._executor,self._evaluate,endpoint,instrument,filter_name,params_list)
+
+        def set_results(done):
+            error = done.exception()
+            for i, (params,future) in enumerate(batch):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(done.result()[i])
+        done.add_done_callback(set_results)
+
+    def submit(self,endpoint,request):
+        """
+        Queue a request for the next batch
+
+        INPUT:
+            endpoint - 'exptime' or 'err_cad'
+            request  - dictionary with instrument, filter, vegamag and optionally other parameters of the endpoint
+
+        OUTPUT:
+            asyncio.Future with the result dictionary
+
+        NOTES:
+            Has to be called from the event loop thread. Raises RequestError for invalid requests
+        """
+        return self._submit(endpoint,*self._parse(endpoint,request))
+
+    def _submit(self,endpoint,instrument,filter_name,params):
+        self.stats['requests'] += 1
+        # Batches need the same parameter names, e.g., requests with and without an airmass are evaluated separately
+        key = (endpoint,instrument,filter_name,tuple(sorted(params)))
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            loop.call_later(self.batch_window,self._flush,key)
+        batch.append((params,future))
+        if len(batch) >= self.max_batch:
+            self._flush(key)
+        return future
+
+    async def handle(self,endpoint,request):
+        """
+        Evaluate a request, or a list of requests, see submit()
+
+        OUTPUT:
+            result dictionary, or a list of result dictionaries if *request* is a list
+        """
+        if isinstance(request,list):
+            # Validate the whole list first, so an invalid entry does not leave the others queued
+            parsed = [self._parse(endpoint,r) for r in request]
+            futures = [self._submit(endpoint,*args) for args in parsed]
+            return list(await asyncio.gather(*futures))
+        return await self.submit(endpoint,request)
+
+    async def handle_http(self,method,path,body):
+        """
+        Route an HTTP request
+
+        OUTPUT:
+            (status, JSON-serializable response)
+        """
+        path = path.split('?')[0].rstrip('/') or '/'
+        try:
+            if path=='/health':
+                return 200, {'status': 'ok',
+                             'uptime': time.time()-self._t_start,
+                             'flux_backend': self.flux_backend,
+                             'telescopes': sorted(self._telescopes),
+                             'stats': dict(self.stats)}
+            if path=='/instruments':
+                return 200, {'instruments': self.instrument_list()}
+            endpoint = path.lstrip('/')
+            if endpoint not in ENDPOINT_PARAMS:
+                return 404, {'error': 'Unknown path {}'.format(path)}
+            if method!='POST':
+                return 405, {'error': 'Use POST for {}'.format(path)}
+            try:
+                request = json.loads(body.decode('utf-8'),parse_constant=_reject_constant)
+            except ValueError as e:
+                raise RequestError('Invalid JSON: {}'.format(e))
+            return 200, await self.handle(endpoint,request)
+        except RequestError as e:
+            self.stats['errors'] += 1
+            return 400, {'error': str(e)}
+        except Exception:
+            self.stats['errors'] += 1
+            # Details only go to the server log, they can contain server paths or file contents
+            traceback.print_exc(file=sys.stderr)
+            return 500, {'error': 'Internal server error'}
+
+    async def _handle_connection(self,reader,writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, path, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n',b'\n',b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length',0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    status, response = 400, {'error': 'Invalid Content-Length {!r}'.format(headers['content-length'])}
+                    keep_alive = False
+                elif length > MAX_BODY_SIZE:
+                    status, response = 413, {'error': 'Request body larger than {} bytes'.format(MAX_BODY_SIZE)}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, response = await self.handle_http(method.upper(),path,body)
+                    keep_alive = (headers.get('connection','').lower()!='close' and version=='HTTP/1.1')
+                try:
+                    payload = json.dumps(response,allow_nan=False).encode('utf-8')
+                except ValueError:
+                    traceback.print_exc(file=sys.stderr)
+                    status, payload = 500, json.dumps({'error': 'Internal server error'}).encode('utf-8')
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                             'Connection: {}\r\n\r\n'.format(status,HTTP_REASONS[status],len(payload),
+                                                             'keep-alive' if keep_alive else 'close').encode('latin-1'))
+                writer.write(payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError,ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self,host='127.0.0.1',port=8080):
+        """
+        Start the HTTP server, returns the asyncio.Server
+        """
+        return await asyncio.start_server(self._handle_connection,host,port)
+
+
+class ServerThread(object):
+    """
+    Run an ETCService HTTP server in a background thread with its own event loop, e.g., for tests or notebooks
+
+    EXAMPLE:
+        with ServerThread(ETCService(['arc'])) as server:
+            print(ETCClient(server.url).exptime(instrument='arc',filter='sloan_i_filter.txt',vegamag=12.))
+    """
+    def __init__(self,service=None,host='127.0.0.1',port=0):
+        """
+        INPUT:
+            service - ETCService, default is ETCService()
+            host    - host to bind to
+            port    - port to bind to, 0 for any free port
+        """
+        self.service = service if service is not None else ETCService()
+        self.host    = host
+        self.port    = port
+        self._loop   = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.host,self.port)
+
+    def start(self):
+        """
+        Start the server and wait until it accepts connections
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._server = self._loop.run_until_complete(self.service.serve(self.host,self.port))
+                self.port = self._server.sockets[0].getsockname()[1]
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run,name='idiffuse-server')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        """
+        Stop the server and the worker threads
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+        self.service.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
+
+
+class ETCClient(object):
+    """
+    Minimal blocking client for the ETC service
+
+    EXAMPLE:
+        client = ETCClient('http://localhost:8080')
+        client.err_cad(instrument='arc',filter='sloan_i_filter.txt',vegamag=12.,binning=2)
+        client.exptime([{'instrument':'arc','filter':'sloan_i_filter.txt','vegamag':mag} for mag in (10.,11.,12.)])
+    """
+    def __init__(self,url,timeout=60.):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'ETCClient({!r})'.format(self.url)
+
+    def _call(self,path,data=None):
+        try:
+            from urllib.request import Request, urlopen
+            from urllib.error import HTTPError
+        except ImportError:
+            from urllib2 import Request, urlopen, HTTPError
+        body = None if data is None else json.dumps(data).encode('utf-8')
+        req = Request(self.url+path,data=body,headers={'Content-Type': 'application/json'})
+        try:
+            response = urlopen(req,timeout=self.timeout)
+        except HTTPError as e:
+            message = json.loads(e.read().decode('utf-8')).get('error',str(e))
+            if e.code==400:
+                raise RequestError(message)
+            raise RuntimeError('{} {}: {}'.format(e.code,path,message))
+        return json.loads(response.read().decode('utf-8'))
+
+    def health(self):
+        return self._call('/health')
+
+    def instruments(self):
+        return self._call('/instruments')['instruments']
+
+    def exptime(self,requests=None,**params):
+        """
+        Exposure time for one request given as keywords, or a list of request dictionaries
+        """
+        return self._call('/exptime',params if requests is None else requests)
+
+    def err_cad(self,requests=None,**params):
+        """
+        Noise and cadence for one request given as keywords, or a list of request dictionaries
+        """
+        return self._call('/err_cad',params if requests is None else requests)
+
+def main(argv=None):
+    """
+    Console script entry point, see `idiffuse-server --help`
+    """
+    parser = argparse.ArgumentParser(description='Run the idiffuse exposure time calculator HTTP/JSON service')
+    parser.add_argument('--host',default='127.0.0.1',help='host to bind to')
+    parser.add_argument('--port',type=int,default=8080,help='port to bind to')
+    parser.add_argument('--instruments',nargs='*',default=None,help='instruments to serve, default is all registered')
+    parser.add_argument('--filters',nargs='*',default=None,help='filters to pre-warm, default is from the definitions')
+    parser.add_argument('--flux-backend',default='pysynphot',help="flux backend, 'pysynphot' or 'numpy'")
+    parser.add_argument('--workers',type=int,default=4,help='worker threads')
+    parser.add_argument('--batch-window',type=float,default=0.002,help='time in s to collect requests into a batch')
+    args = parser.parse_args(argv)
+
+    service = ETCService(args.instruments,args.filters,args.flux_backend,args.workers,args.batch_window)
+    print('Warming up {}'.format(', '.join(service.instrument_list())))
+    service.warm()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(service.serve(args.host,args.port))
+    print('Serving on http://{}:{}'.format(args.host,args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        service.close()
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+from __future__ import print_function
+import numpy as np
+from collections import OrderedDict
+import idiffuse.photometry as photometry
+
+# Noise terms drawn for each exposure, in order
+NOISE_TERMS = ['photon','sky','dark','read','digitization','scint']
+
+def _get_airmass(airmass,jd):
+    if callable(airmass):
+        return np.asarray(airmass(jd),dtype=float)
+    if isinstance(airmass,tuple):
+        track_jd, track_airmass = airmass
+        return np.interp(jd,track_jd,track_airmass,left=np.nan,right=np.nan)
+    return np.full(np.shape(jd),float(airmass))
+
+def simulate_light_curves(telescope,
+                          vegamag,
+                          BandPass,
+                          t_start,
+                          t_end,
+                          airmass=1.5,
+                          chunk_duration=3600.,
+                          seed=None,
+                          max_adu_per_pixel=40000.,
+                          binning=2.,
+                          num_ref_stars=1.,
+                          read_time=2.5,
+                          sky_mag_per_arcsec=17.5):
+    """
+    Stream synthetic diffuser-assisted differential light curves, chunk by chunk.
+
+    Exposures are taken back-to-back at the cadence from Telescope.get_err_cad_for_adu() for each star.
+    For each exposure the photon, sky, dark, read, digitization and scintillation noise are drawn as independent
+    Gaussians with the standard deviations of the noise model at the airmass of that exposure.
+
+    INPUT:
+        telescope      - Telescope instance
+        vegamag        - vegamagnitude(s) of the star(s) in the bandpass supplied, float or array
+        BandPass       - pysynphot.BandPass of the observation
+        t_start, t_end - start and end time of the simulation in JD
+        airmass        - airmass as a number, a (jd, airmass) tuple of arrays to interpolate, or a function of jd,
+                         e.g., ephemeris.site_airmass(). Exposures where the airmass is NaN (target down) are skipped
+        chunk_duration - duration in s of the time window covered by each chunk
+        seed           - seed for the random number generator, the output is reproducible for a given seed
+                         and chunk_duration
+        max_adu_per_pixel, binning, num_ref_stars, read_time, sky_mag_per_arcsec - see Telescope.get_err_cad_for_adu().
+                         If sky_mag_per_arcsec is None, the dark sky of Telescope.sky_model at the airmass of each
+                         exposure is used
+
+    OUTPUT:
+        generator of pandas.DataFrame chunks with columns star (index into vegamag), time (JD, mid-exposure),
+        airmass, exptime, the noise draws for each term in NOISE_TERMS (relative flux), sigma (total expected
+        relative noise), and flux (1 + sum of the noise draws)
+
+    NOTES:
+        Only one chunk is held in memory at a time, so memory use does not grow with the length of the simulation
+        or the number of chunks. The count rate is only computed once with pysynphot.
+        Telescope.extinction is not applied, as the exposure times are fixed while the airmass changes.
+
+    EXAMPLE:
+        arc = idiffuse.TelescopeARC()
+        bp = arc.get_bandpass('sloan_i_filter.txt')
+        for chunk in simulate_light_curves(arc,[10.,12.],bp,2458000.6,2458000.9,airmass=idiffuse.ephemeris.site_airmass(32.78,-105.82,330.,20.),seed=42):
+            process(chunk)
+    """
+    import pandas as pd
+    rng = np.random.RandomState(seed)
+    vegamag = np.atleast_1d(np.asarray(vegamag,dtype=float))
+    star = np.arange(len(vegamag))
+    refstar_factor = np.sqrt(1.+1./num_ref_stars)
+    adu_per_sec_zp = telescope._get_adu_per_sec_zeropoint(BandPass)
+
+    # The exposure time does not depend on airmass, so the cadence of each star is fixed
+    nominal = telescope._calc_err_cad(adu_per_sec_zp,vegamag,max_adu_per_pixel,binning,num_ref_stars,
+                                      1.,read_time,telescope._resolve_sky_mag(BandPass,sky_mag_per_arcsec,1.))
+    exptime = nominal['exptime']
+    cadence = nominal['cadence']/86400. # days
+
+    chunk_days = chunk_duration/86400.
+    t0 = t_start
+    while t0 < t_end:
+        t1 = min(t0+chunk_days,t_end)
+        # Exposure k of each star starts at t_start + k*cadence
+        k0 = np.ceil((t0-t_start)/cadence).astype(int)
+        k1 = np.ceil((t1-t_start)/cadence).astype(int)
+        nexp = np.maximum(k1-k0,0)
+        idx = np.repeat(star,nexp)
+        k = np.arange(nexp.sum()) - np.repeat(np.cumsum(nexp)-nexp,nexp) + np.repeat(k0,nexp)
+        time = t_start + k*cadence[idx] + 0.5*exptime[idx]/86400.
+        am = _get_airmass(airmass,time)
+        up = np.isfinite(am)
+        idx, time, am = idx[up], time[up], am[up]
+
+        sky_mag = telescope._resolve_sky_mag(BandPass,sky_mag_per_arcsec,am)
+        r = telescope._calc_err_cad(adu_per_sec_zp,vegamag[idx],max_adu_per_pixel,binning,num_ref_stars,
+                                    am,read_time,sky_mag)
+        terms = photometry.phot_error_terms(r['star_adu'],r['n_pix'],r['n_b'],r['sky_adu_per_pixel'],
+                                            dark=telescope.dark_noise,read=telescope.read_noise,gain=telescope.gain)
+        sigmas = [terms[name]*refstar_factor/r['star_adu'] for name in NOISE_TERMS[:-1]]
+        sigmas.append(r['scint_noise']/1e6)
+        sigmas = np.array(np.broadcast_arrays(*sigmas))
+        draws = rng.standard_normal(sigmas.shape)*sigmas
+
+        columns = OrderedDict([('star',idx),('time',time),('airmass',am),('exptime',exptime[idx])])
+        for name, draw in zip(NOISE_TERMS,draws):
+            columns[name] = draw
+        columns['sigma'] = r['tot_noise']/1e6
+        columns['flux'] = 1. + draws.sum(axis=0)
+        df = pd.DataFrame(columns)
+        yield df.sort_values(['time','star'],kind='mergesort').reset_index(drop=True)
+        t0 = t1
@@ -0,0 +1,182 @@
+from __future__ import print_function
+import numpy as np
+import idiffuse.filter_registry as filter_registry
+
+# Zenith dark sky brightness in Vega mag/arcsec2 vs wavelength in Angstrom, typical for a good dark site near
+# solar minimum (UBVRI from the KPNO/CTIO sky brightness measurements, extended to z and y)
+DARK_SKY = ((3600.,22.0),
+            (4400.,22.7),
+            (5500.,21.8),
+            (6400.,20.9),
+            (7900.,19.9),
+            (9000.,18.8),
+            (10000.,18.1))
+
+# Color of sunlight (moonlight) in Vega magnitudes relative to V, m_band - m_V, vs wavelength in Angstrom
+SOLAR_COLOR = ((3600.,0.81),
+               (4400.,0.65),
+               (5500.,0.),
+               (6400.,-0.36),
+               (7900.,-0.70),
+               (9000.,-0.85),
+               (10000.,-0.95))
+
+# Grids of the lookup tables, see SkyTable
+AIRMASS_GRID = np.linspace(1.,4.,61)
+PHASE_GRID = np.linspace(0.,180.,181)
+SEPARATION_GRID = np.linspace(0.,180.,181)
+MOON_ZENITH_GRID = np.linspace(0.,90.,91)
+
+def ks_airmass(zenith_distance):
+    """
+    Airmass used in the Krisciunas & Schaefer (1991) moonlight model, (1-0.96 sin^2 Z)^-0.5
+
+    INPUT:
+        zenith_distance - zenith distance in degrees
+    """
+    return (1.-0.96*np.sin(np.deg2rad(zenith_distance))**2.)**-0.5
+
+def nanolambert_to_mag(brightness):
+    """
+    Convert a sky brightness in nanoLamberts to V mag/arcsec2 (Krisciunas & Schaefer 1991, eq 1)
+    """
+    with np.errstate(divide='ignore'):
+        return (20.7233-np.log(np.asarray(brightness,dtype=float)/34.08))/0.92104
+
+def mag_to_nanolambert(mag):
+    """
+    Convert a V sky brightness in mag/arcsec2 to nanoLamberts, inverse of nanolambert_to_mag()
+    """
+    return 34.08*np.exp(20.7233-0.92104*np.asarray(mag,dtype=float))
+
+def moon_illumination_to_phase_angle(illumination):
+    """
+    Convert the illuminated fraction of the moon (0 new, 1 full) to the phase angle in degrees (0 full, 180 new)
+    """
+    return np.rad2deg(np.arccos(np.clip(2.*np.asarray(illumination,dtype=float)-1.,-1.,1.)))
+
+
+class SkyTable(object):
+    """
+    Sky brightness lookup tables for one bandpass: dark sky vs airmass plus scattered moonlight vs moon phase,
+    moon-target separation, moon zenith distance and airmass.
+
+    Moonlight follows Krisciunas & Schaefer (1991):
+        B_moon = f(rho) I(alpha) 10**(-0.4 k X(Z_moon)) (1 - 10**(-0.4 k X))
+    and the dark sky brightens with airmass as X 10**(-0.4 k (X-1)). Both are products of functions of one
+    variable each, so each factor is tabulated (in log) on its own 1D grid, and any number of epochs is evaluated
+    by linear interpolation of the tables and a sum, without evaluating the model.
+
+    NOTES:
+        The moonlight is calculated in V and converted to the bandpass with the solar color (SOLAR_COLOR),
+        ignoring the extra blueing from Rayleigh scattering
+    """
+    def __init__(self,dark_sky_mag,moon_color,k):
+        """
+        INPUT:
+            dark_sky_mag - zenith dark sky in the bandpass in Vega mag/arcsec2
+            moon_color   - color of moonlight in the bandpass relative to V, m_band - m_V
+            k            - extinction in the bandpass in mag/airmass
+        """
+        self.dark_sky_mag = float(dark_sky_mag)
+        self.moon_color   = float(moon_color)
+        self.k            = float(k)
+        X = AIRMASS_GRID
+        alpha = PHASE_GRID
+        rho = SEPARATION_GRID
+        # log10 of each factor on its grid
+        self._log_dark   = -0.4*self.dark_sky_mag + np.log10(X) - 0.4*self.k*(X-1.)
+        self._log_phase  = -0.4*(3.84 + 0.026*alpha + 4e-9*alpha**4.)
+        self._log_sep    = np.log10(10.**5.36*(1.06+np.cos(np.deg2rad(rho))**2.) + 10.**(6.15-rho/40.))
+        self._log_moon_z = -0.4*self.k*ks_airmass(MOON_ZENITH_GRID)
+        self._log_target = np.log10(1.-10.**(-0.4*self.k*X))
+
+    def __repr__(self):
+        return 'SkyTable(dark_sky_mag={:0.2f}, moon_color={:0.2f}, k={:0.3f})'.format(self.dark_sky_mag,self.moon_color,
+                                                                                    self.k)
+
+    def sky_mag(self,airmass=1.,moon_phase=180.,moon_sep=90.,moon_alt=-90.):
+        """
+        Sky brightness in the bandpass in Vega mag/arcsec2
+
+        INPUT:
+            airmass    - airmass of the target
+            moon_phase - moon phase angle in degrees, 0 is full and 180 is new, see moon_illumination_to_phase_angle()
+            moon_sep   - moon-target separation in degrees
+            moon_alt   - moon altitude in degrees, no moonlight if below 0
+            all inputs are floats or arrays that broadcast against each other
+
+        OUTPUT:
+            sky brightness in mag/arcsec2
+        """
+        X = np.asarray(airmass,dtype=float)
+        moon_alt = np.asarray(moon_alt,dtype=float)
+        log_dark = np.interp(X,AIRMASS_GRID,self._log_dark)
+        # nanoLamberts -> V flux, then to the bandpass with the moon color
+        log_moon = (np.interp(np.abs(moon_phase),PHASE_GRID,self._log_phase) +
+                    np.interp(moon_sep,SEPARATION_GRID,self._log_sep) +
+                    np.interp(90.-np.clip(moon_alt,0.,90.),MOON_ZENITH_GRID,self._log_moon_z) +
+                    np.interp(X,AIRMASS_GRID,self._log_target))
+        moon_flux = np.where(moon_alt > 0.,
+                             10.**(-0.4*(nanolambert_to_mag(10.**log_moon)+self.moon_color)),0.)
+        return -2.5*np.log10(10.**log_dark + moon_flux)
+
+
+class SkyModel(object):
+    """
+    Sky brightness model: zenith dark sky per bandpass plus moonlight and airmass terms, see SkyTable
+
+    EXAMPLE:
+        model = SkyModel()
+        table = model.get_table(arc.get_bandpass('sloan_i_filter.txt'),k=0.05)
+        geo = idiffuse.ephemeris.moon_geometry(jd,32.78,-105.82,ra=130.,dec=20.)
+        sky = table.sky_mag(geo['airmass'],geo['moon_phase'],geo['moon_sep'],geo['moon_alt'])
+    """
+    def __init__(self,dark_sky=DARK_SKY,solar_color=SOLAR_COLOR,dark_sky_filters=None):
+        """
+        INPUT:
+            dark_sky         - sequence of (wavelength in Angstrom, zenith dark sky in Vega mag/arcsec2), interpolated
+                               at the pivot wavelength of the bandpass
+            solar_color      - sequence of (wavelength in Angstrom, m_band - m_V of sunlight)
+            dark_sky_filters - dictionary of bandpass name -> zenith dark sky in mag/arcsec2, overrides dark_sky,
+                               e.g., from measurements at the site
+        """
+        self.dark_sky         = np.array(dark_sky,dtype=float)
+        self.solar_color      = np.array(solar_color,dtype=float)
+        self.dark_sky_filters = dict(dark_sky_filters or {})
+        self._tables          = {}
+
+    def __repr__(self):
+        return 'SkyModel({} dark sky points, {} filter overrides)'.format(len(self.dark_sky),len(self.dark_sky_filters))
+
+    def dark_sky_mag(self,BandPass):
+        """
+        Zenith dark sky brightness in Vega mag/arcsec2 in a bandpass
+        """
+        name = getattr(BandPass,'name',None)
+        if name in self.dark_sky_filters:
+            return float(self.dark_sky_filters[name])
+        wave = filter_registry.pivot_wavelength(BandPass.wave,BandPass.throughput)
+        return float(np.interp(wave,self.dark_sky[:,0],self.dark_sky[:,1]))
+
+    def get_table(self,BandPass,k,key=None):
+        """
+        Get the SkyTable of a bandpass
+
+        INPUT:
+            BandPass - pysynphot bandpass or filter_registry.FilterCurve
+            k        - extinction in mag/airmass in the bandpass
+            key      - hashable key of the bandpass to cache the table on, e.g., cache.spectral_key(BandPass)
+
+        OUTPUT:
+            SkyTable, shared between calls with the same key and k
+        """
+        table = None if key is None else self._tables.get((key,k))
+        if table is None:
+            wave = filter_registry.pivot_wavelength(BandPass.wave,BandPass.throughput)
+            table = SkyTable(self.dark_sky_mag(BandPass),
+                             np.interp(wave,self.solar_color[:,0],self.solar_color[:,1]),
+                             k)
+            if key is not None:
+                self._tables[(key,k)] = table
+        return table
@@ -0,0 +1,173 @@
+from __future__ import print_function
+import sys
+import time
+import multiprocessing
+import functools
+import idiffuse.instruments as instruments
+from idiffuse.telescope import Telescope, TelescopeARC, TelescopePSUCDK24, ERR_CAD_DEFAULTS
+
+# Per-worker state, set up once per process by _init_worker()
+_WORKER = {}
+
+def default_filters():
+    """
+    Get the names of all filters in Telescope.FILTER_DICT, excluding QE curves
+    """
+    return [name for name in Telescope.FILTER_DICT if '_qe' not in name]
+
+def _init_worker(catalog,telescopes,kwargs):
+    _WORKER['catalog']    = catalog
+    _WORKER['factories']  = telescopes
+    _WORKER['kwargs']     = kwargs
+    _WORKER['telescopes'] = {}
+
+def _get_telescope(i):
+    # Build each telescope once per worker, so QE files and cached count rates are reused between tasks
+    tel = _WORKER['telescopes'].get(i)
+    if tel is None:
+        tel = _WORKER['factories'][i]()
+        _WORKER['telescopes'][i] = tel
+    return tel
+
+def _run_task(task):
+    start, stop, tel_index, filter_name, mag_column = task
+    tel = _get_telescope(tel_index)
+    catalog = _WORKER['catalog'].iloc[start:stop]
+    params = dict((key,catalog[key].values) for key in ERR_CAD_DEFAULTS if key in catalog)
+    params['vegamag'] = catalog[mag_column].values
+    params.update(_WORKER['kwargs'])
+    df = tel.get_err_cad_grid(tel.get_bandpass(filter_name),**params)
+    df.insert(0,'target',catalog.index.values)
+    df.insert(0,'filter',filter_name)
+    df.insert(0,'telescope',tel.name)
+    return df
+
+def _print_progress(done,total,t_start,label='Sweep'):
+    elapsed = time.time()-t_start
+    sys.stderr.write('\r{}: {}/{} tasks ({:0.1f}s)'.format(label,done,total,elapsed))
+    if done==total:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+def pool_imap(func,
+              tasks,
+              initializer=None,
+              initargs=(),
+              worker_state=None,
+              processes=None,
+              ordered=True,
+              progress=True,
+              label='Sweep'):
+    """
+    Run func over tasks in a process pool, yielding the results as they come in.
+
+    INPUT:
+        func         - picklable function of one task
+        tasks        - list of picklable tasks
+        initializer  - function called with *initargs* once per worker to set up state shared between its tasks
+        worker_state - dictionary the initializer fills, cleared after running in this process
+        processes    - number of worker processes, default is the number of CPUs. If 1, run in this process
+        ordered      - if True, yield the results in the order of the tasks, otherwise as they are done
+        progress     - if True, print progress to stderr. Can also be a callable progress(done,total)
+        label        - label of the progress printed to stderr
+
+    OUTPUT:
+        generator of results
+
+    NOTES:
+        The pool is terminated if a task raises or the generator is closed early
+    """
+    if progress is True:
+        t_start = time.time()
+        progress = lambda done,total: _print_progress(done,total,t_start,label)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes,max(len(tasks),1))
+    done = 0
+    if processes==1:
+        if initializer is not None:
+            initializer(*initargs)
+        try:
+            for result in map(func,tasks):
+                done += 1
+                if progress:
+                    progress(done,len(tasks))
+                yield result
+        finally:
+            if worker_state is not None:
+                worker_state.clear()
+    else:
+        pool = multiprocessing.Pool(processes,initializer=initializer,initargs=initargs)
+        try:
+            for result in (pool.imap if ordered else pool.imap_unordered)(func,tasks):
+                done += 1
+                if progress:
+                    progress(done,len(tasks))
+                yield result
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+def run_sweep(catalog,
+              telescopes=(TelescopeARC,TelescopePSUCDK24),
+              filters=None,
+              mag_column='vegamag',
+              processes=None,
+              chunksize=5000,
+              progress=True,
+              **kwargs):
+    """
+    Evaluate every target in a catalog against every telescope and filter with a process pool.
+
+    The Cartesian product of telescopes x filters x catalog chunks is distributed over the pool, and every
+    task is a single vectorized Telescope.get_err_cad_grid() call.
+
+    INPUT:
+        catalog    - pandas.DataFrame with one row per target. Columns named after the parameters of
+                     Telescope.get_err_cad_for_adu() (airmass, binning, ...) are used per target
+        telescopes - Telescope subclasses (or other picklable zero-argument callables returning a Telescope),
+                     or instrument names in idiffuse.instruments.registry, e.g., ('arc','psu_cdk24')
+        filters    - filter names in Telescope.FILTER_DICT, default is all bundled filters except QE curves
+        mag_column - catalog column with the Vega magnitude, or a dict of filter name -> column name to use
+                     a different magnitude column for each filter
+        processes  - number of worker processes, default is the number of CPUs. If 1, run in this process
+        chunksize  - number of catalog rows per task
+        progress   - if True, print progress to stderr. Can also be a callable progress(done,total)
+        **kwargs   - parameters of Telescope.get_err_cad_for_adu() applied to all targets, override catalog columns
+
+    OUTPUT:
+        pandas.DataFrame with columns telescope, filter, target (the catalog index), the input parameters and the
+        outputs of Telescope.get_err_cad_grid(). Rows are ordered by telescope, filter and catalog order,
+        independent of the number of processes.
+
+    NOTES:
+        Each worker builds its telescopes once, and bandpasses are parsed once per worker by the filter registry,
+        so the pysynphot work per worker is one count rate per (telescope, filter).
+
+    EXAMPLE:
+        catalog = pd.DataFrame({'vegamag':np.random.uniform(8,16,100000),'airmass':1.3})
+        df = idiffuse.sweep.run_sweep(catalog,filters=['sloan_r_filter.txt','sloan_i_filter.txt'],binning=2)
+    """
+    import pandas as pd
+    if filters is None:
+        filters = default_filters()
+    if not isinstance(mag_column,dict):
+        mag_column = dict((filter_name,mag_column) for filter_name in filters)
+    telescopes = [functools.partial(instruments.get_instrument,tel) if isinstance(tel,str) else tel
+                  for tel in telescopes]
+    columns = sorted(set(mag_column[f] for f in filters) | set(k for k in ERR_CAD_DEFAULTS if k in catalog))
+    catalog = catalog[columns]
+
+    tasks = [(start,min(start+chunksize,len(catalog)),i,filter_name,mag_column[filter_name])
+             for i in range(len(telescopes))
+             for filter_name in filters
+             for start in range(0,len(catalog),chunksize)]
+    results = list(pool_imap(_run_task,tasks,_init_worker,(catalog,telescopes,kwargs),_WORKER,processes,
+                             progress=progress))
+    if len(results)==0:
+        return pd.DataFrame()
+    return pd.concat(results,ignore_index=True)
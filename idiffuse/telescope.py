@@ -1,12 +1,36 @@
 from __future__ import print_function
 import numpy as np
-import pandas as pd
 import idiffuse.photometry as photometry
 import idiffuse.diffuser as diffuser
-import pysynphot as S
-import matplotlib.pyplot as plt
+import idiffuse.psf as psf
+import idiffuse.cache as cache
+import idiffuse.backends as backends
+import idiffuse.filter_registry as filter_registry
+import idiffuse.instrumentation as instrumentation
+import idiffuse.extinction as extinction
+import idiffuse.sky as sky
+from idiffuse.results import ErrCadResult, to_records
+import numbers
+import copy
 import os
-import glob
+from collections import OrderedDict
+
+# Default parameters of Telescope.get_err_cad_for_adu(), used by the vectorized Telescope.get_err_cad_grid()
+ERR_CAD_DEFAULTS = OrderedDict([('vegamag',np.nan),
+                                ('max_adu_per_pixel',40000.),
+                                ('binning',2.),
+                                ('num_ref_stars',1.),
+                                ('airmass',1.5),
+                                ('read_time',2.5),
+                                ('sky_mag_per_arcsec',17.5)])
+
+# Telescope parameters that can be changed with Telescope.with_params(), in the order of Telescope.__init__
+TELESCOPE_PARAMS = ('name','diameter','fnum','flength','gain','pix_size','fov','num_pix','plt_scale','dark_noise',
+                    'read_noise','altitude','central_obstruction','QE','Throughput','diffuser_angle',
+                    'diffuser_dist_from_detector','flux_backend','extinction')
+
+# Attributes that the derived diffuser values (diffuser_fwhm_pix, ...) depend on
+DIFFUSER_INPUTS = ('diffuser_angle','diffuser_dist_from_detector','pix_size','plt_scale')
 
 
 class Telescope(object):
@@ -16,17 +40,25 @@ class Telescope(object):
     Can be used to calculate 
 
     NOTES:
-        - Depends on pysynphot for flux calculations
+        - Depends on pysynphot for flux calculations by default, set flux_backend='numpy' to use the
+          pure NumPy backend with a bundled Vega spectrum instead
+        - pysynphot, pandas and matplotlib are imported on first use, so importing idiffuse stays fast
 
     EXAMPLE:
         See TelescopeARC() class, which implements the ARC 3.5m telescope at APO
     """
-    # Get filter names, save as a dict
+    # Filter names -> filenames, a read-only dict backed by the filter registry
     DIRNAME = os.path.dirname(__file__)
-    FILTER_DIRNAME = os.path.join(DIRNAME,'filters')
-    FILTER_FILENAMES = glob.glob(os.path.join(FILTER_DIRNAME,"*"))
-    FILTER_BASENAMES = [os.path.basename(i) for i in FILTER_FILENAMES]
-    FILTER_DICT = dict(zip(FILTER_BASENAMES, FILTER_FILENAMES))
+    FILTER_DIRNAME = filter_registry.FILTER_DIRNAME
+    FILTER_DICT = filter_registry.registry
+    # Optional cache.ZeroPointDiskCache shared by all telescopes, set per instance or class to enable
+    disk_cache = cache.default_disk_cache()
+    # Flux backend used for count rates, 'pysynphot' or 'numpy' (see idiffuse.backends), set per instance or class
+    flux_backend = 'pysynphot'
+    # Optional extinction.ExtinctionCurve, set per instance or class to attenuate the star flux with airmass
+    extinction = None
+    # sky.SkyModel used for sky brightnesses, see get_sky_mag(), set per instance or class
+    sky_model = sky.SkyModel()
     def __init__(self,
                  name,
                  diameter,
@@ -59,8 +91,9 @@ class Telescope(object):
              read_noise - read noise in e^2
              altitude   - altitude in m
              central_obstruction - central obstruction, number from 0-1
-             QE         - pysynphot.FileSpectralElement
-             Throughput - pysynphot.UniformTransmission
+             QE         - pysynphot.FileSpectralElement, or a filter registry name or filename of a QE curve (loaded on first use)
+             Throughput - pysynphot spectral element, a flat throughput as a number, or a filter_registry.FilterCurve
+                          (converted on first use)
              diffuser_angle - diffuser opening angle in degrees
              diffuser_dist_from_detector - distance of diffuser from detector in mm
         EXAMPLE:
@@ -78,22 +111,126 @@ class Telescope(object):
         self.read_noise                  = read_noise
         self.altitude                    = altitude
         self.central_obstruction         = central_obstruction
-        self.QE                          = QE
-        self.Throughput                  = Throughput
+        self._QE                         = QE
+        self._Throughput                 = Throughput
+
+        # Vega count rates per cm2 at vegamag=0, keyed on the QE, Throughput and BandPass contents
+        self._zeropoint_cache            = {}
+        # extinction.AirmassTable instances, keyed on the QE, Throughput, BandPass and extinction contents
+        self._airmass_tables             = {}
+        # sky.SkyTable instances, keyed on the BandPass contents, sky model and extinction
+        self._sky_tables                 = {}
 
-        # Diffuser related values
+        # Diffuser related values, diffuser_fwhm_pix etc. are derived from these on first use
         self.diffuser_angle              = diffuser_angle
         self.diffuser_dist_from_detector = diffuser_dist_from_detector
-        self.diffuser_fwhm_pix = diffuser.calculate_diffuser_fwhm(self.diffuser_angle,
-                                                                  self.diffuser_dist_from_detector,
-                                                                  self.pix_size)
-        self.diffuser_fwhm_arcsec = self.diffuser_fwhm_pix*self.plt_scale
-        self.diffuser_fwhm_total_npix = np.pi*(self.diffuser_fwhm_pix/2.)**2.0
+
+    def __setattr__(self,name,value):
+        if getattr(self,'_frozen',False) and not name.startswith('_'):
+            raise AttributeError('{} is frozen and shared, can not set {}. Use with_params() for a modified copy'.format(self.name,name))
+        object.__setattr__(self,name,value)
+        if name in DIFFUSER_INPUTS:
+            # Invalidate the derived diffuser values
+            self.__dict__.pop('_diffuser_values',None)
+
+    def _get_diffuser_values(self):
+        values = self.__dict__.get('_diffuser_values')
+        if values is None:
+            fwhm_pix = diffuser.calculate_diffuser_fwhm(self.diffuser_angle,self.diffuser_dist_from_detector,self.pix_size)
+            values = (fwhm_pix,fwhm_pix*self.plt_scale,np.pi*(fwhm_pix/2.)**2.0)
+            self._diffuser_values = values
+        return values
+
+    @property
+    def diffuser_fwhm_pix(self):
+        """
+        Diameter of the diffused PSF in unbinned pixels, see diffuser.calculate_diffuser_fwhm()
+
+        NOTES:
+            Recalculated when diffuser_angle, diffuser_dist_from_detector, pix_size or plt_scale change
+        """
+        return self._get_diffuser_values()[0]
+
+    @property
+    def diffuser_fwhm_arcsec(self):
+        """
+        Diameter of the diffused PSF in arcsec
+        """
+        return self._get_diffuser_values()[1]
+
+    @property
+    def diffuser_fwhm_total_npix(self):
+        """
+        Number of unbinned pixels in the diffused PSF
+        """
+        return self._get_diffuser_values()[2]
+
+    def with_params(self,**params):
+        """
+        Get a modified copy of the telescope, e.g., for design studies over many diffuser geometries
+
+        INPUT:
+            **params - new values of any of TELESCOPE_PARAMS, e.g., diffuser_angle=0.5, pix_size=13.5
+
+        OUTPUT:
+            Telescope of the same class, not frozen, with the new parameter values
+
+        NOTES:
+            Copy-on-write: the copy shares the QE and Throughput elements and the count rate caches with this
+            instance (their keys only depend on the spectral contents), so no curves are parsed and no count rates
+            are recalculated. Area and gain are applied on every call, so they can be changed freely.
+
+        EXAMPLE:
+            arc = TelescopeARC()
+            for angle in np.arange(0.1,1.0,0.01):
+                tel = arc.with_params(diffuser_angle=angle)
+                tel.get_err_cad_for_adu(12.,bp,verbose=False)
+        """
+        unknown = set(params) - set(TELESCOPE_PARAMS)
+        if unknown:
+            raise TypeError('Unknown parameters: {}'.format(', '.join(sorted(unknown))))
+        new = copy.copy(self)
+        new.__dict__.pop('_frozen',None)
+        for name, value in params.items():
+            setattr(new,name,value)
+        return new
+
+    def state_key(self):
+        """
+        Hashable key of the telescope parameters, with the QE and Throughput described by their contents
+
+        OUTPUT:
+            tuple of (name, value) pairs of TELESCOPE_PARAMS, equal for telescopes that give the same results
+        """
+        key = []
+        for name in TELESCOPE_PARAMS:
+            if name=='QE':
+                value = cache.spectral_key(self._QE if not isinstance(self._QE,str)
+                                           else filter_registry.registry.get_curve(self._QE))
+            elif name=='Throughput':
+                value = cache.spectral_key(self._Throughput)
+            elif name=='extinction':
+                value = None if self.extinction is None else self.extinction.key
+            else:
+                value = getattr(self,name)
+                value = value if isinstance(value,str) else float(value)
+            key.append((name,value))
+        return tuple(key)
+
+    def freeze(self):
+        """
+        Make the public attributes read-only, e.g., for instances shared by idiffuse.instruments.InstrumentRegistry
+
+        NOTES:
+            Caches (underscored attributes) are still updated. Returns self
+        """
+        self._frozen = True
+        return self
 
     def __str__(self):
         outstring = ""
         outstring += "Telescope: \t\t\t{}".format(self.name)+"\n"
-        outstring += "Throughput (flat) (%): \t\t{:0.3f}".format(100*float(str(self.Throughput)))+"\n"
+        outstring += "Throughput (flat) (%): \t\t{:0.3f}".format(100*self.throughput_value)+"\n"
         outstring += "Diameter (cm):\t\t\t{:0.3f}".format(self.diameter)+"\n"
         outstring += "Fnum: \t\t\t\t{:0.3f}".format(self.fnum)+"\n"
         outstring += "Focal length (m): \t\t{:0.3f}".format(self.flength)+"\n"
@@ -116,6 +253,21 @@ class Telescope(object):
         """
         return sorted(self.FILTER_DICT.values())
 
+    def get_bandpass(self,name):
+        """
+        Get a pysynphot bandpass for a filter in FILTER_DICT
+
+        INPUT:
+            name - filter name, e.g., 'sloan_i_filter.txt', or a filename of a two-column ASCII curve
+
+        OUTPUT:
+            pysynphot.ArrayBandpass, shared between calls
+
+        NOTES:
+            Curves are parsed once per process, see idiffuse.filter_registry
+        """
+        return filter_registry.registry.get_bandpass(name)
+
     def plot_throughput(self,bandpass=None,bandpass_name='Supplied BandPass'):
         """
         Plot a throughput plot of the telescope.
@@ -132,6 +284,8 @@ class Telescope(object):
         else:
             combined = self.QE * self.Throughput
 
+        import matplotlib.pyplot as plt
+
         # Plot
         fig, ax = plt.subplots(dpi=200,figsize=(8,4))
 
@@ -158,7 +312,45 @@ class Telescope(object):
         ax.set_title('Throughput: {}'.format(self.name),fontsize=15)
 
     def __repr__(self):
-        return '{} D={:0.1f}cm Throughput={:0.3f}%'.format(self.__class__,self.diameter,100*float(str(self.Throughput)))
+        return '{} D={:0.1f}cm Throughput={:0.3f}%'.format(self.__class__,self.diameter,100*self.throughput_value)
+
+    @property
+    def QE(self):
+        """
+        Quantum efficiency as a pysynphot spectral element
+        """
+        if isinstance(self._QE,str):
+            self._QE = filter_registry.registry.get_bandpass(self._QE)
+        return self._QE
+
+    @QE.setter
+    def QE(self,value):
+        self._QE = value
+
+    @property
+    def Throughput(self):
+        """
+        Atmospheric+telescope throughput as a pysynphot spectral element
+        """
+        if isinstance(self._Throughput,numbers.Number):
+            import pysynphot as S
+            self._Throughput = S.UniformTransmission(self._Throughput)
+        elif hasattr(self._Throughput,'to_pysynphot'):
+            self._Throughput = self._Throughput.to_pysynphot()
+        return self._Throughput
+
+    @Throughput.setter
+    def Throughput(self,value):
+        self._Throughput = value
+
+    @property
+    def throughput_value(self):
+        """
+        Flat throughput as a fraction, without importing pysynphot if the throughput is still a number.
+        For a wavelength dependent throughput, the peak throughput is returned.
+        """
+        wave, throughput = backends.element_arrays(self._Throughput)
+        return float(np.max(throughput))
 
     @property
     def area(self):
@@ -167,36 +359,161 @@ class Telescope(object):
         """
         return np.pi*((self.diameter/2.)**2.)*(1-self.central_obstruction)
 
-    def get_adu_per_sec(self,vegamag,BandPass):
+    def get_adu_per_sec(self,vegamag,BandPass,airmass=None):
         """
         Get the photon count in phot/s for a star with a Vega magnitude of *vegamag* in a given pysynphot.BandPass
 
         These are the total photon counts the telescope/imager will see.
 
         INPUT:
-            vegamag  - Vega magnitude in a given bandpass
-            BandPass - pysynphot.BandPass class
+            vegamag  - Vega magnitude in a given bandpass, can be a float or an array
+            BandPass - pysynphot.BandPass class, or a filter_registry.FilterCurve
+            airmass  - airmass, float or array. If given and self.extinction is set, the flux is attenuated
+                       by the atmospheric transmission, see get_atmospheric_transmission()
 
         OUTPUT:
-            photons per second
+            photons per second, same shape as *vegamag* (broadcast with *airmass*)
 
         NOTES:
             Accounts for QE
+            The count rate scales exactly as 10**(-0.4*vegamag) for a fixed bandpass, so the flux backend
+            (pysynphot by default) is only used to calculate the count rate at vegamag=0.
+        """
+        return (self._get_adu_per_sec_zeropoint(BandPass)*self.get_atmospheric_transmission(BandPass,airmass)*
+                10.**(-0.4*np.asarray(vegamag,dtype=float)))
+
+    def _get_elements(self,BandPass):
+        # Spectral elements of an observation, with the QE as a FilterCurve while it has not been converted to pysynphot
+        return [self._QE if not isinstance(self._QE,str) else filter_registry.registry.get_curve(self._QE),
+                self._Throughput,
+                BandPass]
+
+    def _get_adu_per_sec_zeropoint(self,BandPass):
+        """
+        Get the ADU count rate for a star with a Vega magnitude of 0 in a given pysynphot.BandPass
+
+        NOTES:
+            The count rate per unit area from the flux backend is cached per (backend, QE, Throughput, BandPass)
+            contents, so changing any of them results in a new calculation. Area and gain are applied on every call.
+            If self.disk_cache is set, it is consulted before calling the flux backend, with keys that also include
+            the reference area and Vega spectrum of the backend.
         """
-        # Convolve QE, BandPass, and Throughput
-        CombinedBP = self.QE*self.Throughput*BandPass
-        # Use Vega magnitudes
-        VegaSpectrum = S.Vega.renorm(vegamag,'vegamag',CombinedBP)
-        # Define observation
-        obs = S.Observation(VegaSpectrum, CombinedBP, binset=VegaSpectrum.GetWaveSet())
-        # pysynphot is automatically set up to calculate for Hubble, we just need to scale the area
-        hubble_area = S.refs.PRIMARY_AREA
-        electrons_per_sec = (obs.countrate()/hubble_area)*self.area # electrons per second, as we are using QE information
+        backend = backends.get_backend(self.flux_backend)
+        elements = self._get_elements(BandPass)
+        key = (backend.name,)+tuple(cache.spectral_key(element) for element in elements)
+        electrons_per_sec_per_cm2 = self._zeropoint_cache.get(key)
+        if electrons_per_sec_per_cm2 is None and self.disk_cache is not None:
+            disk_key = cache.hash_key(key,backend.cache_token())
+            electrons_per_sec_per_cm2 = self.disk_cache.get(disk_key)
+            if electrons_per_sec_per_cm2 is not None:
+                self._zeropoint_cache[key] = electrons_per_sec_per_cm2
+        if electrons_per_sec_per_cm2 is None:
+            t_start = instrumentation.start()
+            # Convolve QE, BandPass, and Throughput with Vega
+            electrons_per_sec_per_cm2 = backend.countrate_per_cm2(elements)
+            self._zeropoint_cache[key] = electrons_per_sec_per_cm2
+            instrumentation.stop(backend.name,t_start)
+            if self.disk_cache is not None:
+                self.disk_cache.set(disk_key,electrons_per_sec_per_cm2)
+        electrons_per_sec = electrons_per_sec_per_cm2*self.area # electrons per second, as we are using QE information
         # convert to adu_per_sec
         adu_per_sec = electrons_per_sec / self.gain
         return adu_per_sec
 
-    def get_exptime_for_adu(self,vegamag,BandPass,max_adu_per_pixel=40000.,binning=1):
+    def get_atmospheric_transmission(self,BandPass,airmass):
+        """
+        Fraction of the flux of a star in a bandpass transmitted through the atmosphere at a given airmass
+
+        INPUT:
+            BandPass - pysynphot.BandPass class, or a filter_registry.FilterCurve
+            airmass  - airmass, float or array
+
+        OUTPUT:
+            transmission with the shape of *airmass*, or 1. if self.extinction is None or airmass is None
+
+        NOTES:
+            The transmission vs airmass is integrated over the Vega spectrum, the QE, Throughput and BandPass once
+            per bandpass and extinction curve (see extinction.AirmassTable), after which any number of airmasses
+            are interpolated without further spectral integrations.
+            The flat Throughput should then not include an atmosphere term.
+        """
+        if self.extinction is None or airmass is None:
+            return 1.
+        elements = self._get_elements(BandPass)
+        key = tuple(cache.spectral_key(element) for element in elements)+(self.extinction.key,)
+        table = self._airmass_tables.get(key)
+        if table is None:
+            t_start = instrumentation.start()
+            table = extinction.AirmassTable(elements,self.extinction)
+            self._airmass_tables[key] = table
+            instrumentation.stop('extinction',t_start)
+        return table(airmass)
+
+    def get_sky_mag(self,BandPass,airmass=1.,moon_phase=180.,moon_sep=90.,moon_alt=-90.):
+        """
+        Sky brightness in a bandpass from self.sky_model, with moonlight and airmass terms
+
+        INPUT:
+            BandPass   - pysynphot.BandPass class, or a filter_registry.FilterCurve
+            airmass    - airmass of the target
+            moon_phase - moon phase angle in degrees, 0 is full and 180 is new
+            moon_sep   - moon-target separation in degrees
+            moon_alt   - moon altitude in degrees, default is below the horizon (dark sky)
+            all inputs except BandPass are floats or arrays that broadcast, e.g., from ephemeris.moon_geometry()
+
+        OUTPUT:
+            sky brightness in Vega mag/arcsec2, e.g., for sky_mag_per_arcsec in get_err_cad_grid()
+
+        NOTES:
+            The sky lookup tables (see sky.SkyTable) are built once per bandpass, so evaluating many epochs of a night
+            is a vectorized interpolation. The extinction coefficient is taken from self.extinction at the pivot
+            wavelength, or from the extinction model at the telescope altitude if self.extinction is None.
+
+        EXAMPLE:
+            geo = idiffuse.ephemeris.moon_geometry(jd,32.78,-105.82,ra=130.,dec=20.)
+            sky_mag = arc.get_sky_mag(bp,geo['airmass'],geo['moon_phase'],geo['moon_sep'],geo['moon_alt'])
+            df = arc.get_err_cad_grid(bp,vegamag=12.,airmass=geo['airmass'],sky_mag_per_arcsec=sky_mag)
+        """
+        ext = self.extinction
+        key = (cache.spectral_key(BandPass),id(self.sky_model),ext.key if ext is not None else self.altitude)
+        table = self._sky_tables.get(key)
+        if table is None:
+            if ext is None:
+                ext = extinction.ExtinctionCurve.from_model(altitude=self.altitude)
+            wave = filter_registry.pivot_wavelength(BandPass.wave,BandPass.throughput)
+            table = self.sky_model.get_table(BandPass,float(ext(wave)))
+            self._sky_tables[key] = table
+        return table.sky_mag(airmass,moon_phase,moon_sep,moon_alt)
+
+    def get_sky_adu_per_sec(self,BandPass,airmass=1.,moon_phase=180.,moon_sep=90.,moon_alt=-90.):
+        """
+        Sky count rate in ADU/s/arcsec2, see get_sky_mag() for the inputs
+        """
+        return self._get_adu_per_sec_zeropoint(BandPass)*10.**(-0.4*self.get_sky_mag(BandPass,airmass,moon_phase,
+                                                                                     moon_sep,moon_alt))
+
+    def _resolve_sky_mag(self,BandPass,sky_mag_per_arcsec,airmass):
+        # None or NaN sky magnitudes are replaced by the dark sky of self.sky_model at the airmass
+        if isinstance(sky_mag_per_arcsec,numbers.Number) and not np.isnan(sky_mag_per_arcsec):
+            return sky_mag_per_arcsec
+        airmass = 1. if airmass is None else airmass
+        if sky_mag_per_arcsec is None:
+            return self.get_sky_mag(BandPass,airmass)
+        sky_mag_per_arcsec = np.asarray(sky_mag_per_arcsec,dtype=float)
+        if np.isnan(sky_mag_per_arcsec).any():
+            sky_mag_per_arcsec = np.where(np.isnan(sky_mag_per_arcsec),self.get_sky_mag(BandPass,airmass),
+                                          sky_mag_per_arcsec)
+        return sky_mag_per_arcsec
+
+    def clear_zeropoint_cache(self):
+        """
+        Clear the cached vegamag=0 count rates used by get_adu_per_sec(), the airmass tables and the sky tables
+        """
+        self._zeropoint_cache.clear()
+        self._airmass_tables.clear()
+        self._sky_tables.clear()
+
+    def get_exptime_for_adu(self,vegamag,BandPass,max_adu_per_pixel=40000.,binning=1,airmass=None):
         """
         Get the maximum exposure time to expose for a given ADU. This assumes a perfectly flat-top-hat diffused PSF.
 
@@ -205,56 +522,132 @@ class Telescope(object):
             BandPass - pysynphot.bandpass
             max_adu_per_pixel - maximum adu in the diffused PSF
             binning - binning (1, 2 or 4 for ARCTIC)
+            airmass - airmass, only used if self.extinction is set, see get_adu_per_sec()
 
         OUTPUT:
             exposure time in s to reach the *max_adu_per_pixel* counts
 
         NOTES:
+            All inputs except BandPass can be arrays, which are broadcast against each other
         """
-        diffuser_fwhm_total_npix = self.diffuser_fwhm_total_npix/(binning*binning)
-        adu_per_sec = self.get_adu_per_sec(vegamag,BandPass) 
+        diffuser_fwhm_total_npix = self.diffuser_fwhm_total_npix/(np.asarray(binning,dtype=float)**2.)
+        adu_per_sec = self.get_adu_per_sec(vegamag,BandPass,airmass)
         total_adu_in_aperture = diffuser_fwhm_total_npix * max_adu_per_pixel
         max_exptime = total_adu_in_aperture/adu_per_sec
         return max_exptime
 
-    def get_err_cad_for_adu(self,
-                            vegamag,
-                            BandPass,
-                            max_adu_per_pixel=40000.,
-                            binning=2.,
-                            num_ref_stars=1.,
-                            airmass=1.5,
-                            read_time=2.5,
-                            sky_mag_per_arcsec=17.5,
-                            verbose=True):
+    def get_psf(self,binning=1.,seeing=1.0,oversample=5):
         """
-        Calculate the total photometric error and cadence, assuming a top-hat PSF for the self.diffuser_opening_angle.
+        Get the pixelized diffused PSF: the diffuser top-hat convolved with Gaussian seeing.
 
-        This calculates the cadence needed to expose on the telescope to reach a maximum of *max_adu_per_pixel* counts
-        per pixel on the detector, assuming a top-hat diffused PSF.
+        INPUT:
+            binning    - binning mode
+            seeing     - seeing FWHM in arcsec
+            oversample - oversampling used to build the PSF, see psf.DiffusedPSF
+
+        OUTPUT:
+            psf.DiffusedPSF, cached per (diffuser FWHM, binning, seeing)
+        """
+        return psf.get_diffused_psf(self.diffuser_fwhm_pix/binning,seeing/(self.plt_scale*binning),oversample)
+
+    def get_exptime_for_peak_adu(self,vegamag,BandPass,max_adu_per_pixel=40000.,binning=1,seeing=1.0,airmass=None):
+        """
+        Get the maximum exposure time before the peak pixel of the diffused PSF reaches *max_adu_per_pixel*.
+
+        Unlike get_exptime_for_adu(), which assumes a perfectly flat top-hat, this uses the PSF from get_psf(),
+        so the seeing wings and the pixelization of the top-hat edge are taken into account.
 
         INPUT:
-            vegamag           - vegamagnitude in the bandpass supplied
-            BandPass          - pysynphot.BandPass of the observation
-            max_adu_per_pixel - maximum ADU counts per pixel, assumes a top-hat PSF
-            binning           - binning mode used
-            num_ref_stars     - number of equally bright reference stars as the target
-            airmass           - airmass of observation
-            read_time         - read time in seconds
-            sky_mag_per_arcsec- sky magnitude of the sky in the full PSF
-            verbose=True      - if True, print out useful results
+            vegamag - vegamagnitude of star in given bandpass, float or array
+            BandPass - pysynphot.bandpass
+            max_adu_per_pixel - maximum adu in the peak pixel
+            binning - binning mode
+            seeing - seeing FWHM in arcsec
+            airmass - airmass, only used if self.extinction is set, see get_adu_per_sec()
 
         OUTPUT:
-            tot_error - total photometric error including: photon, dark, read, sky, digitization and scintillation noise
-            cadence   - total cadence (including read_time) corresponding to the photometric precision returned
+            exposure time in s for the peak pixel to reach *max_adu_per_pixel* counts
+        """
+        peak_fraction = self.get_psf(binning,seeing).peak_fraction
+        return max_adu_per_pixel/(self.get_adu_per_sec(vegamag,BandPass,airmass)*peak_fraction)
 
-        NOTES:
+    def get_optimal_aperture(self,
+                             vegamag,
+                             BandPass,
+                             max_adu_per_pixel=40000.,
+                             binning=1.,
+                             seeing=1.0,
+                             sky_mag_per_arcsec=17.5,
+                             airmass=None):
+        """
+        Get the peak-limited exposure time and the aperture radius that minimizes the photometric error.
+
+        INPUT:
+            vegamag            - vegamagnitude of star(s) in given bandpass, float or array
+            BandPass           - pysynphot.BandPass of the observation
+            max_adu_per_pixel  - maximum ADU counts in the peak pixel
+            binning            - binning mode
+            seeing             - seeing FWHM in arcsec
+            sky_mag_per_arcsec - sky magnitude per arcsec2, as observed (not attenuated by extinction),
+                                 None for the dark sky from get_sky_mag()
+            airmass            - airmass, only used if self.extinction is set or for the dark sky, see get_adu_per_sec()
+
+        OUTPUT:
+            OrderedDict with arrays of:
+            exptime           - exposure time in s, see get_exptime_for_peak_adu()
+            ap_radius         - optimal aperture radius in binned pixels
+            encircled_energy  - fraction of the star flux in the aperture
+            photometric_noise - photometric noise in ppm at the optimal aperture, without scintillation
+        """
+        p = self.get_psf(binning,seeing)
+        adu_per_sec = self.get_adu_per_sec(vegamag,BandPass,airmass)
+        exptime = max_adu_per_pixel/(adu_per_sec*p.peak_fraction)
+        star_adu = adu_per_sec*exptime
+        sky_mag_per_arcsec = self._resolve_sky_mag(BandPass,sky_mag_per_arcsec,airmass)
+        sky_adu_per_pixel = self.get_adu_per_sec(sky_mag_per_arcsec,BandPass)*exptime*(self.plt_scale*binning)**2.
+        ap_radius, rel_error = p.optimal_aperture(star_adu,sky_adu_per_pixel,self.dark_noise,self.read_noise,self.gain)
+        return OrderedDict([('exptime',exptime),
+                            ('ap_radius',ap_radius),
+                            ('encircled_energy',p.encircled_energy(ap_radius)),
+                            ('photometric_noise',rel_error*1e6)])
+
+    def _calc_err_cad(self,
+                      adu_per_sec_zp,
+                      vegamag,
+                      max_adu_per_pixel,
+                      binning,
+                      num_ref_stars,
+                      airmass,
+                      read_time,
+                      sky_mag_per_arcsec,
+                      diffuser_fwhm_pix=None,
+                      transmission=1.):
+        """
+        Elementwise photometric error and cadence calculation behind get_err_cad_for_adu() and get_err_cad_grid()
+
+        INPUT:
+            adu_per_sec_zp - ADU count rate of a vegamag=0 star in the bandpass of the observation
+            diffuser_fwhm_pix - unbinned diffuser FWHM in pixels, default is self.diffuser_fwhm_pix
+            transmission   - atmospheric transmission of the star flux, see get_atmospheric_transmission()
+            see get_err_cad_for_adu() for the rest, all of which can be arrays that broadcast against each other
+
+        OUTPUT:
+            OrderedDict with the cadence, counts and all of the noise terms
         """
-        diffuser_fwhm_pix = self.diffuser_fwhm_pix/binning
-        diffuser_fwhm_total_npix = self.diffuser_fwhm_total_npix/(binning**2.) # Total number of pixels in aperture
+        if diffuser_fwhm_pix is None:
+            diffuser_fwhm_pix_unbinned = self.diffuser_fwhm_pix
+            diffuser_fwhm_total_npix_unbinned = self.diffuser_fwhm_total_npix
+            diffuser_fwhm_arcsec = self.diffuser_fwhm_arcsec
+        else:
+            diffuser_fwhm_pix_unbinned = np.asarray(diffuser_fwhm_pix,dtype=float)
+            diffuser_fwhm_total_npix_unbinned = np.pi*(diffuser_fwhm_pix_unbinned/2.)**2.0
+            diffuser_fwhm_arcsec = diffuser_fwhm_pix_unbinned*self.plt_scale
+        binning = np.asarray(binning,dtype=float)
+        diffuser_fwhm_pix = diffuser_fwhm_pix_unbinned/binning
+        diffuser_fwhm_total_npix = diffuser_fwhm_total_npix_unbinned/(binning**2.) # Total number of pixels in aperture
 
         # Reference star factor, assuming all refstars are same flux as target star
-        refstar_factor = np.sqrt(1.+1./num_ref_stars)
+        refstar_factor = np.sqrt(1.+1./np.asarray(num_ref_stars,dtype=float))
 
         # Apertures and annuli
         ap_r = diffuser_fwhm_pix/2.
@@ -264,14 +657,15 @@ class Telescope(object):
         n_b   = (ap_annul_2**2.-ap_annul_1**2.)*np.pi #number of background pixels
 
         # Get exptime
-        exptime = self.get_exptime_for_adu(vegamag,BandPass,max_adu_per_pixel,binning)
+        adu_per_sec = adu_per_sec_zp*transmission*10.**(-0.4*np.asarray(vegamag,dtype=float))
+        exptime = n_pix*max_adu_per_pixel/adu_per_sec
 
         # Total ADU counts
         star_adu = max_adu_per_pixel * n_pix
 
-        # Sky signal, assume sky magnitude is given as mag/arcsec2
-        sky_adu_per_arcsec2 = self.get_adu_per_sec(sky_mag_per_arcsec,BandPass) * exptime
-        sky_adu = sky_adu_per_arcsec2*np.pi*(self.diffuser_fwhm_arcsec/2.)**2.
+        # Sky signal, assume sky magnitude is given as mag/arcsec2 as observed, so no extinction is applied
+        sky_adu_per_arcsec2 = adu_per_sec_zp*10.**(-0.4*np.asarray(sky_mag_per_arcsec,dtype=float)) * exptime
+        sky_adu = sky_adu_per_arcsec2*np.pi*(diffuser_fwhm_arcsec/2.)**2.
         sky_adu_per_pixel = sky_adu/n_pix
 
         # photon noise in ppm, just calculate this as a reference
@@ -300,32 +694,401 @@ class Telescope(object):
         tot_noise_in_1_min = tot_noise/np.sqrt(num_exp_in_1_min)
         tot_noise_in_30_min = tot_noise/np.sqrt(num_exp_in_30_min)
 
+        return OrderedDict([('exptime',exptime),
+                            ('cadence',cadence),
+                            ('efficiency',exptime/cadence),
+                            ('n_pix',n_pix),
+                            ('n_b',n_b),
+                            ('star_adu',star_adu),
+                            ('sky_adu',sky_adu),
+                            ('sky_adu_per_pixel',sky_adu_per_pixel),
+                            ('photometric_noise',photometric_noise),
+                            ('photon_noise',photon_noise),
+                            ('scint_noise',scint_noise),
+                            ('tot_noise',tot_noise),
+                            ('tot_noise_in_1_min',tot_noise_in_1_min),
+                            ('tot_noise_in_30_min',tot_noise_in_30_min)])
+
+    def get_err_cad_for_adu(self,
+                            vegamag,
+                            BandPass,
+                            max_adu_per_pixel=40000.,
+                            binning=2.,
+                            num_ref_stars=1.,
+                            airmass=1.5,
+                            read_time=2.5,
+                            sky_mag_per_arcsec=17.5,
+                            verbose=True):
+        """
+        Calculate the total photometric error and cadence, assuming a top-hat PSF for the self.diffuser_opening_angle.
+
+        This calculates the cadence needed to expose on the telescope to reach a maximum of *max_adu_per_pixel* counts
+        per pixel on the detector, assuming a top-hat diffused PSF.
+
+        INPUT:
+            vegamag           - vegamagnitude in the bandpass supplied
+            BandPass          - pysynphot.BandPass of the observation
+            max_adu_per_pixel - maximum ADU counts per pixel, assumes a top-hat PSF
+            binning           - binning mode used
+            num_ref_stars     - number of equally bright reference stars as the target
+            airmass           - airmass of observation, for scintillation and, if self.extinction is set, extinction
+            read_time         - read time in seconds
+            sky_mag_per_arcsec- sky magnitude of the sky in the full PSF, as observed. None for the dark sky in the
+                                bandpass at the airmass from get_sky_mag(), see sky.SkyModel
+            verbose=True      - if True, print out useful results
+
+        OUTPUT:
+            results.ErrCadResult, which unpacks as (tot_error, cadence):
+            tot_error - total photometric error including: photon, dark, read, sky, digitization and scintillation noise
+            cadence   - total cadence (including read_time) corresponding to the photometric precision returned
+            and has every intermediate value (exptime, n_pix, n_b, sky_adu, noise terms, ...) as attributes
+
+        NOTES:
+            See get_err_cad_grid() to evaluate many parameter combinations at once
+            The time spent in the count rate and arithmetic steps can be recorded with instrumentation.Profiler
+        """
+        t_start = instrumentation.start()
+        adu_per_sec_zp = self._get_adu_per_sec_zeropoint(BandPass)
+        transmission = self.get_atmospheric_transmission(BandPass,airmass)
+        sky_mag_per_arcsec = self._resolve_sky_mag(BandPass,sky_mag_per_arcsec,airmass)
+        instrumentation.stop('flux',t_start)
+        t_start = instrumentation.start()
+        r = self._calc_err_cad(adu_per_sec_zp,
+                               vegamag,
+                               max_adu_per_pixel,
+                               binning,
+                               num_ref_stars,
+                               airmass,
+                               read_time,
+                               sky_mag_per_arcsec,
+                               transmission=transmission)
+        result = ErrCadResult(**r)
+        instrumentation.stop('arithmetic',t_start)
+
         if verbose:
-            print('##### Exptime #####')
-            print('Exptime [s]:                  {:0.3f}'.format(exptime))
-            print('Total cadence [s]:            {:0.3f}'.format(cadence))
-            print('Obs. Efficiency [%]:          {:0.2f}'.format(100.*exptime/cadence))
-            print('npix [pix]:                   {:0.2f}'.format(n_pix))
-            print('n_b [pix]:                    {:0.2f}'.format(n_b))
-            print('')
-            print('##### Counts #####')
-            print('Star counts - Total [adu]:    {:0.2f} '.format(star_adu))
-            print('Star counts - /pix [adu/pix]: {:0.2f} '.format(star_adu/n_pix))
-            print('Sky counts - Total [adu]:     {:0.2f}'.format(sky_adu))
-            print('Sky counts - /pix [adu/pix]:  {:0.2f}'.format(sky_adu_per_pixel))
-            print('')
-            print('##### Noise in exptime={:0.2f}s ######'.format(exptime))
-            print('Photometric noise [ppm]       {:0.2f}'.format(photometric_noise))
-            print('Photon noise [ppm]:           {:0.2f}'.format(photon_noise))
-            print('Scintillation noise [ppm]:    {:0.2f}'.format(scint_noise))
-            print('Total noise [ppm]:            {:0.2f}'.format(tot_noise))
-            print('')
-            print('##### Noise ######')
-            print('Noise in 1min [ppm]:          {:0.2f}'.format(tot_noise_in_1_min))
-            print('Noise in 30min [ppm]:         {:0.2f}'.format(tot_noise_in_30_min))
-            print('#####')
-
-        return tot_noise, cadence
+            print(result.summary())
+
+        return result
+
+    def get_err_cad_grid(self,BandPass,params=None,grid=False,output='dataframe',**kwargs):
+        """
+        Vectorized version of get_err_cad_for_adu() for sweeping many parameter combinations in one pass.
+
+        The flux backend (pysynphot by default) is only called once per call, and the extinction (if self.extinction
+        is set) is interpolated from a precomputed airmass table, all other calculations are elementwise NumPy operations.
+
+        INPUT:
+            BandPass - pysynphot.BandPass of the observation
+            params   - pandas.DataFrame (or dict of arrays) with columns named after the parameters of get_err_cad_for_adu()
+                       (vegamag, max_adu_per_pixel, binning, num_ref_stars, airmass, read_time, sky_mag_per_arcsec)
+            grid     - if True, evaluate the Cartesian product of the keyword arrays, instead of broadcasting them
+            output   - 'dataframe' to return a pandas.DataFrame, 'records' to return a numpy record array
+            **kwargs - any of the parameters above as scalars or arrays, overrides columns in *params*.
+                       Parameters not given in *params* or **kwargs take the get_err_cad_for_adu() defaults.
+                       None or NaN values of sky_mag_per_arcsec are replaced by the dark sky from get_sky_mag()
+
+        OUTPUT:
+            pandas.DataFrame (or record array) with one row per parameter combination, with the input parameters and columns for
+            exptime, cadence, efficiency, n_pix, n_b, star_adu, sky_adu, sky_adu_per_pixel, photometric_noise,
+            photon_noise, scint_noise, tot_noise, tot_noise_in_1_min and tot_noise_in_30_min
+
+        EXAMPLE:
+            arc = TelescopeARC()
+            ifilt = S.FileBandpass(arc.FILTER_DICT['sloan_i_filter.txt'])
+            df = arc.get_err_cad_grid(ifilt,vegamag=np.arange(8.,16.,0.1),binning=[1,2,4],airmass=[1.,1.5,2.],grid=True)
+        """
+        if output not in ('dataframe','records'):
+            raise ValueError("output has to be 'dataframe' or 'records'")
+        unknown = set(kwargs) - set(ERR_CAD_DEFAULTS)
+        if unknown:
+            raise TypeError('Unknown parameters: {}'.format(', '.join(sorted(unknown))))
+        if params is None:
+            params = {}
+        elif grid:
+            raise ValueError('grid=True can only be used with keyword arrays, not with params')
+        index = getattr(params,'index',None)
+        values = OrderedDict()
+        for key in ERR_CAD_DEFAULTS:
+            if key in kwargs:
+                values[key] = np.asarray(kwargs[key],dtype=float)
+            elif key in params:
+                values[key] = np.asarray(params[key],dtype=float)
+            else:
+                values[key] = np.asarray(ERR_CAD_DEFAULTS[key],dtype=float)
+        # NaN magnitudes are valid input (they give NaN results), only a missing vegamag is an error
+        if 'vegamag' not in kwargs and 'vegamag' not in params:
+            raise ValueError('vegamag has to be supplied, either in params or as a keyword')
+
+        if grid:
+            mesh = np.meshgrid(*[np.atleast_1d(v) for v in values.values()],indexing='ij')
+            values = OrderedDict((key,m.ravel()) for key,m in zip(values,mesh))
+        else:
+            broadcast = np.broadcast_arrays(*[np.atleast_1d(v) for v in values.values()])
+            values = OrderedDict((key,b.ravel()) for key,b in zip(values,broadcast))
+
+        t_start = instrumentation.start()
+        adu_per_sec_zp = self._get_adu_per_sec_zeropoint(BandPass)
+        transmission = self.get_atmospheric_transmission(BandPass,values['airmass'])
+        values['sky_mag_per_arcsec'] = self._resolve_sky_mag(BandPass,values['sky_mag_per_arcsec'],values['airmass'])
+        instrumentation.stop('flux',t_start)
+        t_start = instrumentation.start()
+        r = self._calc_err_cad(adu_per_sec_zp,transmission=transmission,**values)
+        nrows = len(values['vegamag'])
+        for key in r:
+            values[key] = np.array(np.broadcast_to(r[key],nrows))
+        instrumentation.stop('arithmetic',t_start)
+        if output=='records':
+            return to_records(values)
+        import pandas as pd
+        return pd.DataFrame(values,index=index)
+
+    def get_field_err_cad(self,
+                          target_mag,
+                          ref_mags,
+                          BandPass,
+                          target_color=0.,
+                          ref_colors=0.,
+                          color_term=0.,
+                          max_adu_per_pixel=40000.,
+                          binning=2.,
+                          airmass=1.5,
+                          read_time=2.5,
+                          sky_mag_per_arcsec=17.5,
+                          weighting='optimal'):
+        """
+        Differential photometric precision of a target against an ensemble of real reference stars in a shared exposure.
+
+        All stars in the field are observed with the same exposure time, set by the brightest star reaching
+        *max_adu_per_pixel* in the top-hat diffused PSF. The noise of each star is then calculated with its own counts,
+        and the reference stars are combined into an ensemble, so unlike get_err_cad_for_adu() the references do not
+        have to be copies of the target.
+
+        INPUT:
+            target_mag         - vegamagnitude of the target in the bandpass supplied, float or array of shape (...)
+                                 for many fields at once
+            ref_mags           - vegamagnitudes of the reference stars, array of shape (..., nref) with nref >= 1.
+                                 Use NaN to pad fields with fewer references
+            BandPass           - pysynphot.BandPass of the observation
+            target_color, ref_colors - colors of the target and references (e.g., catalog g-i), same shapes as the mags
+            color_term         - magnitudes in the bandpass are mag + color_term*color, e.g., to convert catalog
+                                 magnitudes from another band. Default is 0, mags are already in the bandpass
+            max_adu_per_pixel, binning, airmass, read_time, sky_mag_per_arcsec - see get_err_cad_for_adu(), scalars or
+                                 arrays of shape (...)
+            weighting          - 'optimal' to weight the references by their inverse variance, or 'flux' for a summed
+                                 flux (unweighted) comparison star as in e.g. AstroImageJ
+
+        OUTPUT:
+            OrderedDict with, for each field (shape (...)):
+                exptime, cadence  - shared exposure time and cadence in s
+                limiting_star     - index of the star that sets the exposure time, 0 is the target and i>0 is ref i-1
+                ensemble_noise    - noise of the weighted reference ensemble in ppm
+                tot_noise         - differential noise of the target in ppm, sqrt(target_noise**2+ensemble_noise**2)
+                tot_noise_in_1_min, tot_noise_in_30_min - tot_noise binned to 1 and 30 min
+            and for each star (shape (..., 1+nref), target first):
+                star_adu          - counts in ADU
+                photometric_noise - photon, sky, dark, read and digitization noise in ppm
+                scint_noise       - scintillation noise in ppm
+                star_noise        - total noise of each star in ppm
+                weights           - ensemble weights, 0 for the target and padded references
+
+        NOTES:
+            With nref references of the same magnitude as the target this equals get_err_cad_for_adu() with
+            num_ref_stars=nref. Scintillation is taken as uncorrelated between the stars.
+            Everything is evaluated in one vectorized pass with a single count rate from the flux backend.
+
+        EXAMPLE:
+            arc = TelescopeARC()
+            r = arc.get_field_err_cad(12.,[11.2,12.5,13.1,13.8],arc.get_bandpass('sloan_i_filter.txt'),binning=2)
+            r['tot_noise'], r['exptime'], r['weights']
+        """
+        if weighting not in ('optimal','flux'):
+            raise ValueError("weighting has to be 'optimal' or 'flux'")
+        target = (np.asarray(target_mag,dtype=float)+color_term*np.asarray(target_color,dtype=float))[...,None]
+        refs = np.atleast_1d(np.asarray(ref_mags,dtype=float)+color_term*np.asarray(ref_colors,dtype=float))
+        if refs.shape[-1]==0:
+            raise ValueError('ref_mags has to have at least one reference star')
+        shape = np.broadcast(target[...,0],refs[...,0],np.asarray(max_adu_per_pixel),np.asarray(binning),
+                             np.asarray(airmass),np.asarray(read_time),np.asarray(sky_mag_per_arcsec,dtype=float)).shape
+        mags = np.concatenate([np.broadcast_to(target,shape+(1,)),np.broadcast_to(refs,shape+refs.shape[-1:])],axis=-1)
+        if not np.isfinite(mags[...,0]).all():
+            raise ValueError('target_mag has to be finite')
+        valid = np.isfinite(mags)
+        max_adu_per_pixel = np.asarray(max_adu_per_pixel,dtype=float)
+        binning = np.asarray(binning,dtype=float)
+        airmass = np.asarray(airmass,dtype=float)
+
+        adu_per_sec_zp = self._get_adu_per_sec_zeropoint(BandPass)
+        transmission = self.get_atmospheric_transmission(BandPass,airmass)
+        sky_mag_per_arcsec = self._resolve_sky_mag(BandPass,sky_mag_per_arcsec,airmass)
+
+        # Apertures and annuli, as in _calc_err_cad()
+        ap_r = self.diffuser_fwhm_pix/binning/2.
+        n_pix = self.diffuser_fwhm_total_npix/(binning**2.)
+        n_b = ((ap_r*2.0)**2.-(ap_r*1.5)**2.)*np.pi
+
+        # Shared exposure time from the brightest star
+        adu_per_sec = adu_per_sec_zp*np.asarray(transmission)[...,None]*10.**(-0.4*np.where(valid,mags,np.inf))
+        limiting_star = np.argmax(adu_per_sec,axis=-1)
+        exptime = n_pix*max_adu_per_pixel/np.max(adu_per_sec,axis=-1)
+        star_adu = adu_per_sec*exptime[...,None]
+
+        sky_adu = adu_per_sec_zp*10.**(-0.4*np.asarray(sky_mag_per_arcsec,dtype=float))*exptime*np.pi*(self.diffuser_fwhm_arcsec/2.)**2.
+        sky_adu_per_pixel = sky_adu/n_pix
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            photometric_noise = photometry.phot_error(star_adu,
+                                                      np.asarray(n_pix)[...,None],
+                                                      np.asarray(n_b)[...,None],
+                                                      np.asarray(sky_adu_per_pixel)[...,None],
+                                                      dark=self.dark_noise,
+                                                      read=self.read_noise,
+                                                      gain=self.gain)/star_adu
+        scint_noise = np.broadcast_to(photometry.scintillation_noise(self.diameter,airmass,exptime,self.altitude,
+                                                                     withextra=True)[...,None],mags.shape)
+        star_noise = np.where(valid,np.sqrt(photometric_noise**2.+scint_noise**2.),np.nan)
+
+        # Ensemble weights of the references
+        is_ref = valid.copy()
+        is_ref[...,0] = False
+        if weighting=='optimal':
+            weights = np.where(is_ref,1./np.where(is_ref,star_noise,1.)**2.,0.)
+        else:
+            weights = np.where(is_ref,star_adu,0.)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            weights = weights/np.sum(weights,axis=-1,keepdims=True)
+            ensemble_noise = np.sqrt(np.sum(np.where(is_ref,(weights*star_noise)**2.,0.),axis=-1))
+        ensemble_noise = np.where(is_ref.any(axis=-1),ensemble_noise,np.inf)
+        tot_noise = np.sqrt(star_noise[...,0]**2.+ensemble_noise**2.)*1e6
+
+        cadence = exptime + np.asarray(read_time,dtype=float)
+        return OrderedDict([('exptime',exptime),
+                            ('cadence',cadence),
+                            ('limiting_star',limiting_star),
+                            ('ensemble_noise',ensemble_noise*1e6),
+                            ('tot_noise',tot_noise),
+                            ('tot_noise_in_1_min',tot_noise/np.sqrt(60./cadence)),
+                            ('tot_noise_in_30_min',tot_noise/np.sqrt(1800./cadence)),
+                            ('star_adu',np.where(valid,star_adu,np.nan)),
+                            ('photometric_noise',np.where(valid,photometric_noise*1e6,np.nan)),
+                            ('scint_noise',np.where(valid,scint_noise*1e6,np.nan)),
+                            ('star_noise',star_noise*1e6),
+                            ('weights',np.where(is_ref,weights,0.))])
+
+    def optimize_diffuser(self,
+                          vegamag,
+                          BandPass,
+                          diffuser_angles=None,
+                          binnings=(1.,2.,4.),
+                          max_adu_per_pixels=(10000.,20000.,30000.,40000.),
+                          time_window=1800.,
+                          num_ref_stars=1.,
+                          airmass=1.5,
+                          read_time=2.5,
+                          sky_mag_per_arcsec=17.5,
+                          diffuser_dist_from_detector=None,
+                          max_elements=2000000):
+        """
+        Find the diffuser angle, binning and max_adu_per_pixel that minimize the noise in a fixed time window.
+
+        The count rate in the bandpass is calculated once with the flux backend. Everything that depends on the diffuser
+        angle only enters through the diffuser FWHM (see diffuser.calculate_diffuser_fwhm()), so the noise is
+        evaluated on the full (star, angle, binning, max_adu_per_pixel) grid with NumPy. The best angle per star is
+        then refined by fitting a parabola through the grid minimum and its two neighbours.
+
+        INPUT:
+            vegamag            - vegamagnitude(s) of the star(s) in the bandpass supplied, float or array
+            BandPass           - pysynphot.BandPass of the observation
+            diffuser_angles    - diffuser opening angles in degrees to search, default is 0.05-2.0deg in 0.01deg steps
+            binnings           - binning modes to search
+            max_adu_per_pixels - maximum ADU counts per pixel to search
+            time_window        - time window in s to minimize the noise over, e.g., 1800. for 30min. Grid points with
+                                 a cadence longer than the time window are excluded
+            num_ref_stars, airmass, read_time, sky_mag_per_arcsec - see get_err_cad_for_adu()
+            diffuser_dist_from_detector - distance of diffuser from detector in mm, default is self.diffuser_dist_from_detector
+            max_elements       - stars are processed in chunks so that each chunk evaluates at most this many grid points
+
+        OUTPUT:
+            best  - pandas.DataFrame with one row per star with the vegamag, optimal diffuser_angle, binning,
+                    max_adu_per_pixel, diffuser_fwhm_pix, exptime, cadence, tot_noise and noise_in_window (ppm).
+                    noise_in_window is inf for stars where no grid point fits in the time window
+            curve - pandas.DataFrame of the noise in the time window (ppm) vs diffuser angle (index), minimized over
+                    binning and max_adu_per_pixel, with one column per star. inf where no exposure fits in the window
+
+        EXAMPLE:
+            arc = TelescopeARC()
+            best, curve = arc.optimize_diffuser([10.,12.,14.],arc.get_bandpass('sloan_i_filter.txt'),airmass=1.3)
+        """
+        import pandas as pd
+        if diffuser_angles is None:
+            diffuser_angles = np.arange(0.05,2.0+1e-9,0.01)
+        if diffuser_dist_from_detector is None:
+            diffuser_dist_from_detector = self.diffuser_dist_from_detector
+        vegamag = np.atleast_1d(np.asarray(vegamag,dtype=float))
+        angles = np.asarray(diffuser_angles,dtype=float)
+        binnings = np.asarray(binnings,dtype=float)
+        max_adus = np.asarray(max_adu_per_pixels,dtype=float)
+        adu_per_sec_zp = self._get_adu_per_sec_zeropoint(BandPass)
+        transmission = self.get_atmospheric_transmission(BandPass,airmass)
+        sky_mag_per_arcsec = self._resolve_sky_mag(BandPass,sky_mag_per_arcsec,airmass)
+
+        def window_noise(mag,angle,binning,max_adu):
+            fwhm = diffuser.calculate_diffuser_fwhm(angle,diffuser_dist_from_detector,self.pix_size)
+            r = self._calc_err_cad(adu_per_sec_zp,mag,max_adu,binning,num_ref_stars,airmass,read_time,
+                                   sky_mag_per_arcsec,diffuser_fwhm_pix=fwhm,transmission=transmission)
+            # Grid points where a single exposure does not fit in the time window are excluded
+            noise = np.where(r['cadence']<=time_window,r['tot_noise']/np.sqrt(time_window/r['cadence']),np.inf)
+            return noise, r
+
+        # Grid axes: (star, angle, binning, max_adu)
+        nper = max(1,int(max_elements//(len(angles)*len(binnings)*len(max_adus))))
+        curve = np.empty((len(vegamag),len(angles)))
+        best_a = np.empty(len(vegamag),dtype=int)
+        best_b = np.empty(len(vegamag),dtype=int)
+        best_m = np.empty(len(vegamag),dtype=int)
+        for start in range(0,len(vegamag),nper):
+            sl = slice(start,start+nper)
+            noise, _ = window_noise(vegamag[sl,None,None,None],angles[None,:,None,None],
+                                    binnings[None,None,:,None],max_adus[None,None,None,:])
+            curve[sl] = noise.min(axis=(2,3))
+            flat = noise.reshape(noise.shape[0],-1).argmin(axis=1)
+            best_a[sl], best_b[sl], best_m[sl] = np.unravel_index(flat,noise.shape[1:])
+
+        # Parabolic refinement around the grid minimum, for minima that are not at the edge of the grid
+        best_angle = angles[best_a]
+        inner = (best_a>0) & (best_a<len(angles)-1)
+        if inner.any() and len(angles)>=3:
+            i = best_a[inner]
+            x0, x1, x2 = angles[i-1], angles[i], angles[i+1]
+            y0, y1, y2 = [window_noise(vegamag[inner],x,binnings[best_b[inner]],max_adus[best_m[inner]])[0]
+                          for x in (x0,x1,x2)]
+            denom = (x0-x1)*(x0-x2)*(x1-x2)
+            with np.errstate(divide='ignore',invalid='ignore'):
+                a = (x2*(y1-y0)+x1*(y0-y2)+x0*(y2-y1))/denom
+                b = (x2*x2*(y0-y1)+x1*x1*(y2-y0)+x0*x0*(y1-y2))/denom
+                vertex = np.where(a>0,-b/(2.*a),x1)
+            best_angle[inner] = np.clip(vertex,x0,x2)
+
+        noise, r = window_noise(vegamag,best_angle,binnings[best_b],max_adus[best_m])
+        # Keep the grid angle if the refined angle is not better, e.g., when it no longer fits in the time window
+        grid_noise, grid_r = window_noise(vegamag,angles[best_a],binnings[best_b],max_adus[best_m])
+        worse = ~(noise<=grid_noise)
+        if worse.any():
+            best_angle[worse] = angles[best_a][worse]
+            noise = np.where(worse,grid_noise,noise)
+            r = OrderedDict((key,np.where(worse,grid_r[key],value) if np.ndim(value) else value) for key,value in r.items())
+        best = pd.DataFrame(OrderedDict([('vegamag',vegamag),
+                                         ('diffuser_angle',best_angle),
+                                         ('binning',binnings[best_b]),
+                                         ('max_adu_per_pixel',max_adus[best_m]),
+                                         ('diffuser_fwhm_pix',diffuser.calculate_diffuser_fwhm(best_angle,
+                                                                                               diffuser_dist_from_detector,
+                                                                                               self.pix_size)),
+                                         ('exptime',r['exptime']),
+                                         ('cadence',r['cadence']),
+                                         ('tot_noise',r['tot_noise']),
+                                         ('noise_in_window',noise)]))
+        curve = pd.DataFrame(curve.T,index=pd.Index(angles,name='diffuser_angle'))
+        return best, curve
 
 # -------------------------------------------------------------------------------------------
 # -------------------------------------------------------------------------------------------
@@ -339,7 +1102,7 @@ class TelescopeARC(Telescope):
         Inherits Telescope()
         Can use this as a blueprint to create different classes that implement other telescopes
     """
-    qe_file = Telescope.FILTER_DICT['arctic_qe.txt']
+    qe_file = os.path.join(Telescope.FILTER_DIRNAME,'arctic_qe.txt')
     def __init__(self):
         # Transmission / reflectivity of different elements to calculate throughput
         _e_diff         = 0.90 # transmission
@@ -361,8 +1124,8 @@ class TelescopeARC(Telescope):
                            read_noise=3.7,           #e^2
                            altitude=2788.,           #m
                            central_obstruction=0.09, # from 0 to 1
-                           QE=S.FileBandpass(self.qe_file), 
-                           Throughput=S.UniformTransmission(_tot_throughput),
+                           QE=self.qe_file,
+                           Throughput=_tot_throughput,
                            diffuser_angle = 0.34,
                            diffuser_dist_from_detector = 200.)    # from 0 to 1
 
@@ -383,6 +1146,7 @@ class TelescopePSUCDK24(Telescope):
     _e_mirr         = 0.96*0.96
     _e_atmosphere   = 0.5 # fudgefactor for atmosphere, assume 50%
     _tot_throughput = _e_diff*_e_lens*_e_mirr*_e_atmosphere
+    qe_file = os.path.join(Telescope.FILTER_DIRNAME,'arctic_qe.txt') # Lets just use the same as for ARCTIC for now
     def __init__(self):
         Telescope.__init__(self,
                            name='PSU 0.6m',           #Name of the telescope
@@ -398,7 +1162,7 @@ class TelescopePSUCDK24(Telescope):
                            read_noise=18.,            #e^2
                            altitude=359.,             #m
                            central_obstruction=0.47,  # from 0 to 1
-                           QE=S.FileBandpass(self.qe_file), # Lets just use the same as for ARCTIC for now
-                           Throughput=S.UniformTransmission(_tot_throughput),
+                           QE=self.qe_file,
+                           Throughput=self._tot_throughput,
                            diffuser_angle = 0.34,
                            diffuser_dist_from_detector = 53.)    # from 0 to 1
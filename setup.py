@@ -12,6 +12,9 @@ setup(name='idiffuse',
       author='Gudmundur Stefansson',
       author_email='gummiks@gmail.com',
       install_requires=['pysynphot','pandas>0.20.0','numpy>1.11','matplotlib>1.5.3'],
+      extras_require={'parquet': ['pyarrow'], 'hdf5': ['tables']},
+      entry_points={'console_scripts': ['idiffuse-catalog=idiffuse.catalog:main',
+                                          'idiffuse-server=idiffuse.server:main']},
       packages=['idiffuse'],
       license='GPLv3',
       classifiers=['Topic :: Scientific/Engineering :: Astronomy'],
@@ -0,0 +1,15 @@
+from __future__ import print_function
+import pytest
+from idiffuse import backends, filter_registry
+from idiffuse.telescope import TelescopeARC
+
+# NumpyBackend vs PysynphotBackend, see the NumpyBackend notes (measured up to 0.013% for semrock_857_30.txt)
+RTOL = 5e-4
+
+@pytest.mark.parametrize('filter_name',sorted(filter_registry.registry))
+def test_numpy_backend_matches_pysynphot(filter_name):
+    tel = TelescopeARC()
+    elements = tel._get_elements(filter_registry.registry.get_curve(filter_name))
+    expected = backends.get_backend('pysynphot').countrate_per_cm2(elements)
+    result = backends.get_backend('numpy').countrate_per_cm2(elements)
+    assert result == pytest.approx(expected,rel=RTOL)
@@ -0,0 +1,63 @@
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+import pytest
+from idiffuse import catalog
+from idiffuse.telescope import TelescopeARC
+
+FILTER = 'sloan_i_filter.txt'
+
+def test_ab_column_matches_vega_magnitude(tmp_path):
+    offset = catalog.to_vegamag(0.,FILTER,'AB')
+    assert -0.45 < offset < -0.3
+    imag = np.array([10.,12.,14.])
+    pd.DataFrame({'imag':imag}).to_csv(str(tmp_path/'ab.csv'),index=False)
+    pd.DataFrame({'vegamag':imag+offset}).to_csv(str(tmp_path/'vega.csv'),index=False)
+    tel = TelescopeARC()
+    for name in ('ab','vega'):
+        catalog.process_catalog(str(tmp_path/'{}.csv'.format(name)),str(tmp_path/'{}_out.csv'.format(name)),tel=tel,
+                                filter_name=FILTER,binning=2,verbose=False)
+    ab = pd.read_csv(str(tmp_path/'ab_out.csv'))
+    vega = pd.read_csv(str(tmp_path/'vega_out.csv'))
+    np.testing.assert_allclose(ab[catalog.OUTPUT_COLUMNS].values,vega[catalog.OUTPUT_COLUMNS].values)
+    expected = tel.get_err_cad_for_adu(12.+offset,tel.get_bandpass(FILTER),binning=2)
+    assert ab['tot_noise'][1] == pytest.approx(expected.tot_noise)
+
+def test_unknown_column_needs_mag_system():
+    df = pd.DataFrame({'mymag':[12.]})
+    with pytest.raises(ValueError):
+        catalog.catalog_vegamag(df,FILTER,'mymag')
+    assert catalog.catalog_vegamag(df,FILTER,'mymag','vega')[0] == 12.
+
+def test_gaia_columns():
+    df = pd.DataFrame({'phot_g_mean_mag':[12.,12.],'phot_bp_mean_mag':[12.4,14.],'phot_rp_mean_mag':[11.4,10.]})
+    assert catalog.find_mag_column(df.columns,'bess-v.txt') == 'phot_g_mean_mag'
+    v = catalog.catalog_vegamag(df,'bess-v.txt')
+    # G-V = -0.02704+0.01424-0.2156+0.01426 at BP-RP=1, BP-RP=4 is outside of the color range
+    assert v[0] == pytest.approx(12.+0.02704-0.01424+0.2156-0.01426)
+    assert np.isnan(v[1])
+    with pytest.raises(ValueError):
+        catalog.find_mag_column(df.columns,'sloan_z_filter.txt')
+
+def test_parquet_output_with_changing_column_types(tmp_path):
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({'vegamag':[10.,11.,12.,13.],'comment':['a',None,None,None]})
+    df.to_csv(str(tmp_path/'in.csv'),index=False)
+    catalog.process_catalog(str(tmp_path/'in.csv'),str(tmp_path/'out.parquet'),filter_name=FILTER,chunksize=2,
+                            verbose=False)
+    out = pd.read_parquet(str(tmp_path/'out.parquet'))
+    assert len(out) == 4
+    assert list(out['comment'][:1]) == ['a']
+
+def test_failed_run_leaves_no_output(tmp_path):
+    pd.DataFrame({'vegamag':[10.,11.,12.]}).to_csv(str(tmp_path/'in.csv'),index=False)
+    with pytest.raises(KeyError):
+        catalog.process_catalog(str(tmp_path/'in.csv'),str(tmp_path/'out.csv'),mag_column='missing',verbose=False)
+    assert list(tmp_path.iterdir()) == [tmp_path/'in.csv']
+
+def test_main_reports_missing_magnitude_column(tmp_path,capsys):
+    pd.DataFrame({'Tmag':[10.]}).to_csv(str(tmp_path/'in.csv'),index=False)
+    with pytest.raises(SystemExit) as e:
+        catalog.main([str(tmp_path/'in.csv'),str(tmp_path/'out.csv')])
+    assert e.value.code == 2
+    assert 'No magnitude column' in capsys.readouterr().err
@@ -0,0 +1,37 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+from idiffuse.design import explore, ResultStore, PARAM_COLUMNS
+
+FILTER = 'sloan_i_filter.txt'
+
+def _explore(path,angles):
+    return explore(path,telescopes=('arc',),filters=[FILTER],processes=1,progress=False,diffuser_angle=angles,
+                   binning=[1,2],vegamag=[10.,12.])
+
+@pytest.mark.parametrize('name',['store.parquet','store.h5'])
+def test_rerun_with_equivalent_grid_computes_nothing(tmp_path,name):
+    pytest.importorskip('pyarrow' if name.endswith('.parquet') else 'tables')
+    path = str(tmp_path/name)
+    stats = _explore(path,np.arange(0.1,0.51,0.1))
+    assert stats['computed'] == 20
+    # 0.3 from np.arange and np.linspace differ in the last bits
+    stats = _explore(path,np.linspace(0.1,0.7,7))
+    assert stats['computed'] == 8
+    assert stats['skipped'] == 20
+    store = ResultStore(path)
+    assert len(store) == 28
+    stats = _explore(path,np.linspace(0.1,0.7,7))
+    assert stats['computed'] == 0
+    assert len(store) == 28
+    df = store.read()
+    assert not df.duplicated(list(PARAM_COLUMNS)).any()
+
+def test_pareto_front():
+    import pandas as pd
+    from idiffuse.design import pareto_front
+    df = pd.DataFrame({'noise':[1.,2.,3.,1.5,4.],'efficiency':[0.5,0.8,0.9,0.4,0.85],'g':['a','a','a','a','b']})
+    front = pareto_front(df,'noise','efficiency',minimize=(True,False))
+    assert list(front['noise']) == [1.,2.,3.]
+    front = pareto_front(df,'noise','efficiency',minimize=(True,False),by=['g'])
+    assert list(front['noise']) == [1.,2.,3.,4.]
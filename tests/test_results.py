@@ -0,0 +1,21 @@
+from __future__ import print_function
+import numpy as np
+from idiffuse.telescope import TelescopeARC
+
+FILTER = 'sloan_i_filter.txt'
+
+def test_array_vegamag_repr_and_summary():
+    tel = TelescopeARC()
+    bp = tel.get_bandpass(FILTER)
+    res = tel.get_err_cad_for_adu(np.array([10.,13.8]),bp,binning=4,verbose=False)
+    text = repr(res)
+    assert text.startswith('ErrCadResult(tot_noise=[')
+    assert '{:0.2f}'.format(res.tot_noise[1]) in text
+    summary = res.summary()
+    assert 'Total noise [ppm]:            [{:0.2f}, {:0.2f}]'.format(*res.tot_noise) in summary
+
+def test_scalar_vegamag_repr_unchanged():
+    tel = TelescopeARC()
+    res = tel.get_err_cad_for_adu(13.8,tel.get_bandpass(FILTER),binning=4,verbose=False)
+    assert repr(res) == 'ErrCadResult(tot_noise={:0.2f}ppm, cadence={:0.3f}s, exptime={:0.3f}s)'.format(res.tot_noise,res.cadence,res.exptime)
+    assert 'Exptime [s]:                  {:0.3f}'.format(res.exptime) in res.summary()
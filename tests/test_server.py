@@ -0,0 +1,123 @@
+from __future__ import print_function
+import json
+import socket
+import threading
+import pytest
+from idiffuse import server as etc_server
+from idiffuse.server import ETCService, ServerThread, ETCClient, RequestError
+
+FILTER = 'sloan_i_filter.txt'
+
+@pytest.fixture(scope='module')
+def client():
+    service = ETCService(instrument_names=['arc','TelescopeARC','Telescope','OrderedDict'],batch_window=0.05)
+    with ServerThread(service) as server:
+        yield ETCClient(server.url)
+
+def test_err_cad_matches_telescope(client):
+    from idiffuse.instruments import get_instrument
+    arc = get_instrument('arc')
+    expected = arc.get_err_cad_for_adu(12.,arc.get_bandpass(FILTER),binning=2)
+    result = client.err_cad(instrument='arc',filter=FILTER,vegamag=12.,binning=2)
+    assert result['tot_noise'] == pytest.approx(expected.tot_noise)
+    assert result['cadence'] == pytest.approx(expected.cadence)
+
+def test_concurrent_requests_are_batched(client):
+    batches = client.health()['stats']['batches']
+    results = [None]*20
+
+    def run(i):
+        results[i] = client.exptime(instrument='arc',filter=FILTER,vegamag=8.+0.1*i)
+    threads = [threading.Thread(target=run,args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(r['exptime'] > 0. for r in results)
+    assert results[0]['exptime'] < results[-1]['exptime']
+    assert client.health()['stats']['batches']-batches < len(results)
+
+def test_list_request_is_one_batch(client):
+    batches = client.health()['stats']['batches']
+    results = client.err_cad([{'instrument':'arc','filter':FILTER,'vegamag':mag} for mag in (10.,11.,12.)])
+    assert len(results) == 3
+    assert client.health()['stats']['batches']-batches == 1
+
+@pytest.mark.parametrize('filter_name',['/etc/passwd','../filters/'+FILTER,'missing_filter.txt'])
+def test_filter_has_to_be_registered(client,filter_name):
+    with pytest.raises(RequestError) as e:
+        client.err_cad(instrument='arc',filter=filter_name,vegamag=12.)
+    assert 'root:' not in str(e.value)
+
+@pytest.mark.parametrize('instrument',['Telescope','OrderedDict','not_an_instrument'])
+def test_instrument_has_to_be_a_telescope(client,instrument):
+    with pytest.raises(RequestError):
+        client.err_cad(instrument=instrument,filter=FILTER,vegamag=12.)
+
+def test_telescope_subclass_is_allowed(client):
+    result = client.exptime(instrument='TelescopeARC',filter=FILTER,vegamag=12.)
+    assert result['exptime'] > 0.
+
+def test_invalid_requests(client):
+    with pytest.raises(RequestError):
+        client.err_cad(instrument='arc',filter=FILTER)
+    with pytest.raises(RequestError):
+        client.err_cad(instrument='arc',filter=FILTER,vegamag='12')
+    with pytest.raises(RequestError):
+        client.err_cad(instrument='arc',filter=FILTER,vegamag=12.,exposure=3.)
+
+@pytest.mark.parametrize('value',[float('nan'),float('inf'),-float('inf'),1e400])
+def test_non_finite_numbers_are_rejected(client,value):
+    with pytest.raises(RequestError):
+        client.err_cad(instrument='arc',filter=FILTER,vegamag=12.,airmass=value)
+
+def test_non_finite_results_are_null():
+    assert etc_server._json_float(float('inf')) is None
+    assert etc_server._json_float(float('nan')) is None
+    assert etc_server._json_float(1.5) == 1.5
+
+def test_invalid_list_entry_queues_nothing(client):
+    stats = client.health()['stats']
+    requests = [{'instrument':'arc','filter':FILTER,'vegamag':mag} for mag in (10.,11.)]
+    with pytest.raises(RequestError):
+        client.err_cad(requests+[{'instrument':'arc','filter':FILTER}])
+    after = client.health()['stats']
+    assert after['requests'] == stats['requests']
+    assert after['batches'] == stats['batches']
+
+@pytest.mark.parametrize('length',['abc','-5','1.5'])
+def test_invalid_content_length(client,length):
+    host, port = client.url.split('//')[1].split(':')
+    sock = socket.create_connection((host,int(port)),timeout=10.)
+    try:
+        sock.sendall('POST /err_cad HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(length).encode('latin-1'))
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+    finally:
+        sock.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 400')
+    assert 'Content-Length' in json.loads(body.decode('utf-8'))['error']
+
+def test_internal_errors_are_not_returned(monkeypatch):
+    def fail(*args,**kwargs):
+        raise ValueError('/secret/path could not be read')
+    service = ETCService(instrument_names=['arc'])
+    monkeypatch.setattr(service,'_evaluate',fail)
+    with ServerThread(service) as server:
+        with pytest.raises(RuntimeError) as e:
+            ETCClient(server.url).err_cad(instrument='arc',filter=FILTER,vegamag=12.)
+    assert '500' in str(e.value)
+    assert 'secret' not in str(e.value)
+
+def test_non_finite_responses_are_not_sent(monkeypatch):
+    service = ETCService(instrument_names=['arc'])
+    monkeypatch.setattr(service,'_evaluate',lambda *args: [{'exptime': float('nan')}])
+    with ServerThread(service) as server:
+        with pytest.raises(RuntimeError) as e:
+            ETCClient(server.url).exptime(instrument='arc',filter=FILTER,vegamag=12.)
+    assert '500' in str(e.value)
@@ -0,0 +1,92 @@
+from __future__ import print_function
+import itertools
+import numpy as np
+import pytest
+from idiffuse.results import ERR_CAD_FIELDS
+from idiffuse.telescope import TelescopeARC
+
+FILTER = 'sloan_i_filter.txt'
+
+@pytest.fixture(scope='module')
+def arc():
+    return TelescopeARC()
+
+def loop_err_cad(tel,bp,rows):
+    results = [tel.get_err_cad_for_adu(row.pop('vegamag'),bp,verbose=False,**row) for row in [dict(r) for r in rows]]
+    return dict((name,np.array([getattr(r,name) for r in results])) for name in ERR_CAD_FIELDS)
+
+def test_err_cad_grid_matches_loop(arc):
+    bp = arc.get_bandpass(FILTER)
+    vegamag = np.array([9.,np.nan,12.5,15.])
+    binning = np.array([1.,2.,4.,2.])
+    airmass = np.array([1.,1.3,2.,1.5])
+    df = arc.get_err_cad_grid(bp,vegamag=vegamag,binning=binning,airmass=airmass,read_time=2.7,sky_mag_per_arcsec=19.7)
+    rows = [dict(vegamag=m,binning=b,airmass=a,read_time=2.7,sky_mag_per_arcsec=19.7)
+            for m,b,a in zip(vegamag,binning,airmass)]
+    expected = loop_err_cad(arc,bp,rows)
+    for name in ERR_CAD_FIELDS:
+        np.testing.assert_allclose(df[name].values,expected[name],rtol=1e-12,equal_nan=True,err_msg=name)
+    assert np.isnan(df['tot_noise'].values[1])
+    assert np.isfinite(df['tot_noise'].values[[0,2,3]]).all()
+
+def test_err_cad_grid_cartesian_product_matches_loop(arc):
+    bp = arc.get_bandpass(FILTER)
+    vegamag = [10.,np.nan,13.8]
+    binning = [1.,4.]
+    num_ref_stars = [1.,3.]
+    df = arc.get_err_cad_grid(bp,vegamag=vegamag,binning=binning,num_ref_stars=num_ref_stars,grid=True)
+    assert len(df) == len(vegamag)*len(binning)*len(num_ref_stars)
+    rows = [dict(vegamag=m,binning=b,num_ref_stars=n) for m,b,n in itertools.product(vegamag,binning,num_ref_stars)]
+    np.testing.assert_allclose(df['vegamag'].values,[row['vegamag'] for row in rows],equal_nan=True)
+    expected = loop_err_cad(arc,bp,rows)
+    for name in ERR_CAD_FIELDS:
+        np.testing.assert_allclose(df[name].values,expected[name],rtol=1e-12,equal_nan=True,err_msg=name)
+
+def fresh_adu_per_sec(bp,**params):
+    tel = TelescopeARC()
+    for name, value in params.items():
+        setattr(tel,name,value)
+    return tel.get_adu_per_sec(0.,bp)
+
+def test_zeropoint_cache_follows_qe_throughput_gain_and_area():
+    import pysynphot as S
+    tel = TelescopeARC()
+    bp = tel.get_bandpass(FILTER)
+    before = tel.get_adu_per_sec(0.,bp)
+    params = dict(QE=S.UniformTransmission(0.8),Throughput=S.UniformTransmission(0.3),gain=3.,diameter=200.)
+    for name, value in params.items():
+        setattr(tel,name,value)
+    after = tel.get_adu_per_sec(0.,bp)
+    assert after != pytest.approx(before)
+    assert after == pytest.approx(fresh_adu_per_sec(bp,**params),rel=1e-12)
+    # A new element with other contents, possibly at the address of a garbage collected one
+    for value in (0.2,0.4):
+        tel.Throughput = S.UniformTransmission(value)
+        expected = fresh_adu_per_sec(bp,**dict(params,Throughput=S.UniformTransmission(value)))
+        assert tel.get_adu_per_sec(0.,bp) == pytest.approx(expected,rel=1e-12)
+
+def test_diffuser_values_follow_inputs():
+    from idiffuse import diffuser
+    tel = TelescopeARC()
+    fwhm_pix = tel.diffuser_fwhm_pix
+    tel.pix_size = 2.*tel.pix_size
+    assert tel.diffuser_fwhm_pix == pytest.approx(fwhm_pix/2.)
+    tel.plt_scale = 3.*tel.plt_scale
+    assert tel.diffuser_fwhm_arcsec == pytest.approx(tel.diffuser_fwhm_pix*tel.plt_scale)
+    tel.diffuser_angle = 2.*tel.diffuser_angle
+    expected = diffuser.calculate_diffuser_fwhm(tel.diffuser_angle,tel.diffuser_dist_from_detector,tel.pix_size)
+    assert tel.diffuser_fwhm_pix == pytest.approx(expected)
+    assert tel.diffuser_fwhm_total_npix == pytest.approx(np.pi*(expected/2.)**2.)
+
+def test_frozen_telescope_rejects_setattr():
+    from idiffuse.instruments import get_instrument
+    arc = get_instrument('arc')
+    fwhm_pix = arc.diffuser_fwhm_pix
+    for name, value in (('pix_size',30.),('gain',1.),('diffuser_angle',0.1)):
+        with pytest.raises(AttributeError):
+            setattr(arc,name,value)
+    assert arc.diffuser_fwhm_pix == fwhm_pix
+    tel = arc.with_params(pix_size=2.*arc.pix_size)
+    assert tel.diffuser_fwhm_pix == pytest.approx(fwhm_pix/2.)
+    tel.gain = 1.
+    assert arc.gain != 1.